@@ -0,0 +1,358 @@
+'''asyncio-based web server for Natural Log.
+
+This serves the routes of ln.server without dedicating an OS thread to each
+connection.  Connections are handled by coroutines on one event loop.
+Ordinary requests are passed to the Flask application on a bounded pool of
+worker threads, since the storage backends block, and their responses are
+sent a chunk at a time as the application produces them.  Continuous
+queries are streamed by coroutines fed from the continuous query scheduler
+of the backend, so open server-sent event streams do not hold a worker
+thread, and one process can serve thousands of them.
+
+Requires Python 3.7 or later.  Only plain HTTP/1.1 is supported, with
+request bodies sent with a Content-Length.
+'''
+
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs, unquote
+
+from flask import request
+
+from ln import server
+
+# Threads for blocking calls into the Flask application and the backend
+DEFAULT_WORKERS = 16
+
+MAX_HEADERS = 100
+
+
+class HTTPError(Exception):
+    '''A request that cannot be handled, answered with ``status``.'''
+
+    def __init__(self, status):
+        super(HTTPError, self).__init__(status)
+        self.status = status
+
+
+async def read_request(reader):
+    '''Read an HTTP request from ``reader``.
+
+    Returns ``(method, target, version, headers, body)``, with header names
+    in lower case, or None if the client closed the connection.
+    '''
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError('400 Bad Request')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HTTPError('431 Request Header Fields Too Large')
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'transfer-encoding' in headers:
+        raise HTTPError('411 Length Required')
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError('400 Bad Request')
+    body = await reader.readexactly(length) if length > 0 else b''
+    return method, target, version, headers, body
+
+
+def make_environ(method, target, version, headers, body, sockname, peername):
+    '''Build the WSGI environment of a request.'''
+    path, _, query_string = target.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote(path, encoding='latin-1'),
+        'QUERY_STRING': query_string,
+        'CONTENT_TYPE': headers.get('content-type', ''),
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_NAME': str(sockname[0]),
+        'SERVER_PORT': str(sockname[1]),
+        'SERVER_PROTOCOL': version,
+        'REMOTE_ADDR': str(peername[0]) if peername else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers.items():
+        if name not in ('content-type', 'content-length'):
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+    return environ
+
+
+def is_continuous_query(environ):
+    '''Is this request a /query without a last time?'''
+    if environ['REQUEST_METHOD'] != 'GET' or environ['PATH_INFO'] != '/query':
+        return False
+    return 'last' not in parse_qs(environ['QUERY_STRING'],
+        keep_blank_values=True)
+
+
+def call_app(environ):
+    '''Run the Flask application on a request.
+
+    Returns ``(status, headers, result)``, where ``result`` is the WSGI
+    iterable of the body, to be read with next_chunk() and then closed.
+    '''
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+
+    result = server.app(environ, start_response)
+    return response[0], response[1], result
+
+
+def next_chunk(chunks):
+    '''Return the next chunk of the iterator ``chunks``, or None at its
+    end.'''
+    return next(chunks, None)
+
+
+def close_result(result):
+    if hasattr(result, 'close'):
+        result.close()
+
+
+def start_continuous_query(environ, callback):
+    '''Check a continuous query and subscribe ``callback`` to its new
+    points.
+
+    Returns either ``(status, headers, body)`` of an error response, or
+    ``(times, values, cancel)`` from ``Backend.subscribe_continuous``.
+    '''
+    with server.app.request_context(environ):
+        error, parsed = server.parse_query_args(request.args)
+        if error is not None:
+            return error.status, error.headers.to_wsgi_list(), \
+                error.get_data()
+        return server.storage_backend.subscribe_continuous(
+            parsed['selectors'], parsed['first_us'], parsed['npoints'],
+            callback, updates=parsed['updates'])
+
+
+def has_length(headers):
+    return any(name.lower() == 'content-length' for name, _ in headers)
+
+
+def format_head(status, headers, keep_alive):
+    lines = ['HTTP/1.1 ' + status]
+    for name, value in headers:
+        if name.lower() != 'connection':
+            lines.append('%s: %s' % (name, value))
+    lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def write_response(writer, status, headers, body, keep_alive):
+    if not has_length(headers):
+        headers = list(headers) + [('Content-Length', str(len(body)))]
+    writer.write(format_head(status, headers, keep_alive) + body)
+
+
+async def stream_response(writer, version, status, headers, result,
+        keep_alive, executor):
+    '''Write a response whose body is the WSGI iterable ``result``.
+
+    Each chunk is read on ``executor`` and sent before the next one is read,
+    so streamed bodies, like long ``/data`` ranges, are never held in memory
+    whole.  Bodies without a Content-Length are sent with chunked transfer
+    encoding, or by closing the connection for HTTP/1.0 clients.
+
+    Returns whether the connection can be kept alive.
+    '''
+    loop = asyncio.get_running_loop()
+    chunked = False
+    if not has_length(headers):
+        if version == 'HTTP/1.1':
+            chunked = True
+            headers = list(headers) + [('Transfer-Encoding', 'chunked')]
+        else:
+            keep_alive = False
+
+    try:
+        writer.write(format_head(status, headers, keep_alive))
+        chunks = iter(result)
+        while True:
+            try:
+                chunk = await loop.run_in_executor(executor, next_chunk,
+                    chunks)
+            except Exception:  # pylint: disable=broad-except
+                # The headers are already sent, so the client can only
+                # tell from the connection closing early.
+                return False
+            if chunk is None:
+                break
+            if len(chunk) == 0:
+                continue  # An empty chunk would end a chunked body
+            if chunked:
+                writer.write(b'%x\r\n' % len(chunk) + chunk + b'\r\n')
+            else:
+                writer.write(chunk)
+            await writer.drain()
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keep_alive
+    finally:
+        await loop.run_in_executor(executor, close_result, result)
+
+
+async def wait_for_close(reader):
+    '''Return once the client has closed its side of the connection,
+    discarding anything else it sends.'''
+    try:
+        while await reader.read(4096):
+            pass
+    except ConnectionError:
+        pass
+
+
+async def stream_continuous_query(environ, reader, writer, executor):
+    '''Answer a continuous query with a stream of server-sent events, until
+    the client goes away.
+
+    The client sends nothing more once the stream starts, so the end of
+    ``reader`` means it has gone away, and the subscription is cancelled
+    right away rather than when the next point fails to send.
+    '''
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue()
+
+    def callback(result):
+        loop.call_soon_threadsafe(results.put_nowait, result)
+
+    try:
+        started = await loop.run_in_executor(executor,
+            start_continuous_query, environ, callback)
+    except Exception:  # pylint: disable=broad-except
+        started = ('500 Internal Server Error', [], b'')
+    if isinstance(started[0], str):
+        write_response(writer, *started, keep_alive=False)
+        await writer.drain()
+        return
+
+    times, values, cancel = started
+    closed = asyncio.ensure_future(wait_for_close(reader))
+    try:
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: text/event-stream; charset=utf-8\r\n'
+            b'Cache-Control: no-cache\r\n'
+            b'Connection: close\r\n\r\n')
+        limit = server.app.config.get('LIMIT_CONTINUOUS', None)
+        count = 0
+        while True:
+            writer.write(server.sse_message(times, values).encode('utf-8'))
+            await writer.drain()
+            count += 1
+            if limit is not None and count >= limit:
+                break
+
+            next_result = asyncio.ensure_future(results.get())
+            try:
+                await asyncio.wait([next_result, closed],
+                    return_when=asyncio.FIRST_COMPLETED)
+                if not next_result.done():
+                    break  # The client went away
+            finally:
+                next_result.cancel()
+            result = next_result.result()
+            if isinstance(result, Exception):
+                break
+            times, values = result
+    finally:
+        cancel()
+        closed.cancel()
+
+
+async def handle_connection(reader, writer, executor):
+    '''Serve the requests sent on one connection.'''
+    loop = asyncio.get_running_loop()
+    sockname = writer.get_extra_info('sockname')
+    peername = writer.get_extra_info('peername')
+    try:
+        while True:
+            try:
+                request_parts = await read_request(reader)
+            except HTTPError as e:
+                write_response(writer, e.status, [], b'', keep_alive=False)
+                await writer.drain()
+                break
+            if request_parts is None:
+                break
+
+            method, target, version, headers, body = request_parts
+            environ = make_environ(method, target, version, headers, body,
+                sockname, peername)
+            if is_continuous_query(environ):
+                await stream_continuous_query(environ, reader, writer,
+                    executor)
+                break
+
+            keep_alive = version == 'HTTP/1.1' and \
+                headers.get('connection', '').lower() != 'close'
+            try:
+                status, response_headers, result = \
+                    await loop.run_in_executor(executor, call_app, environ)
+            except Exception:  # pylint: disable=broad-except
+                write_response(writer, '500 Internal Server Error', [], b'',
+                    keep_alive)
+                await writer.drain()
+            else:
+                keep_alive = await stream_response(writer, version, status,
+                    response_headers, result, keep_alive, executor)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass  # The client went away
+    finally:
+        writer.close()
+
+
+async def start_server(host, port, executor):
+    '''Start serving on ``host`` and ``port``, and return the
+    asyncio.Server.'''
+    return await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, executor),
+        host, port)
+
+
+def run(host, port, workers=DEFAULT_WORKERS):
+    '''Serve ln.server.app until interrupted.
+
+    :param workers: Number of threads for blocking calls into the
+        application and storage backend
+    '''
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def serve():
+        http_server = await start_server(host, port, executor)
+        async with http_server:
+            await http_server.serve_forever()
+
+    print('Serving on http://%s:%d/ with asyncio' % (host, port))
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=False)
@@ -1,5 +1,16 @@
 '''Interface for storage backends.'''
-from ln.backend.exception import BackendError
+from ln.backend.exception import BackendError, BadSelectorError
+from ln.backend.selector import parse_selector, create_selector
+from ln.backend.timestamp import as_epoch_us, now_epoch_us
+from ln.backend.bus import AppendBus
+from ln.backend.cache import QueryCache
+from ln.backend.scheduler import ContinuousScheduler, ResultStream, \
+    align_continuous
+from ln.backend.compat import queue
+
+from multiprocessing.pool import ThreadPool
+import threading
+import numpy as np
 
 # pylint: disable=unused-argument,no-self-use
 class Blob(object):
@@ -19,8 +30,59 @@ class Blob(object):
 
 class Backend(object):
     '''A storage backend interface.'''
-    def __init__(self):
-        pass
+    def __init__(self, query_workers=None, query_cache_size=None):
+        '''
+        :param query_workers: Number of threads that resample the selectors
+            of a query in parallel, or None to resample them one at a time.
+        :param query_cache_size: Memory budget in bytes for cached query
+            results, or None to disable the query cache.
+        '''
+        self._query_workers = query_workers or 1
+        self._query_pool = None
+        self._query_pool_lock = threading.Lock()
+
+        # Points added to each series are published here once visible
+        self.append_bus = AppendBus()
+
+        # Hit and miss counters are available from query_cache.hits and
+        # query_cache.misses.
+        if query_cache_size:
+            self.query_cache = QueryCache(query_cache_size)
+            self.append_bus.subscribe(self._invalidate_cached_queries)
+        else:
+            self.query_cache = None
+
+        # Produces the new bins of all continuous queries from the points
+        # published on the bus.
+        self._scheduler = ContinuousScheduler(self.append_bus)
+
+    def _notify_append(self, name, times, values):
+        '''Called by subclasses after points were added to series ``name``
+        and are visible to queries.
+
+        :param times: int64 array of the new timestamps
+        :param values: Array of the new points, as returned by
+            ``Datatype.coerce_many``
+        '''
+        self.append_bus.publish(name, times, values)
+
+    def _invalidate_cached_queries(self, name, times, values):
+        self.query_cache.appended(name, int(times[-1]))
+
+    def _map_parallel(self, func, items):
+        '''Return ``[func(item) for item in items]``, computed on the query
+        worker pool if there is one.
+
+        Results are in the same order as ``items``.  ``func`` must not call
+        _map_parallel() itself, as it could wait forever for a free worker.
+        '''
+        items = list(items)
+        if self._query_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with self._query_pool_lock:
+            if self._query_pool is None:
+                self._query_pool = ThreadPool(self._query_workers)
+        return self._query_pool.map(func, items)
 
     def get_series_list(self):
         '''Returns list of series names'''
@@ -65,81 +127,321 @@ class Backend(object):
         '''Adds a point to data series.
 
         :param name: Name of data series
-        :param time: timestamp of point
-        :type time: datetime.datetime
+        :param time: timestamp of point, in microseconds since the epoch
+        :type time: int or datetime.datetime
         :param value: Data point (type depends on type of series)
 
         Returns the integer sequence number of this new point in the series.'''
         raise BackendError('Cannot call add_data on base class.')
 
-    def get_data(self, name, offset=None, limit=None):
+    def add_data_many(self, name, times, values):
+        '''Adds a batch of points to a data series in one transaction.
+
+        :param name: Name of data series
+        :param times: timestamps of points in microseconds since the epoch,
+                      in chronological order
+        :type times: int64 array, or list of int or datetime.datetime
+        :param values: Data points (type depends on type of series)
+
+        Either all of the points are added, or none of them are.
+
+        Returns a range of the integer sequence numbers of the new points.'''
+        raise BackendError('Cannot call add_data_many on base class.')
+
+    def add_data_multi(self, batches):
+        '''Adds batches of points to several data series at once.
+
+        :param batches: dict mapping series name to a ``(times, values)``
+                        tuple, with the same meaning as the arguments of
+                        ``add_data_many``.
+
+        A batch that cannot be added (unknown series, bad values, or out of
+        order times) is skipped without affecting the others.  Backends with
+        transactions write all of the remaining batches in one transaction.
+
+        Returns a dict mapping each series name to the range of sequence
+        numbers of its new points, or to the BackendError raised for it.'''
+        results = {}
+        for name, (times, values) in batches.items():
+            try:
+                results[name] = self.add_data_many(name, times, values)
+            except BackendError as e:
+                results[name] = e
+        return results
+
+    def get_data(self, name, offset=None, limit=None, first=None,
+            last=None):
         '''Get raw data points.
 
         :param name: Name of data series
         :param offset: Sequence number of first data point to return.
         :param limit: Maximum number of points to return.
+        :param first: Only return points at or after this time, in
+                      microseconds since the epoch.
+        :type first: int or datetime.datetime
+        :param last: Only return points before this time, in microseconds
+                     since the epoch.
+        :type last: int or datetime.datetime
+
+        If none of ``offset``, ``first`` and ``last`` are given, only the
+        last point of the series is returned.
 
         Returns ``(times, values, resume)`` tuple, where ``times`` is
-        a list of datetime objects, ``values`` is a list
+        an int64 array of microseconds since the epoch, ``values`` is a list
         of values corresponding to those timestamps, and resume is the
         sequence number of the point in the database after the last returned
-        point, or None if no more elements (helps with pagination).'''
+        point, or None if no more elements (helps with pagination).  Pass it
+        as ``offset``, with the same ``first`` and ``last``, to get the next
+        page.  Every page costs the same, however far into the series.'''
         raise BackendError('Cannot call get_data on base class.')
 
+    def get_data_arrays(self, name, offset=None, limit=None, first=None,
+            last=None):
+        '''Get raw data points like ``get_data``, but return the values as
+        an array.
+
+        Returns ``(times, values, resume)`` tuple, where ``values`` is an
+        array indexed by point along the first axis, with the types of
+        ``Datatype.convert_to_array``.  Blob series cannot be read as
+        arrays and raise BackendError.'''
+        raise BackendError('Cannot call get_data_arrays on base class.')
+
+    @staticmethod
+    def _select_points(times, offset, limit, first, last):
+        '''Find the points to return from ``get_data`` in a sorted array of
+        timestamps, indexed by sequence number.
+
+        Returns ``(start, stop, resume)``, where ``start:stop`` is the slice of
+        points to return.  If none of ``offset``, ``first`` and ``last`` are
+        given, the slice holds only the last point.
+        '''
+        if offset is None and first is None and last is None:
+            return max(len(times) - 1, 0), len(times), None
+
+        start = offset or 0
+        stop = len(times)
+        if first is not None:
+            start = max(start,
+                int(np.searchsorted(times, as_epoch_us(first))))
+        if last is not None:
+            stop = int(np.searchsorted(times, as_epoch_us(last)))
+        start = min(start, stop)
+
+        if limit is None or start + limit >= stop:
+            return start, stop, None
+        return start, start + limit, start + limit
+
     def query(self, selectors, first, last, npoints):
         '''Query the database between the given time interval.
 
         :param selectors: List of query selectors, one per data series.
-        :param first: Time stamp of earliest data to include.  Note that
-                      the database will make a best effort to honor this.
-        :type first: datetime.datetime
+        :param first: Time stamp of earliest data to include, in
+                      microseconds since the epoch.  Note that the database
+                      will make a best effort to honor this.
+        :type first: int or datetime.datetime
 
-        :param last: Time stamp of the latest data to include.  Note that
-                      the database will make a best effort to honor this.
-        :type laste: datetime.Datetime
+        :param last: Time stamp of the latest data to include, in
+                      microseconds since the epoch.  Note that the database
+                      will make a best effort to honor this.
+        :type last: int or datetime.datetime
 
         :param npoints: Approximate number of summary points to return.
 
-        Returns: ``(times, values)``, where ``times`` is a 1D
-        array of timestamps, and ``values`` is a list of lists, one per
-        timestamp.  Each list contains the values for each series in the order
+        Returns: ``(times, values)``, where ``times`` is a 1D int64
+        array of timestamps in microseconds since the epoch, and ``values``
+        is a list of lists, one per timestamp.  Each list contains the values for each series in the order
         they were listed in ``selectors``.
         '''
-        raise BackendError('Cannot call query on base class.')
-
-    def query_continuous(self, selectors, first, npoints):
+        selector_objs = self._create_selectors([parse_selector(selector)
+            for selector in selectors])
+        times, series, _ = self._resample_range(selector_objs, first, last,
+            npoints)
+        return times, self._series_to_jsonable(selector_objs, series)
+
+    def query_arrays(self, selectors, first, last, npoints):
+        '''Query the database like ``query``, but return the resampled values
+        as arrays.
+
+        Returns: ``(times, series)``, where ``times`` is a 1D int64 array of
+        timestamps in microseconds since the epoch, and ``series`` is a list
+        with a ``(values, valid)`` tuple for each selector.  ``values`` is an
+        array indexed by timestamp along the first axis, with the types of
+        ``Datatype.convert_to_array``, and ``valid`` is a boolean array that
+        is False where ``query`` would return None.
+        '''
+        selector_objs = self._create_selectors([parse_selector(selector)
+            for selector in selectors])
+        times, series, _ = self._resample_range(selector_objs, first, last,
+            npoints)
+        return times, [(selector.datatype.convert_to_array(values), valid)
+            for selector, (values, valid) in zip(selector_objs, series)]
+
+    def query_continuous(self, selectors, first, npoints, updates='bin'):
         '''Query database between time ``first`` and now, returning
         approximately npoints of data, and a generator that produces new
         points with the same sampling interval.
 
         :param selectors: List of query selectors, one per data series.
-        :param first: Time stamp of earliest data to include.
-        :type first: datetime.datetime
+        :param first: Time stamp of earliest data to include, in
+                      microseconds since the epoch.
+        :type first: int or datetime.datetime
 
         :param npoints: Approximate number of points between ``first`` and
                         now to return immediately.
+        :param updates: ``'bin'`` to generate each new point once its bin has
+                        ended, or ``'point'`` to also generate the
+                        current value of the open bin whenever data is
+                        added to it.
 
         Returns ``(times, values, generator)``, where ``times`` and ``values``
         are the immediate result of the query, and ``generator`` emits
         ``(times, values)`` tuples periodically with new points.  In both
-        cases, ``times`` is a list of timestamps, and ``values`` is a list of
-        lists, even if there is only 1 row to return.
+        cases, ``times`` is an int64 array of timestamps, and ``values`` is a
+        list of lists, even if there is only 1 row to return.
+
+        The bins are aligned to a grid shared by all continuous queries (see
+        ln.backend.scheduler), so the first and last times may move by up to
+        half a bin, and the new points of queries on the same grid are only
+        computed once.  ``generator`` is an ln.backend.scheduler.ResultStream:
+        close it to stop receiving new points, even if it was never read.
 
         Note that the returned generator will block while waiting for new
         data, so do not call it from your main thread!
         '''
-        raise BackendError('Cannot call query_continuous on base class.')
+        results = queue.Queue()
+        times, values, cancel = self.subscribe_continuous(selectors, first,
+            npoints, results.put, updates=updates)
+        return times, values, ResultStream(results, cancel)
+
+    def subscribe_continuous(self, selectors, first, npoints, callback,
+            updates='bin'):
+        '''Like ``query_continuous``, but call ``callback`` with each new
+        ``(times, values)`` tuple rather than generating them.  Errors while
+        computing new points are passed to ``callback`` as the exception.
+
+        ``callback`` is called from other threads, so it should only hand the
+        new points over, for example to a queue, and return.
+
+        Returns ``(times, values, cancel)``, where ``cancel`` is a function
+        that ends the subscription.
+        '''
+        selector_objs = self._create_selectors([parse_selector(selector)
+            for selector in selectors])
+        first, last, delta_t = align_continuous(as_epoch_us(first),
+            now_epoch_us(), npoints)
+
+        # Subscribe first, so no points added during the initial query are
+        # missed from the next bin.
+        cancel = self._scheduler.add_subscriber(selector_objs, last + delta_t,
+            delta_t, callback, updates=updates)
+        try:
+            times, series, _ = self._resample_range(selector_objs, first, last,
+                npoints)
+        except:
+            cancel()
+            raise
+        return times, self._series_to_jsonable(selector_objs, series), cancel
+
+    def _get_resampled_series(self, selectors, bin_edges, center_times):
+        '''Return the resampled points for the given selectors using the
+        bins given by bin_edges.
+
+        :param selectors: list of Selector objects
+        :param bin_edges: int64 array of the ``nbins + 1`` bin boundaries, in
+            microseconds since the epoch.  Bin ``i`` covers the half-open
+            interval ``[bin_edges[i], bin_edges[i + 1])``.
+        :param center_times: int64 array with the center of each bin
+
+        Returns: List of ``(values, valid)`` tuples from
+        ``Selector.apply_strategies(..., as_arrays=True)``, one per selector.
+        Blobs must be returned as ``bytes``.
+        '''
+        raise BackendError('Cannot call _get_resampled_series on base class.')
 
+    @staticmethod
+    def _series_to_jsonable(selectors, series):
+        '''Convert resampled ``(values, valid)`` arrays to lists of points,
+        one per selector, with None for missing points.'''
+        return [selector.datatype.convert_many_to_jsonable(values, valid)
+            for selector, (values, valid) in zip(selectors, series)]
 
-def get_backend(storage_config):
+    def _create_selector(self, name, reduction, interpolation):
+        '''Return a Selector object for a series, using its default
+        strategies where ``reduction`` or ``interpolation`` is None.
+
+        Raises BadSelectorError if the series does not exist.
+        '''
+        config = self.get_config(name)
+        if config is None:
+            raise BadSelectorError('Unknown series name "%s"' % name)
+
+        return create_selector(series_config=config, reduction=reduction,
+            interpolation=interpolation)
+
+    def _create_selectors(self, parsed_selectors):
+        '''Return a list of Selector objects for a list of ``(name,
+        reduction, interpolation)`` tuples, like ``_create_selector``.'''
+        return [self._create_selector(name, reduction, interpolation)
+            for name, reduction, interpolation in parsed_selectors]
+
+    def _resample_range(self, selector_objs, first, last, npoints):
+        '''Common core of query implementation shared between ``query``
+        and ``query_continuous``.
+
+        Returns: int64 array of timestamps, list of resampled series (each a
+            ``(values, valid)`` tuple of arrays), microseconds between
+            timestamps
+        '''
+        # Compute bin boundaries, rounded to whole microseconds
+        first = as_epoch_us(first)
+        last = as_epoch_us(last)
+        bin_half_delta = int(round((last - first) / ((npoints - 1) * 2.0)))
+        bin_edges = first + bin_half_delta * (2 * np.arange(npoints + 1) - 1)
+        bin_centers = first + bin_half_delta * 2 * np.arange(npoints)
+
+        # Collect and resample points for each series, unless the same
+        # query has a cached result that is still valid.
+        cache = self.query_cache
+        resampled_series = None
+        if cache is not None:
+            key = (tuple((s.series_name, s.reduction, s.interpolation)
+                for s in selector_objs), first, last, npoints)
+            resampled_series = cache.get(key)
+        if resampled_series is None:
+            if cache is not None:
+                watermarks = cache.watermarks(
+                    [s.series_name for s in selector_objs])
+            resampled_series = self._get_resampled_series(selector_objs,
+                bin_edges, bin_centers)
+            if cache is not None:
+                cache.put(key, resampled_series, int(bin_edges[-1]),
+                    watermarks)
+
+        return bin_centers, resampled_series, 2 * bin_half_delta
+
+
+def get_backend(storage_config, resampling_intervals=None):
     '''Find/build a backend based on the configuration.
 
+    The optional ``query_workers`` key of ``storage_config`` sets the number
+    of threads each backend uses to resample the selectors of a query, and
+    ``query_cache_size`` the memory budget in bytes for cached results.
+
     :param config: storage section of the configuration
+    :param resampling_intervals: list of intervals in seconds at which
+        backends that support rollups should pre-aggregate scalar series,
+        or None to leave the current setting of the storage unchanged.
     '''
     storage_type = storage_config['backend']
+    options = dict(query_workers=storage_config.get('query_workers'),
+        query_cache_size=storage_config.get('query_cache_size'))
     if storage_type == 'memory':
-        from ln.backend.sql import SQLBackend
-        return SQLBackend('sqlite://')
+        from ln.backend.memory import MemoryBackend
+        return MemoryBackend(**options)
     if storage_type == 'sql':
         from ln.backend.sql import SQLBackend
-        return SQLBackend(storage_config['url'])
+        return SQLBackend(storage_config['url'],
+            resampling_intervals=resampling_intervals, **options)
+    if storage_type == 'segment':
+        from ln.backend.segment import SegmentBackend
+        return SegmentBackend(storage_config['path'], **options)
@@ -0,0 +1,40 @@
+'''In-process publish/subscribe bus for points added to data series.
+
+Backends publish every batch of points added to a series once the points
+are visible to queries.  Subscribers, such as the query cache and the
+continuous query scheduler, are called synchronously by the thread that
+added the points, so they should return quickly.
+'''
+
+import threading
+
+
+class AppendBus(object):
+    '''Delivers the points added to data series to subscribed callbacks.
+
+    Callbacks take ``(name, times, values)``, where ``times`` is an int64
+    array of microseconds since the epoch in chronological order, and
+    ``values`` the matching array of points in the form returned by
+    ``Datatype.coerce_many``.
+    '''
+
+    def __init__(self):
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        '''Call ``callback`` with every batch of points published.'''
+        with self._lock:
+            self._callbacks = self._callbacks + [callback]
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._callbacks = [c for c in self._callbacks if c != callback]
+
+    def publish(self, name, times, values):
+        '''Deliver points added to series ``name`` to all subscribers.'''
+        if len(times) == 0:
+            return
+        # The list is replaced rather than modified, so no lock is needed
+        for callback in self._callbacks:
+            callback(name, times, values)
@@ -0,0 +1,149 @@
+'''Cache of resampled query results.
+
+Data series are append-only, and new points can never be earlier than the
+last point of their series.  The result of a query whose bins all end at or
+before the last timestamp of each of its series can therefore never change.
+Other results stay valid only until a point is added to one of their series.
+
+The cache tracks a *watermark* for each series: the number of appends seen,
+and the timestamp of the last point added.  Backends report every append
+with ``QueryCache.appended()``, after the new points are visible to queries.
+'''
+
+from collections import OrderedDict
+import threading
+import numpy as np
+
+
+def estimate_size(obj):
+    '''Roughly estimate the memory in bytes used by a query result, made
+    of lists, tuples, NumPy arrays and scalars.'''
+    if isinstance(obj, (list, tuple)):
+        return 56 + 8 * len(obj) + sum(estimate_size(item) for item in obj)
+    elif isinstance(obj, bytes):
+        return 33 + len(obj)
+    elif isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            return 96 + sum(estimate_size(item) for item in obj.flat)
+        return 96 + obj.nbytes
+    else:
+        return 24
+
+
+def copy_result(value):
+    '''Copy a list of resampled series, including their NumPy arrays, so
+    that callers cannot modify a cached result.'''
+    return [[item.copy() if isinstance(item, np.ndarray) else item
+        for item in points] for points in value]
+
+
+class CacheEntry(object):
+    '''A cached query result.
+
+    :param value: List of resampled series
+    :param end: End of the last bin of the query, in microseconds since
+        the epoch
+    :param watermarks: dict mapping each series of the query to its
+        watermark when the result was computed
+    :param size: Estimated size of value in bytes
+    '''
+
+    def __init__(self, value, end, watermarks, size):
+        self.value = value
+        self.end = end
+        self.watermarks = watermarks
+        self.size = size
+
+
+class QueryCache(object):
+    '''Least recently used cache of query results within a memory budget.
+
+    Keys are hashable descriptions of normalized queries, and values are
+    lists of resampled series, one list of points per selector.
+
+    :param max_bytes: Budget for the estimated size of all cached results.
+        The least recently used results are evicted to stay within it.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._watermarks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def watermarks(self, names):
+        '''Return a dict mapping each of ``names`` to its current watermark,
+        to pass to put() with a result computed afterwards.'''
+        with self._lock:
+            return dict((name, self._watermark(name)) for name in names)
+
+    def appended(self, name, last_time):
+        '''Record that points up to ``last_time`` (in microseconds since the
+        epoch) were added to series ``name``.'''
+        with self._lock:
+            version, _ = self._watermark(name)
+            self._watermarks[name] = (version + 1, last_time)
+
+    def get(self, key):
+        '''Return a copy of the cached result for ``key``, or None if there
+        is no valid result for it.'''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and not self._is_valid(entry):
+                self.size -= entry.size
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # Reinsert to mark the entry as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return copy_result(entry.value)
+
+    def put(self, key, value, end, watermarks):
+        '''Cache the result ``value`` of a query.
+
+        :param end: End of the last bin of the query, in microseconds since
+            the epoch
+        :param watermarks: Watermarks of the series of the query from
+            before the result was computed, as returned by watermarks()
+        '''
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        entry = CacheEntry(copy_result(value), end, watermarks, size)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = entry
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def clear(self):
+        '''Drop all cached results.  The counters and watermarks are kept.'''
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _watermark(self, name):
+        return self._watermarks.get(name, (0, None))
+
+    def _is_valid(self, entry):
+        for name, (version, last_time) in entry.watermarks.items():
+            historical = last_time is not None and entry.end <= last_time
+            if not historical and self._watermark(name)[0] != version:
+                return False
+        return True
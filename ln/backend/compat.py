@@ -10,7 +10,16 @@ def get_total_seconds(td):
 
 version = sys.version_info[:2]
 zip = zip
+range = range
+string_types = str
 if version < (3,0):
     import itertools
     zip = itertools.izip
+    range = xrange
+    string_types = basestring
 
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
@@ -103,6 +103,34 @@ class Datatype(object):
         except (ValueError, TypeError) as e:
             raise BadTypeError(str(e))
 
+    def coerce_many(self, values):
+        '''Convert a sequence of values to a numpy array indexed by point
+        along the first axis, like ``stack``.
+
+        Integer scalars become int64, floating point scalars become float64,
+        array types keep the dtype of the series, and blob types become an
+        object array of ``bytes``.
+
+        Raises ``BadTypeError`` if any value cannot be coerced to this
+        datatype.
+        '''
+        try:
+            if self.is_blob():
+                return self.stack([bytes(v) for v in values])
+            elif self.is_int_scalar():
+                dtype = np.int64
+            elif self.is_float_scalar():
+                dtype = np.float64
+            else:
+                dtype = NUMPY_TYPE_MAPPING[self.base]
+            array = np.asarray(values, dtype=dtype)
+        except (ValueError, TypeError) as e:
+            raise BadTypeError(str(e))
+
+        if array.shape != (len(values),) + (self.shape or ()):
+            raise BadTypeError('Cannot coerce values')
+        return array
+
     def make_zero(self):
         '''Return an "zero" instance of this data type.
 
@@ -119,6 +147,57 @@ class Datatype(object):
         elif self.is_blob():
             return b''
 
+    def make_zeros(self, count):
+        '''Return an array of ``count`` "zero" instances of this data type,
+        indexed by point along the first axis like ``stack``.'''
+        if self.is_blob():
+            array = np.empty(count, dtype=object)
+            array[:] = [b''] * count
+            return array
+        return np.zeros((count,) + (self.shape or ()),
+            dtype=NUMPY_TYPE_MAPPING[self.base])
+
+    def stack(self, values):
+        '''Combine a list of values returned by coerce into a single numpy
+        array indexed by point along the first axis.
+
+        Scalars become a 1D array, arrays gain a leading dimension, and
+        blobs are held in an object array.
+        '''
+        if self.is_blob():
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            return array
+        elif self.is_array():
+            array = np.asarray(values, dtype=NUMPY_TYPE_MAPPING[self.base])
+            return array.reshape((len(values),) + self.shape)
+        else:
+            return np.asarray(values)
+
+    def _storage_dtype(self):
+        return np.dtype(NUMPY_TYPE_MAPPING[self.base]).newbyteorder('<')
+
+    def to_bytes(self, value):
+        '''Return the raw little-endian bytes of an array value returned by
+        coerce (only valid for array types).'''
+        return np.ascontiguousarray(value, dtype=self._storage_dtype()) \
+            .tobytes()
+
+    def from_bytes(self, data, count=None):
+        '''Rebuild array values from bytes produced by to_bytes (only valid
+        for array types).  The result shares memory with ``data``.
+
+        :param data: Raw bytes of one value, or of ``count`` values
+            concatenated.
+        :param count: Number of values in ``data``, or None for one value.
+            If set, the result has a leading dimension of length ``count``.
+        '''
+        array = np.frombuffer(data, dtype=self._storage_dtype())
+        if count is None:
+            return array.reshape(self.shape)
+        else:
+            return array.reshape((count,) + self.shape)
+
     def convert_to_jsonable(self, value):
         '''Converts value to a type that can be handled by the JSON parser,
         i.e. no numpy types.
@@ -135,6 +214,36 @@ class Datatype(object):
         elif self.is_blob():
             return bytes(value)
 
+    def convert_to_array(self, values):
+        '''Convert an array of values indexed by point along the first
+        axis, such as resampled values, to the types of convert_to_jsonable.
+
+        Integer scalars become int64, floating point scalars become float64,
+        array types keep their dtype, and blob types become an object array
+        of ``bytes``.
+        '''
+        if self.is_int_scalar():
+            return np.asarray(values, dtype=np.int64)
+        elif self.is_float_scalar():
+            return np.asarray(values, dtype=np.float64)
+        elif self.is_array():
+            return np.asarray(values)
+        elif self.is_blob():
+            return self.stack([bytes(v) for v in values])
+
+    def convert_many_to_jsonable(self, values, valid):
+        '''Convert an array of values indexed by point along the first axis
+        to a list of values like convert_to_jsonable, with None wherever the
+        boolean array ``valid`` is False.
+        '''
+        if self.is_blob():
+            # Only valid entries are guaranteed to hold blobs
+            return [bytes(value) if is_valid else None
+                for value, is_valid in zip(values, valid)]
+        items = self.convert_to_array(values).tolist()
+        return [item if is_valid else None
+            for item, is_valid in zip(items, valid.tolist())]
+
 
 def parse_datatype(typestring):
     '''Parse a datatype string and return an instance of Datatype to
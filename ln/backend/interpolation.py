@@ -1,34 +1,72 @@
-'''Functions that perform the different interpolation strategies.'''
+'''Functions that perform the different interpolation strategies.
 
+Every interpolation receives the reduced values of all bins as one dense
+array, indexed by bin along the first axis, and a boolean ``valid`` mask
+that is False for empty bins.  The contents of empty bins are arbitrary.
+``center_times`` is an int64 array with the center of each bin, in
+microseconds since the epoch, or None.
 
-def none(reduced_values, datatype, center_times):
-    return reduced_values
+Each function returns a ``(values, valid)`` tuple in the same form, where
+bins that are still invalid become null in the query result.
+'''
 
+import numpy as np
 
-def zero(reduced_values, datatype, center_times):
-    new_reduced_values = []
-    for v in reduced_values:
-        if v is not None:
-            new_reduced_values.append(v)
-        else:
-            new_reduced_values.append(datatype.make_zero())
-    return new_reduced_values
 
+def none(values, valid, datatype, center_times):
+    return values, valid
 
-def previous(reduced_values, datatype, center_times):
-    new_reduced_values = []
-    last_seen = None
-    for v in reduced_values:
-        if v is not None:
-            last_seen = v
-            new_reduced_values.append(v)
-        else:
-            new_reduced_values.append(last_seen)
-    return new_reduced_values
 
+def zero(values, valid, datatype, center_times):
+    if datatype.is_blob():
+        # Backends may reduce blobs to indices, which cannot hold b''
+        values = values.astype(object)
+    else:
+        values = values.copy()
+    values[~valid] = datatype.make_zero()
+    return values, np.ones_like(valid)
 
-def linear(reduced_values, datatype, center_times):
-    pass
+
+def previous(values, valid, datatype, center_times):
+    # Index of the last valid bin at or before each bin, or -1 if none
+    last_valid = np.maximum.accumulate(
+        np.where(valid, np.arange(len(valid)), -1))
+    return values[np.maximum(last_valid, 0)], last_valid >= 0
+
+
+def linear(values, valid, datatype, center_times):
+    indices = np.flatnonzero(valid)
+    if datatype.is_blob() or len(indices) < 2:
+        return values, valid
+
+    # Only bins between the first and last non-empty bins can be filled
+    missing = np.flatnonzero(~valid[indices[0]:indices[-1]]) + indices[0]
+    if len(missing) == 0:
+        return values, valid
+
+    # Interpolate in seconds since the epoch, or bin index if not given
+    if center_times is None:
+        x = np.arange(len(valid), dtype=np.float64)
+    else:
+        x = np.asarray(center_times, dtype=np.int64) / 1e6
+    y = values[indices].astype(np.float64)
+
+    if datatype.is_array():
+        # Same as np.interp, applied to every element of the arrays
+        right = np.searchsorted(indices, missing)
+        left = right - 1
+        weight = (x[missing] - x[indices[left]]) \
+            / (x[indices[right]] - x[indices[left]])
+        weight = weight.reshape((-1,) + (1,) * (y.ndim - 1))
+        filled = y[left] + weight * (y[right] - y[left])
+    else:
+        filled = np.interp(x[missing], x[indices], y)
+
+    values = values.astype(np.result_type(values, np.float64))
+    values[missing] = filled
+    valid = valid.copy()
+    valid[missing] = True
+    return values, valid
 
 
 INTERPOLATIONS = dict(none=none, zero=zero, previous=previous, linear=linear)
@@ -0,0 +1,224 @@
+'''Storage backend that keeps every series in memory as NumPy arrays.'''
+
+from ln.backend.base import Backend, Blob
+from ln.backend.exception import BackendError, SeriesCreationError, \
+    SeriesDoesNotExistError, SeriesTimeOrderError, BadTypeError
+from ln.backend.datatype import parse_datatype, NUMPY_TYPE_MAPPING
+from ln.backend.compat import range
+from ln.backend.timestamp import to_epoch_us, as_epoch_us
+
+import threading
+import numpy as np
+
+INITIAL_CAPACITY = 16
+
+
+class MemoryBlob(Blob):
+    '''A blob held in memory'''
+
+    def __init__(self, index, mimetype, contents):
+        super(MemoryBlob, self).__init__(index, mimetype)
+        self._contents = contents
+
+    def get_bytes(self):
+        return self._contents
+
+
+class SeriesStore(object):
+    '''Columnar storage for the points of one data series.
+
+    Timestamps are kept in an int64 array of microseconds since the epoch,
+    and values in an array typed from the series datatype.  Both arrays
+    double in capacity when full, so appends are amortized O(1).
+    '''
+
+    def __init__(self, datatype):
+        self.datatype = datatype
+        self.size = 0
+        self.times = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+        self.values = self._allocate_values(INITIAL_CAPACITY)
+
+    def _allocate_values(self, capacity):
+        if self.datatype.is_blob():
+            return np.empty(capacity, dtype=object)
+        shape = (capacity,)
+        if self.datatype.is_array():
+            shape += self.datatype.shape
+        return np.empty(shape, dtype=NUMPY_TYPE_MAPPING[self.datatype.base])
+
+    def _grow(self, capacity):
+        times = np.empty(capacity, dtype=np.int64)
+        times[:self.size] = self.times[:self.size]
+        values = self._allocate_values(capacity)
+        values[:self.size] = self.values[:self.size]
+        # Readers may still hold views of the old arrays, which stay valid
+        self.times = times
+        self.values = values
+
+    def append(self, time, value):
+        '''Append one point and return its sequence number.'''
+        if self.size > 0 and time < self.times[self.size - 1]:
+            raise SeriesTimeOrderError('New data point is chronologically before last point in series')
+
+        if self.size == len(self.times):
+            self._grow(2 * len(self.times))
+
+        sequence = self.size
+        self.times[sequence] = time
+        self.values[sequence] = value
+        self.size += 1
+        return sequence
+
+    def extend(self, times, values):
+        '''Append arrays of points and return their sequence numbers.'''
+        if len(times) != len(values):
+            raise BadTypeError('Number of times and values do not match')
+        if self.size > 0:
+            previous = self.times[self.size - 1:self.size]
+        else:
+            previous = times[:0]
+        if np.any(np.diff(np.concatenate([previous, times])) < 0):
+            raise SeriesTimeOrderError('New data points are not in chronological order after last point in series')
+
+        capacity = len(self.times)
+        while capacity < self.size + len(times):
+            capacity *= 2
+        if capacity != len(self.times):
+            self._grow(capacity)
+
+        start = self.size
+        stop = start + len(times)
+        self.times[start:stop] = times
+        self.values[start:stop] = values
+        self.size = stop
+        return range(start, stop)
+
+    def snapshot(self):
+        '''Return views of the timestamps and values recorded so far.'''
+        size = self.size
+        return self.times[:size], self.values[:size]
+
+
+class MemoryBackend(Backend):
+    '''Backend that stores data series in NumPy arrays in memory'''
+
+    def __init__(self, query_workers=None, query_cache_size=None):
+        super(MemoryBackend, self).__init__(query_workers=query_workers,
+            query_cache_size=query_cache_size)
+        self._configs = {}
+        self._names = []
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def _get_store(self, name):
+        try:
+            return self._stores[name]
+        except KeyError:
+            raise SeriesDoesNotExistError('Series %s does not exist.' % name)
+
+    def get_series_list(self):
+        with self._lock:
+            return list(self._names)
+
+    def create_series(self, name, type, reduction, interpolation, unit,
+            description, metadata):
+
+        # Raises exception if datatype is invalid
+        datatype = parse_datatype(type)
+
+        with self._lock:
+            if name in self._configs:
+                raise SeriesCreationError('Series %s already exists.'
+                    % name)
+
+            self._configs[name] = dict(name=name, type=type,
+                reduction=reduction, interpolation=interpolation, unit=unit,
+                description=description, metadata=metadata)
+            self._names.append(name)
+            self._stores[name] = SeriesStore(datatype)
+
+    def get_config(self, name):
+        with self._lock:
+            config = self._configs.get(name)
+            if config is None:
+                return None
+            else:
+                return dict(config)
+
+    def update_config(self, name, unit=None, description=None, metadata=None):
+        with self._lock:
+            config = self._configs.get(name)
+
+            if config is None:
+                raise SeriesDoesNotExistError('Series %s does not exist.' % name)
+
+            if unit is not None:
+                config['unit'] = unit
+            if description is not None:
+                config['description'] = description
+            if metadata is not None:
+                config['metadata'] = metadata
+
+    def add_data(self, name, time, value):
+        store = self._get_store(name)
+        value = store.datatype.coerce(value)
+        time = as_epoch_us(time)
+        with self._lock:
+            sequence = store.append(time, value)
+            # Publish before releasing the lock, so appends are seen in order
+            self._notify_append(name, np.array([time]),
+                store.datatype.stack([value]))
+        return sequence
+
+    def add_data_many(self, name, times, values):
+        store = self._get_store(name)
+        values = store.datatype.coerce_many(values)
+        times = to_epoch_us(times)
+        with self._lock:
+            sequences = store.extend(times, values)
+            self._notify_append(name, times, values)
+        return sequences
+
+    def _make_value(self, name, datatype, sequence, value):
+        if datatype.is_blob():
+            return MemoryBlob(index=sequence, mimetype=datatype.mimetype,
+                contents=value)
+        else:
+            return datatype.convert_to_jsonable(value)
+
+    def get_data(self, name, offset=None, limit=None, first=None,
+            last=None):
+        store = self._get_store(name)
+        datatype = store.datatype
+        with self._lock:
+            times, values = store.snapshot()
+
+        start, stop, next_offset = self._select_points(times, offset, limit,
+            first, last)
+        out_values = [self._make_value(name, datatype, start + i, value)
+            for i, value in enumerate(values[start:stop])]
+        return times[start:stop], out_values, next_offset
+
+    def get_data_arrays(self, name, offset=None, limit=None, first=None,
+            last=None):
+        store = self._get_store(name)
+        datatype = store.datatype
+        if datatype.is_blob():
+            raise BackendError('Cannot read blob series as arrays.')
+        with self._lock:
+            times, values = store.snapshot()
+
+        start, stop, next_offset = self._select_points(times, offset, limit,
+            first, last)
+        return times[start:stop], \
+            datatype.convert_to_array(values[start:stop]), next_offset
+
+    def _get_resampled_series(self, selectors, bin_edges, center_times):
+        def resample(selector):
+            store = self._get_store(selector.series_name)
+            with self._lock:
+                times, values = store.snapshot()
+
+            return selector.apply_strategies(bin_edges, center_times, times,
+                values, as_arrays=True)
+        return self._map_parallel(resample, selectors)
@@ -1,30 +1,77 @@
-'''Functions that perform the different reduction strategies.'''
+'''Functions that perform the different reduction strategies.
+
+Every reduction operates on a whole query at once.  The raw points of all
+non-empty bins are passed as contiguous, time-ordered arrays, and
+``offsets`` gives the index of the first point in each bin (the same
+convention as ``numpy.ufunc.reduceat``).  Bin ``i`` therefore spans
+``offsets[i]:offsets[i + 1]``, with the last bin running to the end of the
+arrays.  ``center_times`` holds the center of each of those bins.
+
+All times are int64 microseconds since the epoch.  Each function returns
+an array with one reduced value per bin.
+'''
 
 import numpy as np
-from ln.backend.compat import get_total_seconds
 
 
-def closest(times, values, center_time):
-    abs_delta = np.abs(np.array([get_total_seconds(t - center_time)
-        for t in times]))
-    closest_index = np.argmin(abs_delta)
-    return values[closest_index]
+def _bin_ends(offsets, npoints):
+    '''Return the index one past the last point of each bin.'''
+    return np.append(offsets[1:], npoints)
+
+
+def _accumulator_dtype(values):
+    '''Widen integer and float values so sums do not overflow.'''
+    if values.dtype.kind in 'iu':
+        return np.int64
+    elif values.dtype.kind == 'f':
+        return np.float64
+    else:
+        return values.dtype
+
+
+def closest(times, values, offsets, center_times):
+    ends = _bin_ends(offsets, len(times))
+    # Candidates are the first point at or after the center, and the one
+    # just before it, both kept inside their bin.
+    right = np.clip(np.searchsorted(times, center_times), offsets, ends - 1)
+    left = np.clip(right - 1, offsets, ends - 1)
+    # Prefer the earliest of several points sharing the same timestamp
+    left = np.maximum(np.searchsorted(times, times[left]), offsets)
+    pick_left = np.abs(times[left] - center_times) \
+        <= np.abs(times[right] - center_times)
+    return values[np.where(pick_left, left, right)]
+
+
+def first(times, values, offsets, center_times):
+    return values[offsets]
+
+
+def last(times, values, offsets, center_times):
+    return values[_bin_ends(offsets, len(times)) - 1]
+
 
+def sum(times, values, offsets, center_times):
+    return np.add.reduceat(values, offsets, axis=0,
+        dtype=_accumulator_dtype(values))
 
-def sum(times, values, center_time):
-    return np.sum(values, axis=0)
 
+def mean(times, values, offsets, center_times):
+    counts = np.diff(np.append(offsets, len(values)))
+    counts = counts.reshape((-1,) + (1,) * (values.ndim - 1))
+    return sum(times, values, offsets, center_times) / counts
 
-def mean(times, values, center_time):
-    return np.mean(values, axis=0)
 
+def min(times, values, offsets, center_times):
+    return np.minimum.reduceat(values, offsets, axis=0)
 
-def min(times, values, center_time):
-    return np.amin(values, axis=0)
 
+def max(times, values, offsets, center_times):
+    return np.maximum.reduceat(values, offsets, axis=0)
 
-def max(times, values, center_time):
-    return np.amax(values, axis=0)
 
+REDUCTIONS = dict(closest=closest, first=first, last=last, sum=sum,
+    mean=mean, min=min, max=max)
 
-REDUCTIONS = dict(closest=closest, sum=sum, mean=mean, min=min, max=max)
+# Reductions that select one of the raw points in each bin.  The chosen
+# point can be found with index lookups, without reading the whole bin.
+SELECTIONS = set(['closest', 'first', 'last'])
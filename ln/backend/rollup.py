@@ -0,0 +1,185 @@
+'''Pre-aggregated rollups of scalar data series.
+
+A rollup tier summarizes the points of a series in buckets of a fixed
+interval (in seconds), aligned to the epoch.  Each bucket holds partial
+aggregates that can be merged with those of other buckets: the number of
+points, their sum, minimum and maximum, and the first and last point with
+their timestamps.
+
+Queries with bins at least as wide as the interval of a tier can be
+answered by merging buckets instead of reading the raw points.  Only the
+buckets that lie entirely within one bin are merged.  Where a bin edge falls
+inside a bucket, the raw points of that bucket are read instead and merged
+as buckets of one point each, so results match resampling the raw points.
+'''
+
+import numpy as np
+
+US_PER_SECOND = 10**6
+
+# Fewest buckets per bin for a tier that does not line up with the bins to
+# be used, which bounds the share of raw points read at the bin edges.
+MIN_BUCKETS_PER_BIN = 8
+
+FIELDS = ('start', 'count', 'sum', 'min', 'max', 'first_time', 'first_value',
+    'last_time', 'last_value')
+
+
+class Buckets(object):
+    '''A sequence of rollup buckets, held as one array per field.
+
+    Times are int64 microseconds since the epoch, and values are float64.
+    '''
+
+    def __init__(self, start, count, sum, min, max, first_time, first_value,
+            last_time, last_value):
+        self.start = np.asarray(start, dtype=np.int64)
+        self.count = np.asarray(count, dtype=np.int64)
+        self.sum = np.asarray(sum, dtype=np.float64)
+        self.min = np.asarray(min, dtype=np.float64)
+        self.max = np.asarray(max, dtype=np.float64)
+        self.first_time = np.asarray(first_time, dtype=np.int64)
+        self.first_value = np.asarray(first_value, dtype=np.float64)
+        self.last_time = np.asarray(last_time, dtype=np.int64)
+        self.last_value = np.asarray(last_value, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.start)
+
+    def __getitem__(self, index):
+        '''Return the buckets selected by a slice or index array.'''
+        return Buckets(**dict((field, getattr(self, field)[index])
+            for field in FIELDS))
+
+
+def bucket_start(times, interval):
+    '''Return the start of the bucket of ``interval`` seconds holding each
+    of ``times``.'''
+    width = interval * US_PER_SECOND
+    return times // width * width
+
+
+def aggregate(times, values, interval):
+    '''Summarize points into buckets of ``interval`` seconds.
+
+    :param times: Sorted int64 array of point timestamps.
+    :param values: Array of scalar point values.
+    :param interval: Bucket width in seconds.
+    '''
+    starts = bucket_start(np.asarray(times, dtype=np.int64), interval)
+    return merge(Buckets(start=starts, count=np.ones(len(starts)),
+        sum=values, min=values, max=values, first_time=times,
+        first_value=values, last_time=times, last_value=values))
+
+
+def merge(buckets):
+    '''Combine consecutive buckets with the same start into one bucket.'''
+    if len(buckets) == 0:
+        return buckets
+
+    offsets = np.flatnonzero(np.diff(buckets.start, prepend=-1) != 0)
+    ends = np.append(offsets[1:], len(buckets)) - 1
+    return Buckets(start=buckets.start[offsets],
+        count=np.add.reduceat(buckets.count, offsets),
+        sum=np.add.reduceat(buckets.sum, offsets),
+        min=np.minimum.reduceat(buckets.min, offsets),
+        max=np.maximum.reduceat(buckets.max, offsets),
+        first_time=buckets.first_time[offsets],
+        first_value=buckets.first_value[offsets],
+        last_time=buckets.last_time[ends],
+        last_value=buckets.last_value[ends])
+
+
+def concatenate(buckets_list):
+    '''Join time-ordered Buckets, merging any bucket split between them.'''
+    return merge(Buckets(**dict((field,
+        np.concatenate([getattr(b, field) for b in buckets_list]))
+        for field in FIELDS)))
+
+
+def from_points(times, values):
+    '''Return Buckets holding one point each.'''
+    return Buckets(start=times, count=np.ones(len(times)), sum=values,
+        min=values, max=values, first_time=times, first_value=values,
+        last_time=times, last_value=values)
+
+
+def combine(buckets_list):
+    '''Join Buckets that may overlap in time, sorting them by start.'''
+    joined = Buckets(**dict((field,
+        np.concatenate([getattr(b, field) for b in buckets_list]))
+        for field in FIELDS))
+    return merge(joined[np.argsort(joined.start, kind='mergesort')])
+
+
+def pick_interval(intervals, bin_edges):
+    '''Return the interval (in seconds) of the tier to resample bins with
+    edges ``bin_edges`` from, or None if raw points should be used.
+
+    Tiers whose buckets line up with the bin edges need no raw points, so the
+    longest of them is preferred.  Otherwise, the raw points of the buckets
+    crossing each bin edge are read too, so only tiers with at least
+    ``MIN_BUCKETS_PER_BIN`` buckets per bin are worth using.
+    '''
+    bin_width = int(bin_edges[1] - bin_edges[0])
+    fitting = [interval for interval in intervals
+        if interval * US_PER_SECOND <= bin_width]
+    aligned = [interval for interval in fitting
+        if bin_width % (interval * US_PER_SECOND) == 0
+        and int(bin_edges[0]) % (interval * US_PER_SECOND) == 0]
+    if len(aligned) > 0:
+        return max(aligned)
+
+    coarse = [interval for interval in fitting
+        if interval * US_PER_SECOND * MIN_BUCKETS_PER_BIN <= bin_width]
+    if len(coarse) == 0:
+        return None
+    return max(coarse)
+
+
+def whole_buckets(buckets, bin_edges, interval):
+    '''Return the buckets that lie entirely within one of the bins.'''
+    width = interval * US_PER_SECOND
+    first_bin = np.searchsorted(bin_edges, buckets.start, side='right')
+    last_bin = np.searchsorted(bin_edges, buckets.start + width - 1,
+        side='right')
+    keep = (first_bin == last_bin) & (first_bin > 0) \
+        & (first_bin < len(bin_edges))
+    return buckets[keep]
+
+
+def partial_ranges(bin_edges, interval):
+    '''Return the time ranges of the buckets that cross a bin edge,
+    clipped to the bins, as sorted int64 arrays ``(lo, hi)`` of half-open
+    ranges.  Their points must be read raw.'''
+    starts = bucket_start(np.asarray(bin_edges, dtype=np.int64), interval)
+    crossing = starts != bin_edges
+    lo = np.maximum(starts[crossing], bin_edges[0])
+    hi = np.minimum(starts[crossing] + interval * US_PER_SECOND,
+        bin_edges[-1])
+    keep = lo < hi
+    return lo[keep], hi[keep]
+
+
+# Merge the buckets of each bin into the result of a reduction.  These use
+# the same segmented convention as ln.backend.reduction, with ``offsets``
+# giving the index of the first bucket in each bin.
+
+def merge_sum(buckets, offsets):
+    return np.add.reduceat(buckets.sum, offsets)
+
+
+def merge_mean(buckets, offsets):
+    return merge_sum(buckets, offsets) \
+        / np.add.reduceat(buckets.count, offsets)
+
+
+def merge_min(buckets, offsets):
+    return np.minimum.reduceat(buckets.min, offsets)
+
+
+def merge_max(buckets, offsets):
+    return np.maximum.reduceat(buckets.max, offsets)
+
+
+MERGES = dict(sum=merge_sum, mean=merge_mean, min=merge_min, max=merge_max)
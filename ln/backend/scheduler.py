@@ -0,0 +1,423 @@
+'''Shared scheduling of continuous queries.
+
+Every continuous query subscribes to a *tick group*, identified by its
+selectors, bin width and phase (the bin centers modulo the bin width).  The
+points added to the series of a group are folded into a small summary of
+each bin as they arrive from the append bus of the backend, so no raw
+points are kept.  A single scheduler thread finishes the open bin of each
+group from its summary once it has ended, and hands the same result to every
+subscriber of the group, so many clients following the same series cost one
+resampling per tick and no reads from storage.  Updates of the open bin for
+subscribers that want them are finished and delivered on the same thread,
+so adding data only updates the summaries.
+
+Continuous queries are aligned to a grid anchored at the epoch (see
+align_continuous()), so that subscriptions to the same selectors with the
+same time window fall into the same group no matter when they started.
+'''
+
+from ln.backend.compat import queue, zip
+from ln.backend.reduction import REDUCTIONS
+from ln.backend.timestamp import now_epoch_us, US_PER_SECOND
+
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bin widths of continuous queries are rounded to a multiple of twice this
+# many microseconds, so that clients asking for nearly the same window share
+# the same ticks.
+TICK_RESOLUTION_US = 1000
+
+
+def align_continuous(first, last, npoints):
+    '''Move the range of a continuous query onto the shared tick grid.
+
+    The bin width is rounded to a multiple of ``2 * TICK_RESOLUTION_US``
+    (or of 2 microseconds for very narrow bins), and ``last`` to the
+    nearest multiple of the bin width.  ``first`` is then chosen so the
+    query still has ``npoints`` bins.
+
+    Returns ``(first, last, delta_t)``, all in microseconds since the epoch.
+    '''
+    raw_delta = (last - first) / float(npoints - 1)
+    step = 2 * TICK_RESOLUTION_US if raw_delta >= 2 * TICK_RESOLUTION_US \
+        else 2
+    delta_t = max(step, int(round(raw_delta / step)) * step)
+    # The latest bin center whose bin has started, with ``last`` in
+    # [center - delta_t/2, center + delta_t/2) like the points of a bin.
+    last = (last + delta_t // 2) // delta_t * delta_t
+    return last - (npoints - 1) * delta_t, last, delta_t
+
+
+class Subscription(object):
+    '''A continuous query waiting for the ticks of its group.
+
+    :param next_t: Center of the next bin this subscriber needs
+    :param updates: ``'bin'`` to receive each bin once it has ended, or
+        ``'point'`` to also receive the open bin whenever points are added
+    :param callback: Function called with each ``(times, values)`` result,
+        or with the exception raised while resampling
+
+    ``cancel`` is set to a function that ends the subscription.
+    '''
+
+    def __init__(self, next_t, updates, callback):
+        self.next_t = next_t
+        self.updates = updates
+        self.callback = callback
+        self.cancel = None
+
+
+class BinSummary(object):
+    '''Mergeable summary of the points of one series in one bin, holding
+    only what the reduction ``reduction`` needs: the running sum, minimum
+    or maximum, the first or last point, or the point closest to the bin
+    center ``tick``.
+
+    Points must be added in time order.  The reduced value is kept as an
+    array of length one, like the result of a reduction over one bin.
+    '''
+
+    def __init__(self, reduction, tick):
+        self.reduction = reduction
+        self.tick = tick
+        self.count = 0
+        self.value = None
+        self.time = None  # Time of the point held by 'closest'
+
+    def add(self, times, values):
+        '''Add points later than those added before.'''
+        if len(times) == 0:
+            return
+        offsets = np.zeros(1, dtype=np.intp)
+        centers = np.array([self.tick])
+        reduction = self.reduction
+        if reduction in ('sum', 'mean'):
+            value = REDUCTIONS['sum'](times, values, offsets, centers)
+            if self.count > 0:
+                value = self.value + value
+        elif reduction in ('min', 'max'):
+            value = REDUCTIONS[reduction](times, values, offsets, centers)
+            if self.count > 0:
+                combine = np.minimum if reduction == 'min' else np.maximum
+                value = combine(self.value, value)
+        elif reduction == 'first':
+            value = self.value if self.count > 0 else values[:1]
+        elif reduction == 'last':
+            value = values[-1:]
+        else:  # closest, keeping the earliest point on ties
+            distances = np.abs(times - self.tick)
+            i = int(np.argmin(distances))
+            if self.count > 0 and \
+                    abs(self.time - self.tick) <= distances[i]:
+                value = self.value
+            else:
+                self.time = int(times[i])
+                value = values[i:i + 1]
+        self.value = value
+        self.count += len(times)
+
+    def reduced(self):
+        '''Return the reduced value of the bin, or None if it is empty.'''
+        if self.count == 0:
+            return None
+        if self.reduction == 'mean':
+            return self.value / self.count
+        return self.value
+
+
+class TickGroup(object):
+    '''Subscriptions sharing the same selectors, bin width and phase.
+
+    ``bins`` maps the center of the open bin, and of any later bin that
+    points were published for, to a list with a BinSummary for each
+    selector.  ``previous`` holds for each selector the center and reduced
+    value of the last non-empty bin that was taken, for interpolation.
+    '''
+
+    def __init__(self, selectors, next_t, delta_t):
+        self.selectors = selectors
+        self.next_t = next_t
+        self.delta_t = delta_t
+        self.subscribers = set()
+        self.bins = {}
+        self.previous = [(None, None)] * len(selectors)
+
+    def due_time(self):
+        '''Time at which the open bin has ended and can be resampled.'''
+        return self.next_t + self.delta_t // 2
+
+    def add_points(self, name, times, values):
+        '''Add the points of series ``name`` that fall in the open bin or
+        later ones to the summaries of their bins.'''
+        start = self.next_t - self.delta_t // 2
+        skip = np.searchsorted(times, start)
+        times = times[skip:]
+        values = values[skip:]
+        if len(times) == 0:
+            return
+
+        indices = (times - start) // self.delta_t
+        offsets = np.append(np.flatnonzero(np.diff(indices)) + 1, len(times))
+        lo = 0
+        for hi in offsets:
+            tick = self.next_t + int(indices[lo]) * self.delta_t
+            summaries = self.bins.get(tick)
+            if summaries is None:
+                summaries = self.bins[tick] = [BinSummary(s.reduction, tick)
+                    for s in self.selectors]
+            for selector, summary in zip(self.selectors, summaries):
+                if selector.series_name == name:
+                    summary.add(times[lo:hi], values[lo:hi])
+            lo = hi
+
+    def peek_bin(self):
+        '''Return the state of the open bin, to pass to bin_result().'''
+        return self._bin_state(self.bins.get(self.next_t))
+
+    def take_bin(self):
+        '''Remove and return the state of the open bin, like peek_bin(),
+        and move on to the next bin.'''
+        state = self._bin_state(self.bins.pop(self.next_t, None))
+        self.previous = [previous if reduced is None
+            else (self.next_t, reduced)
+            for previous, reduced in state]
+        self.next_t += self.delta_t
+        return state
+
+    def _bin_state(self, summaries):
+        if summaries is None:
+            return [(previous, None) for previous in self.previous]
+        return [(previous, summary.reduced())
+            for previous, summary in zip(self.previous, summaries)]
+
+
+def bin_result(selectors, tick, delta_t, state):
+    '''Finish one bin centered on ``tick`` for each selector, from the
+    state returned by TickGroup.peek_bin() or take_bin(), interpolating
+    empty bins from the last non-empty one.
+
+    Returns a ``(times, values)`` tuple, like the generators of continuous
+    queries.
+    '''
+    center_times = np.array([tick])
+    resampled_series = []
+    for selector, ((previous_tick, previous), reduced) in zip(selectors,
+            state):
+        datatype = selector.datatype
+        valid = np.array([previous is not None, reduced is not None])
+        known = [value for value in (previous, reduced) if value is not None]
+        if len(known) == 0:
+            values = datatype.make_zeros(2)
+        else:
+            values = np.concatenate([known[0] if value is None else value
+                for value in (previous, reduced)])
+        if previous_tick is None:
+            previous_tick = tick - delta_t
+        values, valid = selector.interpolation_func(values, valid, datatype,
+            np.array([previous_tick, tick]))
+        resampled_series.append([datatype.convert_to_jsonable(values[1])
+            if valid[1] else None])
+    return center_times, resampled_series
+
+
+class ResultStream(object):
+    '''Iterator over the results a subscriber callback put in the queue
+    ``results``, which blocks until the next one arrives.
+
+    ``cancel`` ends the subscription.  It is called by close(), even if no
+    result was ever read, and when a result is an exception, which is
+    raised.
+    '''
+
+    def __init__(self, results, cancel):
+        self._results = results
+        self._cancel = cancel
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        result = self._results.get()
+        if isinstance(result, Exception):
+            self.close()
+            raise result
+        return result
+
+    next = __next__  # Python 2
+
+    def close(self):
+        '''End the subscription.'''
+        if not self._closed:
+            self._closed = True
+            self._cancel()
+
+
+class ContinuousScheduler(object):
+    '''Produces the bins of all continuous queries of a backend, once per
+    tick group.
+
+    The points of each group are collected from ``append_bus`` as they are
+    added, so bins are resampled without reading the storage, and nothing
+    is done while no data arrives apart from closing bins on time.  Only
+    points added through the same backend object are seen.
+
+    :param append_bus: AppendBus of the backend
+    '''
+
+    def __init__(self, append_bus):
+        self._groups = {}
+        self._series_groups = {}
+        # Updates of open bins waiting for the scheduler thread
+        self._updates = []
+        self._condition = threading.Condition()
+        self._thread = None
+        append_bus.subscribe(self._points_added)
+
+    def subscribe(self, selectors, next_t, delta_t, updates='bin'):
+        '''Return a ResultStream of ``(times, values)`` tuples, one for each
+        bin of width ``delta_t`` centered on ``next_t`` and later, produced
+        once the bin has ended.  With ``updates='point'``, the open bin is
+        also produced each time points are added to it.
+
+        Closing the stream ends the subscription.
+        '''
+        results = queue.Queue()
+        cancel = self.add_subscriber(selectors, next_t, delta_t, results.put,
+            updates=updates)
+        return ResultStream(results, cancel)
+
+    def add_subscriber(self, selectors, next_t, delta_t, callback,
+            updates='bin'):
+        '''Like subscribe(), but call ``callback`` with each result instead
+        of generating them.  Resampling errors are passed to ``callback`` as
+        the exception object.
+
+        ``callback`` is called from the scheduler thread or from threads
+        adding data, so it should only hand the result over, for example to
+        a queue.  If it raises an exception, the subscription is ended.
+        Returns a function that ends the subscription.
+        '''
+        key = (tuple((s.series_name, s.reduction, s.interpolation)
+            for s in selectors), delta_t, next_t % delta_t)
+        subscription = Subscription(next_t, updates, callback)
+        subscription.cancel = lambda: self._unsubscribe(key, subscription)
+
+        with self._condition:
+            group = self._groups.get(key)
+            if group is None:
+                group = TickGroup(selectors, next_t, delta_t)
+                self._groups[key] = group
+                for selector in selectors:
+                    self._series_groups.setdefault(selector.series_name,
+                        set()).add(group)
+            group.subscribers.add(subscription)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                    name='ln-continuous-scheduler')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+        return subscription.cancel
+
+    def _unsubscribe(self, key, subscription):
+        with self._condition:
+            group = self._groups.get(key)
+            if group is not None:
+                group.subscribers.discard(subscription)
+                if len(group.subscribers) == 0:
+                    del self._groups[key]
+                    for selector in group.selectors:
+                        groups = self._series_groups[selector.series_name]
+                        groups.discard(group)
+                        if len(groups) == 0:
+                            del self._series_groups[selector.series_name]
+
+    def _points_added(self, name, times, values):
+        if name not in self._series_groups:
+            return  # Nobody is following this series
+
+        with self._condition:
+            for group in self._series_groups.get(name, ()):
+                group.add_points(name, times, values)
+                subscribers = [s for s in group.subscribers
+                    if s.updates == 'point' and group.next_t >= s.next_t]
+                if len(subscribers) > 0 and times[-1] >= \
+                        group.next_t - group.delta_t // 2:
+                    self._updates.append((group, group.next_t,
+                        group.peek_bin(), subscribers))
+                    self._condition.notify()
+
+    def _deliver(self, group, tick, state, subscribers):
+        try:
+            result = bin_result(group.selectors, tick, group.delta_t, state)
+        except Exception as e:  # pylint: disable=broad-except
+            result = e
+        for subscription in subscribers:
+            try:
+                subscription.callback(result)
+            except Exception:  # pylint: disable=broad-except
+                # One broken subscriber must not stop the others, nor fail
+                # the thread adding data.
+                logger.exception('Ending continuous query subscription '
+                    'after its callback failed')
+                subscription.cancel()
+
+    def _run(self):
+        try:
+            self._run_ticks()
+        except:
+            logger.exception('Continuous query scheduler failed')
+            # Let the next subscription start a new thread
+            with self._condition:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+            raise
+
+    def _run_ticks(self):
+        while True:
+            with self._condition:
+                updates = self._wait_for_updates()
+                if updates is None:
+                    # Nothing to do until the next subscription
+                    self._thread = None
+                    return
+
+            for update in updates:
+                self._deliver(*update)
+
+    def _wait_for_updates(self):
+        '''Wait until updates of open bins are queued, or the open bin of a
+        group has ended, and return the arguments of _deliver() for each of
+        them.  Returns None once there are no groups left.  The caller must
+        hold ``_condition``.'''
+        while len(self._updates) == 0:
+            if len(self._groups) == 0:
+                return None
+
+            group = min(self._groups.values(), key=lambda g: g.due_time())
+            wait = (group.due_time() - now_epoch_us()) / float(US_PER_SECOND)
+            if wait > 0:
+                self._condition.wait(wait)
+                continue
+
+            tick = group.next_t
+            state = group.take_bin()
+            # Subscribers that joined after this bin already have it from
+            # their initial query.
+            subscribers = [s for s in group.subscribers if tick >= s.next_t]
+            for subscription in subscribers:
+                subscription.next_t = tick + group.delta_t
+            return [(group, tick, state, subscribers)]
+
+        updates = self._updates
+        self._updates = []
+        return updates
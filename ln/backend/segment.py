@@ -0,0 +1,359 @@
+'''Storage backend that writes each series to append-only binary files.
+
+Each series is stored in a directory as a set of segment files named after
+the integer id of the series:
+
+  * ``<id>.times``: int64 little-endian timestamps, microseconds since
+    the epoch.
+  * ``<id>.values``: packed little-endian values, one fixed-width record
+    per point for scalar and array types.  For blob types this holds the
+    concatenated blob contents instead.
+  * ``<id>.offsets``: (blob types only) int64 little-endian end offset of
+    each blob in the ``.values`` file.
+
+The list of series and their configuration is kept in ``series.json``.
+Queries read the segment files through ``numpy.memmap``, so resampling
+works directly on the operating system page cache without deserializing
+rows.
+'''
+
+from ln.backend.base import Backend, Blob
+from ln.backend.exception import BackendError, SeriesCreationError, \
+    SeriesDoesNotExistError, SeriesTimeOrderError, BadTypeError
+from ln.backend.datatype import parse_datatype, NUMPY_TYPE_MAPPING
+from ln.backend.compat import range
+from ln.backend.timestamp import to_epoch_us, as_epoch_us
+
+import os
+import json
+import threading
+import numpy as np
+
+CATALOG_FILENAME = 'series.json'
+TIME_DTYPE = np.dtype('<i8')
+
+
+def _map_file(filename, dtype, shape=()):
+    '''Memory map the complete records in ``filename`` read-only.'''
+    record_size = dtype.itemsize * int(np.prod(shape))
+    count = os.path.getsize(filename) // record_size
+    if count == 0:  # mmap cannot map an empty region
+        return np.empty((0,) + shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', shape=(count,) + shape)
+
+
+class SegmentBlob(Blob):
+    '''A blob stored in a segment file'''
+
+    def __init__(self, index, mimetype, series):
+        super(SegmentBlob, self).__init__(index, mimetype)
+        self._series = series
+
+    def get_bytes(self):
+        return self._series.read_blob(self.index)
+
+
+class SegmentSeries(object):
+    '''The segment files of one data series.'''
+
+    def __init__(self, path, id, datatype):
+        self.datatype = datatype
+        prefix = os.path.join(path, str(id))
+        self.times_filename = prefix + '.times'
+        self.values_filename = prefix + '.values'
+        self.offsets_filename = prefix + '.offsets'
+
+        if datatype.is_blob():
+            self.value_dtype = np.dtype('u1')
+            self.value_shape = ()
+        else:
+            self.value_dtype = np.dtype(NUMPY_TYPE_MAPPING[datatype.base]) \
+                .newbyteorder('<')
+            self.value_shape = datatype.shape or ()
+
+        filenames = [self.times_filename, self.values_filename]
+        if datatype.is_blob():
+            filenames.append(self.offsets_filename)
+        for filename in filenames:
+            open(filename, 'ab').close()
+
+        # Drop any partially written trailing point
+        times, _ = self.snapshot()
+        self.size = len(times)
+        self.last_time = times[-1] if self.size > 0 else None
+        if datatype.is_blob() and self.size > 0:
+            self.blob_end = int(self._blob_offsets()[self.size - 1])
+        else:
+            self.blob_end = 0
+        self._truncate()
+
+        # Files are opened for appending on first write
+        self._files = None
+
+    def _blob_offsets(self):
+        return _map_file(self.offsets_filename, TIME_DTYPE)
+
+    def _truncate(self):
+        with open(self.times_filename, 'r+b') as f:
+            f.truncate(self.size * TIME_DTYPE.itemsize)
+        if self.datatype.is_blob():
+            with open(self.offsets_filename, 'r+b') as f:
+                f.truncate(self.size * TIME_DTYPE.itemsize)
+            values_size = self.blob_end
+        else:
+            values_size = self.size * self.value_dtype.itemsize \
+                * int(np.prod(self.value_shape))
+        with open(self.values_filename, 'r+b') as f:
+            f.truncate(values_size)
+
+    def append(self, time, value):
+        '''Append one point and return its sequence number.'''
+        if self.last_time is not None and time < self.last_time:
+            raise SeriesTimeOrderError('New data point is chronologically before last point in series')
+
+        return self._write_points(np.array([time], dtype=TIME_DTYPE),
+            [value])[0]
+
+    def extend(self, times, values):
+        '''Append arrays of points and return their sequence numbers.'''
+        if len(times) != len(values):
+            raise BadTypeError('Number of times and values do not match')
+        if self.last_time is not None:
+            previous = np.array([self.last_time], dtype=TIME_DTYPE)
+        else:
+            previous = np.empty(0, dtype=TIME_DTYPE)
+        if np.any(np.diff(np.concatenate([previous, times])) < 0):
+            raise SeriesTimeOrderError('New data points are not in chronological order after last point in series')
+
+        return self._write_points(np.asarray(times, dtype=TIME_DTYPE), values)
+
+    def _write_points(self, times, values):
+        if self._files is None:
+            self._files = dict(times=open(self.times_filename, 'ab'),
+                values=open(self.values_filename, 'ab'))
+            if self.datatype.is_blob():
+                self._files['offsets'] = open(self.offsets_filename, 'ab')
+
+        # Values are written before the timestamps, so points only become
+        # visible to readers once they are complete.
+        if self.datatype.is_blob():
+            lengths = np.array([len(value) for value in values],
+                dtype=TIME_DTYPE)
+            self._write('values', b''.join(values))
+            offsets = self.blob_end + np.cumsum(lengths)
+            self.blob_end += int(lengths.sum())
+            self._write('offsets', offsets.astype(TIME_DTYPE).tobytes())
+        else:
+            self._write('values',
+                np.asarray(values, dtype=self.value_dtype).tobytes())
+        self._write('times', times.tobytes())
+
+        start = self.size
+        self.size += len(times)
+        if len(times) > 0:
+            self.last_time = times[-1]
+        return range(start, self.size)
+
+    def _write(self, column, data):
+        f = self._files[column]
+        f.write(data)
+        f.flush()
+
+    def snapshot(self):
+        '''Return memory-mapped timestamps and values of complete points.
+
+        For blob series, the values are the sequence numbers of the points.
+        '''
+        times = _map_file(self.times_filename, TIME_DTYPE)
+        if self.datatype.is_blob():
+            count = min(len(times), len(self._blob_offsets()))
+            return times[:count], np.arange(count)
+        values = _map_file(self.values_filename, self.value_dtype,
+            self.value_shape)
+        count = min(len(times), len(values))
+        return times[:count], values[:count]
+
+    def read_blob(self, index):
+        offsets = self._blob_offsets()
+        start = offsets[index - 1] if index > 0 else 0
+        contents = _map_file(self.values_filename, self.value_dtype)
+        return contents[start:offsets[index]].tobytes()
+
+    def close(self):
+        if self._files is not None:
+            for f in self._files.values():
+                f.close()
+            self._files = None
+
+
+class SegmentBackend(Backend):
+    '''Backend that stores data series in memory-mapped segment files'''
+
+    def __init__(self, path, query_workers=None, query_cache_size=None):
+        '''Open a segment file storage backend, creating it if needed.
+
+        :param path: Directory holding the segment files
+        :param query_workers: Number of threads that resample the selectors
+            of a query in parallel, or None for one at a time.
+        :param query_cache_size: Memory budget in bytes for cached query
+            results, or None to disable the query cache.
+        '''
+        super(SegmentBackend, self).__init__(query_workers=query_workers,
+            query_cache_size=query_cache_size)
+        self._path = path
+        self._lock = threading.Lock()
+        self._configs = []
+        self._series = {}
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        catalog_filename = os.path.join(path, CATALOG_FILENAME)
+        if os.path.exists(catalog_filename):
+            with open(catalog_filename, 'r') as f:
+                self._configs = json.load(f)['series']
+
+        for config in self._configs:
+            self._series[config['name']] = SegmentSeries(path, config['id'],
+                parse_datatype(config['type']))
+
+    def _write_catalog(self):
+        catalog_filename = os.path.join(self._path, CATALOG_FILENAME)
+        temp_filename = catalog_filename + '.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump(dict(series=self._configs), f)
+        os.rename(temp_filename, catalog_filename)
+
+    def _get_series(self, name):
+        try:
+            return self._series[name]
+        except KeyError:
+            raise SeriesDoesNotExistError('Series %s does not exist.' % name)
+
+    def _find_config(self, name):
+        for config in self._configs:
+            if config['name'] == name:
+                return config
+        return None
+
+    def close(self):
+        '''Close all open segment files.'''
+        with self._lock:
+            for series in self._series.values():
+                series.close()
+
+    def get_series_list(self):
+        with self._lock:
+            return [config['name'] for config in self._configs]
+
+    def create_series(self, name, type, reduction, interpolation, unit,
+            description, metadata):
+
+        # Raises exception if datatype is invalid
+        datatype = parse_datatype(type)
+
+        with self._lock:
+            if name in self._series:
+                raise SeriesCreationError('Series %s already exists.'
+                    % name)
+
+            id = len(self._configs)
+            self._series[name] = SegmentSeries(self._path, id, datatype)
+            self._configs.append(dict(id=id, name=name, type=type,
+                reduction=reduction, interpolation=interpolation, unit=unit,
+                description=description, metadata=metadata))
+            self._write_catalog()
+
+    def get_config(self, name):
+        with self._lock:
+            config = self._find_config(name)
+            if config is None:
+                return None
+            else:
+                config = dict(config)
+                del config['id']
+                return config
+
+    def update_config(self, name, unit=None, description=None, metadata=None):
+        with self._lock:
+            config = self._find_config(name)
+
+            if config is None:
+                raise SeriesDoesNotExistError('Series %s does not exist.' % name)
+
+            if unit is not None:
+                config['unit'] = unit
+            if description is not None:
+                config['description'] = description
+            if metadata is not None:
+                config['metadata'] = metadata
+            self._write_catalog()
+
+    def add_data(self, name, time, value):
+        series = self._get_series(name)
+        value = series.datatype.coerce(value)
+        time = as_epoch_us(time)
+        with self._lock:
+            sequence = series.append(time, value)
+            # Publish before releasing the lock, so appends are seen in order
+            self._notify_append(name, np.array([time]),
+                series.datatype.stack([value]))
+        return sequence
+
+    def add_data_many(self, name, times, values):
+        series = self._get_series(name)
+        values = series.datatype.coerce_many(values)
+        times = to_epoch_us(times)
+        with self._lock:
+            sequences = series.extend(times, values)
+            self._notify_append(name, times, values)
+        return sequences
+
+    def _make_value(self, series, sequence, value):
+        datatype = series.datatype
+        if datatype.is_blob():
+            return SegmentBlob(index=sequence, mimetype=datatype.mimetype,
+                series=series)
+        else:
+            return datatype.convert_to_jsonable(value)
+
+    def get_data(self, name, offset=None, limit=None, first=None,
+            last=None):
+        series = self._get_series(name)
+        times, values = series.snapshot()
+
+        start, stop, next_offset = self._select_points(times, offset, limit,
+            first, last)
+        out_values = [self._make_value(series, start + i, value)
+            for i, value in enumerate(values[start:stop])]
+        return times[start:stop], out_values, next_offset
+
+    def get_data_arrays(self, name, offset=None, limit=None, first=None,
+            last=None):
+        series = self._get_series(name)
+        datatype = series.datatype
+        if datatype.is_blob():
+            raise BackendError('Cannot read blob series as arrays.')
+        times, values = series.snapshot()
+
+        start, stop, next_offset = self._select_points(times, offset, limit,
+            first, last)
+        return times[start:stop], \
+            datatype.convert_to_array(values[start:stop]), next_offset
+
+    def _get_resampled_series(self, selectors, bin_edges, center_times):
+        def resample(selector):
+            datatype = selector.datatype
+            series = self._get_series(selector.series_name)
+            times, values = series.snapshot()
+
+            values, valid = selector.apply_strategies(bin_edges,
+                center_times, times, values, as_arrays=True)
+            if datatype.is_blob():
+                # Blobs may be reduced to their index in the series
+                values = datatype.stack([b'' if not is_valid
+                    else value if isinstance(value, bytes)
+                    else series.read_blob(value)
+                    for value, is_valid in zip(values, valid)])
+            return values, valid
+        return self._map_parallel(resample, selectors)
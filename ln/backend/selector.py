@@ -4,8 +4,11 @@ from ln.backend.exception import BadSelectorError
 from ln.backend.datatype import parse_datatype
 from ln.backend.reduction import REDUCTIONS
 from ln.backend.interpolation import INTERPOLATIONS
+from ln.backend.rollup import MERGES
 from ln.backend.compat import zip
 
+import numpy as np
+
 
 class Selector(object):
     '''A representation of a Natural Log selector.
@@ -36,38 +39,90 @@ class Selector(object):
         self.reduction_func = reduction_func
         self.interpolation_func = interpolation_func
 
-    def apply_strategies(self, center_times, point_groups):
-        '''Compute the resampled value for each point using the provided
-        groups of values.
+    def apply_strategies(self, bin_edges, center_times, times, values,
+            as_arrays=False):
+        '''Compute the resampled value for each bin from the raw points.
+
+        :bin_edges: int64 array of the ``nbins + 1`` bin boundaries, in
+            microseconds since the epoch.  Bin ``i`` covers the half-open
+            interval ``[bin_edges[i], bin_edges[i + 1])``.
+        :center_times: int64 array with the center of each bin.
+        :times: Sorted int64 array of raw point timestamps.
+        :values: Array of raw point values, indexed by point along the
+            first axis.
+        :as_arrays: Return the resampled values as arrays rather than a
+            list.
+
+        Returns: List of resampled values, with None for bins without a
+            value, or if ``as_arrays`` is set, a ``(values, valid)`` tuple of
+            an array of values indexed by bin along the first axis and a
+            boolean array of the bins that have a value.
+        '''
+        def reduce(start, stop, offsets, centers):
+            return self.reduction_func(times[start:stop], values[start:stop],
+                offsets, centers)
+
+        return self._resample(bin_edges, center_times, times, reduce,
+            as_arrays)
+
+    def can_use_rollup(self):
+        '''Return True if this selector can be computed from rollups.'''
+        return self.datatype.is_scalar() and self.reduction in MERGES
+
+    def apply_rollup(self, bin_edges, center_times, buckets,
+            as_arrays=False):
+        '''Compute the resampled value for each bin from rollup buckets.
+
+        :bin_edges: int64 array of bin boundaries, as in apply_strategies.
+        :center_times: int64 array with the center of each bin.
+        :buckets: ln.backend.rollup.Buckets sorted by start time.
+        :as_arrays: Return arrays, as in apply_strategies.
+
+        Returns: List of resampled values, or arrays as in apply_strategies.
+        '''
+        merge_func = MERGES[self.reduction]
+
+        def reduce(start, stop, offsets, centers):
+            return merge_func(buckets[start:stop], offsets)
+
+        return self._resample(bin_edges, center_times, buckets.start, reduce,
+            as_arrays)
 
-        :center_times: Array of datetime objects representing the center
-            of each time bin.
-        :point_groups: List of lists of raw points.  Each list element
-            (another list) corresponds to raw points in one time bin.  Each
-            raw point is a tuple of the form (datetime, value).
+    def _resample(self, bin_edges, center_times, times, reduce, as_arrays):
+        '''Reduce the items at ``times`` in each bin with ``reduce``, then
+        interpolate the empty bins.
 
-        Returns: List of resampled values.
+        ``reduce(start, stop, offsets, centers)`` is called once, for the
+        items ``start:stop``, and returns a value for each non-empty bin.
         '''
 
-        # First reduce each bin
-        reduced_values = []
-        for center_time, group in zip(center_times, point_groups):
-            if len(group) == 0:
-                reduced_values.append(None)
-            else:
-                times = []
-                values = []
-                for t, v in group:
-                    times.append(t)
-                    values.append(v)
-                reduced_value = self.reduction_func(times, values, center_time)
-                reduced_values.append(reduced_value)
+        # Locate the items in each bin.  Items outside the bins are
+        # dropped by slicing to the first and last boundaries.
+        bounds = np.searchsorted(times, bin_edges)
+        nonempty = np.flatnonzero(bounds[1:] > bounds[:-1])
+        start, stop = bounds[0], bounds[-1]
+
+        # First reduce all non-empty bins in one pass, into a dense array
+        # with a mask of the bins that have a value
+        valid = np.zeros(len(center_times), dtype=bool)
+        valid[nonempty] = True
+        if len(nonempty) > 0:
+            reduced = np.asarray(reduce(start, stop, bounds[nonempty] - start,
+                center_times[nonempty]))
+            values = np.zeros((len(center_times),) + reduced.shape[1:],
+                dtype=reduced.dtype)
+            values[nonempty] = reduced
+        else:
+            values = self.datatype.make_zeros(len(center_times))
 
         # Then interpolate empty bins
-        resampled_values = self.interpolation_func(reduced_values,
-            self.datatype, center_times)
+        values, valid = self.interpolation_func(values, valid, self.datatype,
+            center_times)
 
-        return resampled_values
+        if as_arrays:
+            return values, valid
+        return [value if is_valid else None
+            for value, is_valid in zip(values, valid)]
 
 
 def parse_selector(selector_string):
@@ -90,7 +145,8 @@ def parse_selector(selector_string):
              % selector_string)
 
 
-def create_selector(series_config, reduction=None, interpolation=None):
+def create_selector(series_config, reduction=None, interpolation=None,
+        datatype=None):
     '''Create a Selector representing the given parts.
 
     :param series_config: dict of series properties
@@ -98,9 +154,12 @@ def create_selector(series_config, reduction=None, interpolation=None):
         to select the default for this series.
     :param interpolation: String name of requested reduction strategy, or
         ``None`` to select the default for this series.
+    :param datatype: Parsed Datatype of the series, or ``None`` to parse it
+        from ``series_config``.
     '''
     name = series_config['name']
-    datatype = parse_datatype(series_config['type'])
+    if datatype is None:
+        datatype = parse_datatype(series_config['type'])
     if reduction is None:
         reduction = series_config['reduction']
     if interpolation is None:
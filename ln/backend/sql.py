@@ -1,31 +1,67 @@
-from sqlalchemy import create_engine, Column, Integer, String, \
-    DateTime, Float, LargeBinary, Text
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, \
+    DateTime, Float, LargeBinary, Text, Index
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.types import TypeDecorator
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import StaticPool
+from sqlalchemy import sql
 
 from ln.backend.base import Backend, Blob
-from ln.backend.exception import SeriesCreationError, \
-    SeriesDoesNotExistError, SeriesTimeOrderError, BadSelectorError
+from ln.backend.selector import create_selector
+from ln.backend.exception import BackendError, SeriesCreationError, \
+    SeriesDoesNotExistError, SeriesTimeOrderError, BadTypeError, \
+    BadSelectorError
 from ln.backend.datatype import parse_datatype
-from ln.backend.selector import parse_selector, create_selector
-from ln.backend.compat import get_total_seconds
+from ln.backend.compat import range, zip
+from ln.backend.timestamp import to_epoch_us, as_epoch_us, \
+    datetime_to_epoch_us
+from ln.backend.reduction import SELECTIONS
+from ln.backend import rollup
 
-from datetime import datetime
-import time
 from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
 import json
+import threading
 import numpy as np
 
+# Version of the database layout written by this module.  Older databases
+# are upgraded when opened, see SQLBackend._upgrade_schema().
+#   1: array values stored as JSON text
+#   2: array values stored as raw little-endian bytes
+#   3: timestamps stored as integer microseconds since the epoch
+#   4: sequence numbers unique within each series
+SCHEMA_VERSION = 4
+
+# Times a write is attempted when another writer to the same database has
+# extended the series since its tail was read.
+WRITE_ATTEMPTS = 3
+
+# Selection reductions (see ln.backend.reduction.SELECTIONS) look up their
+# points through the timestamp index when a query has more than this many
+# points per bin, instead of reading every point.
+SEEK_POINTS_PER_BIN = 16
+
+# Time ranges read in one query when fetching the raw points of the rollup
+# buckets that cross bin edges
+RANGES_PER_QUERY = 100
+
 ##### SQLAlchemy tables
 
 Base = declarative_base()
 
 
+class SchemaInfo(Base):
+    __tablename__ = 'schema_info'
+    key = Column(String, primary_key=True)
+    value = Column(String)
+
+
 class Series(Base):
     __tablename__ = 'series'
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    name = Column(String, unique=True, index=True)
     type = Column(String)
     reduction = Column(String)
     interpolation = Column(String)
@@ -49,7 +85,20 @@ class CommonData(object):
     id = Column(Integer, primary_key=True)
     name = Column(String)
     sequence = Column(Integer)
-    timestamp = Column(DateTime)
+    timestamp = Column(BigInteger)  # microseconds since the epoch
+
+    @declared_attr
+    def __table_args__(cls):
+        # Every lookup is scoped to one series, so lead each index with
+        # the series name to turn scans into bounded range scans.  Sequence
+        # numbers are unique, so a write based on a stale SeriesTail fails
+        # instead of corrupting the series.
+        return (
+            Index('ix_%s_name_sequence' % cls.__tablename__,
+                'name', 'sequence', unique=True),
+            Index('ix_%s_name_timestamp' % cls.__tablename__,
+                'name', 'timestamp'),
+        )
 
 
 class IntValues(CommonData, Base):
@@ -62,25 +111,11 @@ class FloatValues(CommonData, Base):
     value = Column(Float)
 
 
-class JsonArray(TypeDecorator):
-    '''Converts numpy array to JSON string for storage in text field.'''
-
-    impl = Text
-
-    def process_bind_param(self, value, dialect):
-        if value is not None:
-            value = json.dumps(np.asarray(value).tolist())
-        return value
-
-    def process_result_value(self, value, dialect):
-        if value is not None:
-            value = np.asarray(json.loads(value))
-        return value
-
-
 class ArrayValues(CommonData, Base):
+    '''Array values are stored as the raw little-endian bytes of the series
+    dtype, see Datatype.to_bytes().'''
     __tablename__ = 'array'
-    value = Column(JsonArray)
+    value = Column(LargeBinary)
 
 
 class BlobValues(CommonData, Base):
@@ -88,6 +123,29 @@ class BlobValues(CommonData, Base):
     value = Column(LargeBinary)
 
 
+class Rollup(Base):
+    '''One bucket of a rollup tier of a scalar series, see ln.backend.rollup.
+    ``interval`` is the width of the bucket in seconds, and times are in
+    microseconds since the epoch.'''
+    __tablename__ = 'rollup'
+    __table_args__ = (
+        Index('ix_rollup_name_interval_start', 'name', 'interval', 'start',
+            unique=True),
+    )
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    interval = Column(Integer)
+    start = Column(BigInteger)
+    count = Column(Integer)
+    sum = Column(Float)
+    min = Column(Float)
+    max = Column(Float)
+    first_time = Column(BigInteger)
+    first_value = Column(Float)
+    last_time = Column(BigInteger)
+    last_value = Column(Float)
+
+
 #####
 
 class SQLBlob(Blob):
@@ -105,23 +163,370 @@ class SQLBlob(Blob):
 
 
 
+class SeriesInfo(object):
+    '''Cached catalog entry for one data series.'''
+
+    def __init__(self, config, datatype, table):
+        self.config = config
+        self.datatype = datatype
+        self.table = table
+
+
+class SeriesTail(object):
+    '''The last point of a data series, used to allocate sequence numbers
+    and check time order without reading the value table.
+
+    ``lock`` must be held from reading the tail until the transaction that
+    extends the series has been committed.  The tail is only reread after
+    reset(), when a write found that another writer extended the series.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.timestamp = None
+        self.sequence = -1
+
+    def load(self, session, table, name):
+        '''Read the last point of the series, if not done already.'''
+        if self.loaded:
+            return
+
+        last_entry = session.query(table.timestamp, table.sequence) \
+            .filter_by(name=name).order_by(table.sequence.desc()).first()
+        if last_entry is not None:
+            self.timestamp = last_entry.timestamp
+            self.sequence = last_entry.sequence
+        self.loaded = True
+
+    def update(self, timestamp, sequence):
+        self.timestamp = timestamp
+        self.sequence = sequence
+
+    def reset(self):
+        '''Forget the last point, so the next load() reads it again.'''
+        self.loaded = False
+        self.timestamp = None
+        self.sequence = -1
+
 
 class SQLBackend(Backend):
     '''Backend based on SQLAlchemy'''
 
-    def __init__(self, url):
+    def __init__(self, url, resampling_intervals=None, query_workers=None,
+            query_cache_size=None):
         '''Connect to an SQL-based Natural Log storage backend.
 
         :param url: SQLAlchemy-format url
+        :param resampling_intervals: List of rollup intervals in seconds to
+            maintain for scalar series, or None to keep the intervals the
+            database was last opened with.  Rollups for new intervals are
+            built from the stored points.
+        :param query_workers: Number of threads, each with its own
+            connection, that read and resample the series of a query in
+            parallel, or None for one at a time.
+        :param query_cache_size: Memory budget in bytes for cached query
+            results, or None to disable the query cache.
         '''
-        super(Backend, self).__init__()
-        self._engine = create_engine(url)
+        super(SQLBackend, self).__init__(query_workers=query_workers,
+            query_cache_size=query_cache_size)
+        if self._is_in_memory(url):
+            # An in-memory SQLite database lives in a single connection, so
+            # share that connection between threads, and take turns using it.
+            self._engine = create_engine(url, poolclass=StaticPool,
+                connect_args={'check_same_thread': False})
+            self._session_lock = threading.RLock()
+        else:
+            self._engine = create_engine(url)
+            self._session_lock = None
         Base.metadata.create_all(self._engine)
+
+        # create_all() skips indexes on tables that already exist, so add
+        # any that are missing from databases created by older versions.
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=self._engine, checkfirst=True)
+
         self._sessionmaker = sessionmaker(bind=self._engine)
+        self._upgrade_schema()
+        self._configure_rollups(resampling_intervals)
+
+        # Catalog of series looked up so far, mapping name to SeriesInfo.
+        # The generation counter is bumped on every invalidation, so a
+        # lookup that raced with update_config() does not cache stale data.
+        self._catalog = {}
+        self._catalog_generation = 0
+        self._catalog_lock = threading.Lock()
+
+        # Tails of the series written so far, mapping name to SeriesTail.
+        # These assume this backend is the only writer to the database.
+        self._tails = {}
+
+    def _upgrade_schema(self):
+        '''Bring a database written by an older version of this module up
+        to SCHEMA_VERSION.
+
+        Migrations rewrite their rows in batches, each committed with a
+        record of its progress, so a large database is not rewritten in one
+        transaction, and an interrupted upgrade resumes where it stopped.
+        '''
+        with self.session_scope() as session:
+            info = session.query(SchemaInfo).get('version')
+            if info is None:
+                # Either a new database, or one from before versioning.  Both
+                # can be treated as version 1, since a new database has no
+                # rows to migrate.
+                info = SchemaInfo(key='version', value='1')
+                session.add(info)
+            version = int(info.value)
+
+        if version < 2:
+            self._migrate_json_arrays()
+            self._set_schema_version(2)
+        if version < 3:
+            self._migrate_datetimes()
+            self._set_schema_version(3)
+        if version < 4:
+            self._migrate_unique_sequences()
+            self._set_schema_version(4)
+
+    def _set_schema_version(self, version):
+        '''Record that the database is at ``version``, and drop the
+        progress of the migrations that led to it.'''
+        with self.session_scope() as session:
+            session.query(SchemaInfo).get('version').value = str(version)
+            session.query(SchemaInfo) \
+                .filter(SchemaInfo.key.like('upgrade:%')) \
+                .delete(synchronize_session=False)
+
+    def _migrate_rows(self, progress_key, legacy, update, convert,
+            batch_size):
+        '''Rewrite the rows of the table ``legacy`` in order of id,
+        ``batch_size`` at a time, each batch in its own transaction.
+
+        ``convert`` turns a list of rows into the parameters of the
+        ``update`` statement, leaving out rows that need no change.  The
+        last id rewritten is stored in the schema_info table under
+        ``progress_key`` with each batch.
+        '''
+        while True:
+            with self.session_scope() as session:
+                progress = session.query(SchemaInfo).get(progress_key)
+                if progress is None:
+                    progress = SchemaInfo(key=progress_key, value='-1')
+                    session.add(progress)
+                rows = session.execute(legacy.select()
+                    .where(legacy.c.id > int(progress.value))
+                    .order_by(legacy.c.id).limit(batch_size)).fetchall()
+                if len(rows) == 0:
+                    return
+                params = convert(rows)
+                if len(params) > 0:
+                    session.execute(update, params)
+                progress.value = str(rows[-1].id)
+
+    def _migrate_json_arrays(self, batch_size=1000):
+        '''Re-encode array values stored as JSON text as raw bytes.'''
+        # Read through a plain text column so the stored JSON is not
+        # interpreted as binary data.
+        legacy = sql.table(ArrayValues.__tablename__,
+            sql.column('id', Integer), sql.column('name', String),
+            sql.column('value', Text))
+        update = ArrayValues.__table__.update() \
+            .where(ArrayValues.id == sql.bindparam('row_id')) \
+            .values(value=sql.bindparam('new_value'))
+
+        with self.session_scope() as session:
+            datatypes = dict((series.name, parse_datatype(series.type))
+                for series in session.query(Series.name, Series.type))
+
+        def convert(rows):
+            params = []
+            for row in rows:
+                datatype = datatypes.get(row.name)
+                if datatype is None or not datatype.is_array():
+                    continue
+                params.append(dict(row_id=row.id,
+                    new_value=datatype.to_bytes(datatype.coerce(
+                        json.loads(row.value)))))
+            return params
+
+        self._migrate_rows('upgrade:2:' + ArrayValues.__tablename__, legacy,
+            update, convert, batch_size)
+
+    def _configure_rollups(self, intervals, batch_size=100000):
+        '''Set the rollup intervals, adding and removing tiers as needed.'''
+        with self.session_scope() as session:
+            info = session.query(SchemaInfo).get('rollup_intervals')
+            if info is None:
+                info = SchemaInfo(key='rollup_intervals', value='[]')
+                session.add(info)
+            current = json.loads(info.value)
+
+            if intervals is None:
+                self._rollup_intervals = current
+                return
+            self._rollup_intervals = sorted(set(int(i) for i in intervals))
+
+            removed = [i for i in current if i not in self._rollup_intervals]
+            if len(removed) > 0:
+                session.query(Rollup).filter(Rollup.interval.in_(removed)) \
+                    .delete(synchronize_session=False)
+
+            added = [i for i in self._rollup_intervals if i not in current]
+            if len(added) > 0:
+                self._build_rollups(session, added, batch_size)
+            info.value = json.dumps(self._rollup_intervals)
+
+    def _build_rollups(self, session, intervals, batch_size):
+        '''Build rollup tiers for ``intervals`` from the stored points.'''
+        for series in session.query(Series.name, Series.type):
+            datatype = parse_datatype(series.type)
+            if not datatype.is_scalar():
+                continue
+            table = self._pick_table(datatype)
+
+            # The last bucket of each batch may continue in the next batch,
+            # so it is held back until the following batch is merged in.
+            pending = dict((interval, None) for interval in intervals)
+            last_sequence = -1
+            while True:
+                rows = session.query(table.sequence, table.timestamp,
+                    table.value).filter(table.name == series.name,
+                    table.sequence > last_sequence) \
+                    .order_by(table.sequence).limit(batch_size).all()
+                if len(rows) == 0:
+                    break
+                sequences, times, values = zip(*rows)
+                times = np.asarray(times, dtype=np.int64)
+                values = np.asarray(values, dtype=np.float64)
+                last_sequence = sequences[-1]
+
+                for interval in intervals:
+                    buckets = rollup.aggregate(times, values, interval)
+                    if pending[interval] is not None:
+                        buckets = rollup.concatenate([pending[interval],
+                            buckets])
+                    self._insert_buckets(session, series.name, interval,
+                        buckets[:-1])
+                    pending[interval] = buckets[-1:]
+
+            for interval, buckets in pending.items():
+                if buckets is not None:
+                    self._insert_buckets(session, series.name, interval,
+                        buckets)
+
+    def _bucket_rows(self, name, interval, buckets):
+        rows = []
+        for i in range(len(buckets)):
+            rows.append(dict(name=name, interval=interval,
+                start=int(buckets.start[i]),
+                count=int(buckets.count[i]), sum=float(buckets.sum[i]),
+                min=float(buckets.min[i]), max=float(buckets.max[i]),
+                first_time=int(buckets.first_time[i]),
+                first_value=float(buckets.first_value[i]),
+                last_time=int(buckets.last_time[i]),
+                last_value=float(buckets.last_value[i])))
+        return rows
+
+    def _insert_buckets(self, session, name, interval, buckets):
+        if len(buckets) > 0:
+            session.execute(Rollup.__table__.insert(),
+                self._bucket_rows(name, interval, buckets))
+
+    def _update_rollups(self, session, name, tail, times, values):
+        '''Add new points to the rollups of a series within ``session``.
+
+        :param tail: SeriesTail of the series before the new points.
+        :param times: int64 array of the new point timestamps.
+        :param values: Array of the new point values.
+        '''
+        if len(times) == 0:
+            return
+
+        table = Rollup.__table__
+        values = np.asarray(values, dtype=np.float64)
+        for interval in self._rollup_intervals:
+            buckets = rollup.aggregate(times, values, interval)
+
+            # Points arrive in time order, so only the first bucket can
+            # already exist, as the last bucket of the series.
+            if tail.timestamp is not None and buckets.start[0] == \
+                    rollup.bucket_start(tail.timestamp, interval):
+                row = self._bucket_rows(name, interval, buckets[:1])[0]
+                session.execute(table.update().where(sql.and_(
+                    table.c.name == name, table.c.interval == interval,
+                    table.c.start == row['start'])).values(
+                        count=table.c.count + row['count'],
+                        sum=table.c.sum + row['sum'],
+                        min=sql.case((table.c.min < row['min'], table.c.min),
+                            else_=row['min']),
+                        max=sql.case((table.c.max > row['max'], table.c.max),
+                            else_=row['max']),
+                        last_time=row['last_time'],
+                        last_value=row['last_value']))
+                buckets = buckets[1:]
+
+            self._insert_buckets(session, name, interval, buckets)
+
+    def _migrate_datetimes(self, batch_size=1000):
+        '''Convert timestamps stored as DATETIME values to integer
+        microseconds since the epoch.
+
+        This relies on the column types of existing tables being advisory,
+        as they are in SQLite.
+        '''
+        columns = [(table, ['timestamp']) for table in
+            (IntValues, FloatValues, ArrayValues, BlobValues)]
+        columns.append((Rollup, ['start', 'first_time', 'last_time']))
+
+        for table, names in columns:
+            legacy = sql.table(table.__tablename__, sql.column('id', Integer),
+                *[sql.column(name, DateTime) for name in names])
+            update = table.__table__.update() \
+                .where(table.id == sql.bindparam('row_id')) \
+                .values(dict((name, sql.bindparam('new_' + name))
+                    for name in names))
+
+            def convert(rows, names=names):
+                params = []
+                for row in rows:
+                    param = dict(row_id=row.id)
+                    for name in names:
+                        param['new_' + name] = datetime_to_epoch_us(
+                            getattr(row, name))
+                    params.append(param)
+                return params
+
+            self._migrate_rows('upgrade:3:' + table.__tablename__, legacy,
+                update, convert, batch_size)
+
+    def _migrate_unique_sequences(self):
+        '''Replace the index on series name and sequence number of each
+        value table with a unique one.'''
+        for table in (IntValues, FloatValues, ArrayValues, BlobValues):
+            for index in table.__table__.indexes:
+                if not index.unique:
+                    continue
+                index.drop(bind=self._engine, checkfirst=True)
+                try:
+                    index.create(bind=self._engine)
+                except IntegrityError:
+                    raise BackendError('Cannot upgrade database: table "%s" '
+                        'has points with the same sequence number, written '
+                        'by more than one writer' % table.__tablename__)
+
+    @staticmethod
+    def _is_in_memory(url):
+        url = make_url(url)
+        return url.get_backend_name() == 'sqlite' \
+            and url.database in (None, '', ':memory:')
 
     @contextmanager
     def session_scope(self):
         '''Provide a transactional scope around a series of operations.'''
+        if self._session_lock is not None:
+            self._session_lock.acquire()
         session = self._sessionmaker()
         try:
             yield session
@@ -131,10 +536,65 @@ class SQLBackend(Backend):
             raise
         finally:
             session.close()
+            if self._session_lock is not None:
+                self._session_lock.release()
+
+    def _get_series_info(self, name):
+        '''Return the cached SeriesInfo of a series, reading it from the
+        database on first use.
+
+        Raises SeriesDoesNotExistError if the series does not exist.
+        '''
+        with self._catalog_lock:
+            info = self._catalog.get(name)
+        if info is not None:
+            return info
+
+        info = self._load_series_infos([name]).get(name)
+        if info is None:
+            raise SeriesDoesNotExistError('Series %s does not exist.' % name)
+        return info
+
+    def _load_series_infos(self, names):
+        '''Read the series in ``names`` that are not cached yet from the
+        database with one query, and return a dict of their SeriesInfo.'''
+        with self._catalog_lock:
+            missing = set(name for name in names if name not in self._catalog)
+            generation = self._catalog_generation
+        if len(missing) == 0:
+            return {}
+
+        # Missing series are not cached, since they may be created later
+        infos = {}
+        with self.session_scope() as session:
+            for series in session.query(Series).filter(
+                    Series.name.in_(missing)):
+                config = self._series_config(series)
+                datatype = parse_datatype(config['type'])
+                infos[series.name] = SeriesInfo(config, datatype,
+                    self._pick_table(datatype))
+
+        with self._catalog_lock:
+            if generation == self._catalog_generation:
+                self._catalog.update(infos)
+        return infos
+
+    def _get_tail(self, name):
+        with self._catalog_lock:
+            tail = self._tails.get(name)
+            if tail is None:
+                tail = self._tails[name] = SeriesTail()
+            return tail
+
+    def _invalidate_series_info(self, name):
+        with self._catalog_lock:
+            self._catalog.pop(name, None)
+            self._catalog_generation += 1
 
     def get_series_list(self):
         with self.session_scope() as session:
-            return [row.name for row in session.query(Series.name)]
+            return [row.name for row in
+                session.query(Series.name).order_by(Series.id)]
 
     def create_series(self, name, type, reduction, interpolation, unit,
             description, metadata):
@@ -152,18 +612,21 @@ class SQLBackend(Backend):
                 meta=metadata)
             session.add(series)
 
+        self._invalidate_series_info(name)
+
     def get_config(self, name):
-        with self.session_scope() as session:
-            series = session.query(Series).filter_by(name=name).first()
-            if series is None:
-                return None
-            else:
-                config = dict([(k, getattr(series, k)) for k in
-                    ('name', 'type', 'reduction',
-                    'interpolation', 'unit', 'description')])
-                # "metadata" is used by SQLAlchemy, so the field is named "meta"
-                config['metadata'] = series.meta
-                return config
+        try:
+            return dict(self._get_series_info(name).config)
+        except SeriesDoesNotExistError:
+            return None
+
+    def _series_config(self, series):
+        config = dict([(k, getattr(series, k)) for k in
+            ('name', 'type', 'reduction',
+            'interpolation', 'unit', 'description')])
+        # "metadata" is used by SQLAlchemy, so the field is named "meta"
+        config['metadata'] = series.meta
+        return config
 
     def update_config(self, name, unit=None, description=None, metadata=None):
         with self.session_scope() as session:
@@ -179,6 +642,8 @@ class SQLBackend(Backend):
             if metadata is not None:
                 series.meta = metadata
 
+        self._invalidate_series_info(name)
+
     def _pick_table(self, datatype):
         # select table based on type
         if datatype.is_int_scalar():
@@ -191,44 +656,176 @@ class SQLBackend(Backend):
             return BlobValues
 
     def add_data(self, name, time, value):
-        with self.session_scope() as session:
-            config = session.query(Series.name, Series.type).filter_by(name=name).first()
-
-            if config is None:
-                raise SeriesDoesNotExistError('Series %s does not exist.' % name)
+        info = self._get_series_info(name)
+        datatype = info.datatype
+        table = info.table
+        value = datatype.coerce(value)
+        time = as_epoch_us(time)
+        tail = self._get_tail(name)
+        points = (np.array([time]), datatype.stack([value]))
 
-            datatype = parse_datatype(config.type)
-            value = datatype.coerce(value)
-            table = self._pick_table(datatype)
+        if datatype.is_array():
+            value = datatype.to_bytes(value)
 
-            # get last entry for this series (if exists)
-            last_entry = session.query(table.timestamp, table.sequence) \
-                .filter_by(name=name).order_by(table.timestamp.desc()).first()
+        def write(session):
+            tail.load(session, table, name)
 
             # compute new sequence number
-            if last_entry is None:
-                sequence = 0
-            else:
-                if last_entry.timestamp > time:
-                    raise SeriesTimeOrderError('New data point is chronologically before last point in series')
-                sequence = last_entry.sequence + 1
+            if tail.timestamp is not None and tail.timestamp > time:
+                raise SeriesTimeOrderError('New data point is chronologically before last point in series')
+            sequence = tail.sequence + 1
 
             # create new entry
             entry = table(name=name, sequence=sequence, timestamp=time,
                 value=value)
             session.add(entry)
+
+            if datatype.is_scalar() and len(self._rollup_intervals) > 0:
+                self._update_rollups(session, name, tail,
+                    np.array([time]), [value])
             return sequence
 
-    def get_data(self, name, offset=None, limit=None):
-        with self.session_scope() as session:
-            config = session.query(Series.name, Series.type).filter_by(name=name).first()
+        with tail.lock:
+            sequence = self._write([tail], write)
 
-            if config is None:
-                raise SeriesDoesNotExistError('Series %s does not exist.' % name)
+            # Only advance the tail once the point has been committed
+            tail.update(time, sequence)
+            self._notify_append(name, *points)
+            return sequence
 
-            datatype = parse_datatype(config.type)
-            table = self._pick_table(datatype)
+    def add_data_many(self, name, times, values):
+        info = self._get_series_info(name)
+        tail = self._get_tail(name)
+
+        with tail.lock:
+            sequences, points = self._write([tail], lambda session:
+                self._add_batch(session, info, name, tail, times, values))
+            if len(sequences) > 0:
+                tail.update(int(points[0][-1]), sequences[-1])
+                self._notify_append(name, *points)
+            return sequences
+
+    def add_data_multi(self, batches):
+        results = {}
+        tails = {}
+        for name in batches:
+            try:
+                tails[name] = (self._get_series_info(name),
+                    self._get_tail(name))
+            except BackendError as e:
+                results[name] = e
+
+        # Lock the tails in a fixed order so concurrent calls cannot deadlock
+        locks = [tails[name][1].lock for name in sorted(tails)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            def write(session):
+                added = {}
+                for name, (info, tail) in tails.items():
+                    times, values = batches[name]
+                    # _add_batch validates everything before it writes, so a
+                    # failed batch leaves nothing behind in the transaction.
+                    try:
+                        results[name], added[name] = self._add_batch(session,
+                            info, name, tail, times, values)
+                    except BackendError as e:
+                        results[name] = e
+                return added
+
+            added = self._write([tail for _, tail in tails.values()], write)
+            for name, points in added.items():
+                sequences = results[name]
+                if len(sequences) > 0:
+                    tails[name][1].update(int(points[0][-1]), sequences[-1])
+                    self._notify_append(name, *points)
+        finally:
+            for lock in locks:
+                lock.release()
+        return results
+
+    def _write(self, tails, write):
+        '''Call ``write(session)`` in a transaction and return its result.
+
+        The caller must hold the locks of ``tails``, the SeriesTails of the
+        series written.  If another writer to the database extended one of
+        them since its tail was read, the unique sequence numbers make the
+        transaction fail.  The tails are then read again and the write
+        retried, so it is either added after the other writer's points, or
+        rejected with SeriesTimeOrderError.
+        '''
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                with self.session_scope() as session:
+                    return write(session)
+            except IntegrityError:
+                if attempt == WRITE_ATTEMPTS - 1:
+                    raise
+                for tail in tails:
+                    tail.reset()
+
+    def _add_batch(self, session, info, name, tail, times, values):
+        '''Insert a batch of points for one series within ``session``.
+
+        The caller must hold ``tail.lock``, and update the tail once the
+        transaction has been committed.
+
+        Returns the range of new sequence numbers, and a tuple of the int64
+        times and coerced values of the new points.
+        '''
+        datatype = info.datatype
+        table = info.table
+        values = datatype.coerce_many(values)
+        if len(times) != len(values):
+            raise BadTypeError('Number of times and values do not match')
+
+        tail.load(session, table, name)
+
+        # Check the time order of the whole batch at once
+        times = to_epoch_us(times)
+        if tail.timestamp is not None:
+            ordered = np.concatenate([[tail.timestamp], times])
+        else:
+            ordered = times
+        if np.any(np.diff(ordered) < 0):
+            raise SeriesTimeOrderError('New data points are not in chronological order after last point in series')
+
+        # allocate sequence numbers for the batch
+        first_sequence = tail.sequence + 1
+        sequences = range(first_sequence, first_sequence + len(values))
+
+        if datatype.is_scalar() and len(self._rollup_intervals) > 0:
+            self._update_rollups(session, name, tail, times, values)
+
+        # insert all rows with a single executemany
+        if datatype.is_array():
+            rows = [datatype.to_bytes(value) for value in values]
+        else:
+            rows = values.tolist()
+        if len(rows) > 0:
+            session.execute(table.__table__.insert(),
+                [dict(name=name, sequence=sequence, timestamp=time,
+                    value=value)
+                for sequence, time, value in zip(sequences, times.tolist(),
+                    rows)])
+        return sequences, (times, values)
+
+    def _make_value(self, name, datatype, sequence, value):
+        if datatype.is_blob():
+            return SQLBlob(index=sequence, mimetype=datatype.mimetype,
+                series_name=name, backend=self)
+        elif datatype.is_array():
+            return datatype.convert_to_jsonable(datatype.from_bytes(value))
+        else:
+            return datatype.convert_to_jsonable(value)
 
+    def get_data(self, name, offset=None, limit=None, first=None,
+            last=None):
+        info = self._get_series_info(name)
+        datatype = info.datatype
+        table = info.table
+
+        with self.session_scope() as session:
             # Select appropriate columns from table
             if datatype.is_blob():
                 query = session.query(table.sequence, table.timestamp)\
@@ -236,146 +833,339 @@ class SQLBackend(Backend):
             else:
                 query = session.query(table.sequence, table.timestamp, table.value)\
                     .filter_by(name=name)
+            rows, next_offset = self._select_rows(session, table, name,
+                query, offset, limit, first, last)
 
-            # Decide how many entries to fetch
-            if offset == None:  # get last entry
-                row = query.order_by(table.sequence.desc()).first()
+            times = np.array([row.timestamp for row in rows],
+                dtype=np.int64)
+            values = [self._make_value(name, datatype, row.sequence,
+                getattr(row, 'value', None)) for row in rows]
 
-                if row is None:
-                    return [], [], None  # No entry to return
-                elif datatype.is_blob():
-                    value = SQLBlob(index=row.sequence, mimetype=datatype.mimetype,
-                        series_name=name, backend=self)
-                else:
-                    value = datatype.convert_to_jsonable(row.value)
-
-                return [row.timestamp], [value], None
-            else:
-                query = query.order_by(table.sequence)
+            return times, values, next_offset
 
-                # Apply limits and decide what the next sequence number is, if any
-                if limit is None:
-                    rows = query[offset:]
-                    next_offset = None
-                else:
-                    rows = query[offset:offset + limit + 1]
-                    if len(rows) > limit:
-                        next_offset = rows[-1].sequence
-                    else:
-                        next_offset = None
-                    rows = rows[:limit]
-
-                times = []
-                values = []
+    def get_data_arrays(self, name, offset=None, limit=None, first=None,
+            last=None):
+        info = self._get_series_info(name)
+        datatype = info.datatype
+        table = info.table
+        if datatype.is_blob():
+            raise BackendError('Cannot read blob series as arrays.')
 
-                for row in rows:
-                    times.append(row.timestamp)
-                    if datatype.is_blob():
-                        value = SQLBlob(index=row.sequence,
-                            mimetype=datatype.mimetype,
-                            series_name=name, backend=self)
-                    else:
-                        value = datatype.convert_to_jsonable(row.value)
-                    values.append(value)
-
-                return times, values, next_offset
-
-    def _get_resampled_series(self, selectors, bin_lower, bin_upper, bin_center):
-        '''Return the resampled points for the given selectors using the list
-        of datetimes provided in bin_lower and bin_upper.
-
-        :param selectors: list of Selector objects
-        :param bin_lower: list of datetimes representing lower bin boundaries
-        :param bin_upper: list of datetimes representing upper bin boundaries
-        :param bin_center: list of datetimes representing the center of each bin
-
-        Returns: List of lists of resampled points.  Top level list is indexed
-        by selector, and each sublist is the list of points in the order
-        of the bin boundaries.
-        '''
         with self.session_scope() as session:
-            resampled_series = []
-            for selector in selectors:
-                table = self._pick_table(selector.datatype)
-                raw_values = session.query(table.timestamp, table.value) \
-                    .order_by(table.sequence).filter(
-                        table.timestamp >= bin_lower[0],
-                        table.timestamp < bin_upper[-1]
-                    ).all()
-
-                groups = [[] for i in range(len(bin_lower))]
-                current_group = 0
-                for row in raw_values:
-                    while row.timestamp >= bin_upper[current_group]:
-                        current_group += 1
-                    groups[current_group].append((row.timestamp, row.value))
-
-                resampled_points = [selector.datatype.convert_to_jsonable(value)
-                    for value in selector.apply_strategies(bin_center, groups)]
-                resampled_series.append(resampled_points)
-            return resampled_series
-
-    def _query(self, selectors, first, last, npoints):
-        '''Common core of query implementation shared between ``query``
-        and ``query_continuous``.
-
-        Returns: list of timestamps, list of resampled series (each a list of
-            resampled points), list of Selector objects,
-            timedelta between timestamps
-        '''
+            query = session.query(table.sequence, table.timestamp,
+                table.value).filter_by(name=name)
+            rows, next_offset = self._select_rows(session, table, name,
+                query, offset, limit, first, last)
+
+            times, values = self._rows_to_arrays(datatype,
+                [(row.timestamp, row.value) for row in rows])
+            return times, datatype.convert_to_array(values), next_offset
+
+    def _select_rows(self, session, table, name, query, offset, limit,
+            first, last):
+        '''Run ``query`` for the rows ``get_data`` returns, in sequence
+        order.
+
+        Returns ``(rows, resume)``, where resume is the sequence number of
+        the next row, or None if there are no more rows.'''
+        # Decide how many entries to fetch
+        if offset is None and first is None and last is None:
+            # get last entry
+            row = query.order_by(table.sequence.desc()).first()
+            return ([] if row is None else [row]), None
+
+        # Points are in time order, so time bounds become a range
+        # of sequence numbers.  Pages then start with an index seek
+        # to their first sequence number, rather than skipping over
+        # all the earlier points with OFFSET.
+        start = offset or 0
+        if first is not None:
+            start = max(start, self._sequence_at(session, table,
+                name, first))
+        query = query.filter(table.sequence >= start)
+        if last is not None:
+            query = query.filter(table.sequence
+                < self._sequence_at(session, table, name, last))
+        query = query.order_by(table.sequence)
+
+        # Apply limits and decide what the next sequence number is, if any
+        if limit is None:
+            return query.all(), None
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            return rows[:limit], rows[-1].sequence
+        return rows, None
+
+    def _sequence_at(self, session, table, name, time):
+        '''Return the sequence number of the first point of a series at or
+        after ``time``, or the next sequence number if there is none.'''
+        row = session.query(table.sequence).filter(table.name == name,
+                table.timestamp >= as_epoch_us(time)) \
+            .order_by(table.timestamp, table.sequence).first()
+        if row is not None:
+            return row.sequence
+        row = session.query(table.sequence).filter(table.name == name) \
+            .order_by(table.sequence.desc()).first()
+        return 0 if row is None else row.sequence + 1
+
+    def _create_selector(self, name, reduction, interpolation):
+        try:
+            info = self._get_series_info(name)
+        except SeriesDoesNotExistError:
+            raise BadSelectorError('Unknown series name "%s"' % name)
 
-        # Parse selectors
-        selector_objs = []
-        for selector in selectors:
-            name, reduce_strategy, interp_strategy = parse_selector(selector)
-            config = self.get_config(name)
-            if config is None:
-                raise BadSelectorError('Unknown series name "%s"' % name)
-
-            selector_obj = create_selector(series_config=config,
-                reduction=reduce_strategy, interpolation=interp_strategy)
-            selector_objs.append(selector_obj)
-
-        # Compute bin boundaries
-        bin_half_delta = (last - first) / ((npoints - 1) * 2)
-        bin_boundaries = [first + bin_half_delta * (2 * i - 1)
-            for i in range(npoints + 1)]
-        bin_centers = [first + bin_half_delta * (2 * i)
-            for i in range(npoints)]
-
-        # Collect and resample points for each series
-        resampled_series = self._get_resampled_series(selector_objs,
-            bin_boundaries[:-1], bin_boundaries[1:], bin_centers)
-
-        return bin_centers, resampled_series, selector_objs, 2 * bin_half_delta
-
-    def query(self, selectors, first, last, npoints):
-        times, values, _, _ = self._query(selectors, first, last, npoints)
-        return times, values
+        return create_selector(series_config=info.config, reduction=reduction,
+            interpolation=interpolation, datatype=info.datatype)
 
-    def _generate_values(self, selectors, next_t, delta_t):
-        '''Generate new query results every delta_t interval.'''
+    def _create_selectors(self, parsed_selectors):
+        # Look up all of the series at once before creating the selectors
+        self._load_series_infos([name for name, _, _ in parsed_selectors])
+        return super(SQLBackend, self)._create_selectors(parsed_selectors)
 
-        while True:
-            next_query_time = next_t + delta_t / 2
-            sleep_time = get_total_seconds(next_query_time - datetime.now())
-            if sleep_time > 0:
-                time.sleep(sleep_time)
+    def _get_resampled_series(self, selectors, bin_edges, center_times):
+        interval = rollup.pick_interval(self._rollup_intervals, bin_edges)
 
-            bin_lower = [next_t - delta_t / 2]
-            bin_upper = [next_t + delta_t / 2]
-            bin_center = [next_t]
+        with self.session_scope() as session:
+            # Decide how to resample each selector, collecting the series
+            # that need raw points from each value table, and rollups.
+            methods = []
+            raw_series = {}
+            rollup_series = {}
+            for selector in selectors:
+                name = selector.series_name
+                if interval is not None and selector.can_use_rollup():
+                    methods.append('rollup')
+                    table = self._pick_table(selector.datatype)
+                    rollup_series.setdefault(table, {})[name] = \
+                        selector.datatype
+                elif selector.reduction in SELECTIONS and \
+                        self._count_points(session, selector, bin_edges) \
+                        > SEEK_POINTS_PER_BIN * len(center_times):
+                    methods.append('seek')
+                else:
+                    methods.append('raw')
+                    table = self._pick_table(selector.datatype)
+                    raw_series.setdefault(table, {})[name] = \
+                        selector.datatype
+
+        # Fetch the points of all series in a table with one scan per time
+        # slice, the rollups with one more query, plus the raw points of the
+        # buckets crossing bin edges, and each seek selector on its own.
+        # These are independent, so they run on the query workers.
+        jobs = []
+        slices = self._time_slices(bin_edges)
+        for table, datatypes in raw_series.items():
+            for slice_edges in slices:
+                jobs.append(('raw', (self._fetch_points, table, datatypes,
+                    slice_edges)))
+        if len(rollup_series) > 0:
+            names = set(name for datatypes in rollup_series.values()
+                for name in datatypes)
+            jobs.append(('rollup', (self._fetch_buckets, names, interval,
+                bin_edges)))
+            lo, hi = rollup.partial_ranges(bin_edges, interval)
+            for start in range(0, len(lo), RANGES_PER_QUERY):
+                stop = start + RANGES_PER_QUERY
+                for table, datatypes in rollup_series.items():
+                    jobs.append(('partial', (self._fetch_ranges, table,
+                        datatypes, lo[start:stop], hi[start:stop])))
+        for index, (selector, method) in enumerate(zip(selectors, methods)):
+            if method == 'seek':
+                jobs.append((index, (self._resample_seek, selector,
+                    bin_edges, center_times)))
+        results = self._map_parallel(self._run_in_session,
+            [job for _, job in jobs])
+
+        # Slices are fetched in time order, so joining them keeps the
+        # points of each series sorted.
+        slice_points = {}
+        partial_points = {}
+        buckets = {}
+        seek_values = {}
+        for (kind, _), result in zip(jobs, results):
+            if kind == 'raw':
+                for name, arrays in result.items():
+                    slice_points.setdefault(name, []).append(arrays)
+            elif kind == 'partial':
+                for name, arrays in result.items():
+                    partial_points.setdefault(name, []).append(arrays)
+            elif kind == 'rollup':
+                buckets = result
+            else:
+                seek_values[kind] = result
+
+        def resample(index):
+            selector = selectors[index]
+            name = selector.series_name
+            method = methods[index]
+            if method == 'rollup':
+                series_buckets = rollup.combine(
+                    [rollup.whole_buckets(buckets[name], bin_edges, interval)]
+                    + [rollup.from_points(times, raw_values)
+                        for times, raw_values in partial_points.get(name, [])])
+                return selector.apply_rollup(bin_edges, center_times,
+                    series_buckets, as_arrays=True)
+            elif method == 'seek':
+                return seek_values[index]
+            else:
+                parts = slice_points[name]
+                if len(parts) == 1:
+                    times, raw_values = parts[0]
+                else:
+                    times = np.concatenate([part[0] for part in parts])
+                    raw_values = np.concatenate([part[1] for part in parts])
+                return selector.apply_strategies(bin_edges, center_times,
+                    times, raw_values, as_arrays=True)
+        return self._map_parallel(resample, range(len(selectors)))
+
+    def _run_in_session(self, job):
+        '''Call ``job[0]`` with a new session and the rest of ``job`` as
+        arguments, so that each query worker has its own connection.'''
+        func, args = job[0], job[1:]
+        with self.session_scope() as session:
+            return func(session, *args)
 
-            resampled_series = self._get_resampled_series(selectors,
-                bin_lower, bin_upper, bin_center)
-            yield bin_center, resampled_series
+    def _time_slices(self, bin_edges):
+        '''Split bin edges into one contiguous run of bins per query
+        worker, returning the edges of each run.'''
+        nbins = len(bin_edges) - 1
+        count = max(1, min(self._query_workers, nbins))
+        bounds = np.linspace(0, nbins, count + 1).astype(int)
+        return [bin_edges[lo:hi + 1] for lo, hi in zip(bounds[:-1],
+            bounds[1:])]
 
-            next_t = next_t + delta_t
+    def _fetch_points(self, session, table, datatypes, bin_edges):
+        '''Read the points between the first and last bin edges of several
+        series stored in ``table`` with one query.
 
-    def query_continuous(self, selectors, first, npoints):
-        last = datetime.now()
-        times, values, selector_objs, delta_t = self._query(selectors, first,
-            last, npoints)
-        gen = self._generate_values(selector_objs, last + delta_t, delta_t)
+        :param datatypes: dict mapping series name to Datatype
 
-        return times, values, gen
+        Returns a dict mapping series name to arrays ``(times, values)``.
+        '''
+        rows = session.query(table.name, table.timestamp, table.value) \
+            .filter(
+                table.name.in_(list(datatypes)),
+                table.timestamp >= int(bin_edges[0]),
+                table.timestamp < int(bin_edges[-1])
+            ).order_by(table.name, table.timestamp, table.sequence).all()
+        return self._split_rows(datatypes, rows)
+
+    def _fetch_ranges(self, session, table, datatypes, lo, hi):
+        '''Like ``_fetch_points``, but read the points in the half-open time
+        ranges ``[lo[i], hi[i])`` rather than between two bin edges.'''
+        rows = session.query(table.name, table.timestamp, table.value) \
+            .filter(
+                table.name.in_(list(datatypes)),
+                sql.or_(*[sql.and_(table.timestamp >= int(range_lo),
+                    table.timestamp < int(range_hi))
+                    for range_lo, range_hi in zip(lo, hi)])
+            ).order_by(table.name, table.timestamp, table.sequence).all()
+        return self._split_rows(datatypes, rows)
+
+    def _split_rows(self, datatypes, rows):
+        '''Split ``(name, timestamp, value)`` rows sorted by series into a
+        dict mapping series name to arrays ``(times, values)``.'''
+        # Rows are sorted by series, so split them at each change of name
+        series_rows = dict((name, []) for name in datatypes)
+        for name, group in groupby(rows, key=itemgetter(0)):
+            series_rows[name] = [row[1:] for row in group]
+        return dict((name, self._rows_to_arrays(datatypes[name], rows))
+            for name, rows in series_rows.items())
+
+    def _rows_to_arrays(self, datatype, rows):
+        '''Convert ``(timestamp, value)`` rows to arrays of times and values
+        all at once.'''
+        if len(rows) > 0:
+            raw_times, raw_values = zip(*rows)
+        else:
+            raw_times, raw_values = [], []
+        times = np.array(raw_times, dtype=np.int64)
+        if datatype.is_array():
+            # Decode all the stored arrays with a single copy
+            values = datatype.from_bytes(b''.join(raw_values),
+                count=len(raw_values))
+        else:
+            values = datatype.stack(raw_values)
+        return times, values
+
+    def _seek(self, session, table, name, lo, hi, order, columns):
+        '''Return ``columns`` of the first point in ``[lo, hi)`` by
+        ``order``, or None if there is no point in that range.'''
+        return session.query(*columns).filter(table.name == name,
+            table.timestamp >= int(lo), table.timestamp < int(hi)) \
+            .order_by(*order).first()
+
+    def _count_points(self, session, selector, bin_edges):
+        '''Count the points of a series between the first and last bin
+        edges from the sequence numbers of the points at both ends.'''
+        table = self._pick_table(selector.datatype)
+        name = selector.series_name
+        columns = (table.sequence,)
+        first = self._seek(session, table, name, bin_edges[0], bin_edges[-1],
+            (table.timestamp, table.sequence), columns)
+        if first is None:
+            return 0
+        last = self._seek(session, table, name, bin_edges[0], bin_edges[-1],
+            (table.timestamp.desc(), table.sequence.desc()), columns)
+        return last.sequence - first.sequence + 1
+
+    def _resample_seek(self, session, selector, bin_edges, center_times):
+        '''Resample a selection reduction from the few points in each bin it
+        can choose between, found with one or two index lookups per bin.'''
+        table = self._pick_table(selector.datatype)
+        name = selector.series_name
+        columns = (table.timestamp, table.value)
+        earliest = (table.timestamp, table.sequence)
+        latest = (table.timestamp.desc(), table.sequence.desc())
+        # The earliest of several points sharing the latest timestamp,
+        # which is the point the closest reduction would choose.
+        latest_first = (table.timestamp.desc(), table.sequence)
+
+        rows = []
+        for lo, hi, center in zip(bin_edges[:-1], bin_edges[1:],
+                center_times):
+            if selector.reduction == 'first':
+                candidates = [self._seek(session, table, name, lo, hi,
+                    earliest, columns)]
+            elif selector.reduction == 'last':
+                candidates = [self._seek(session, table, name, lo, hi,
+                    latest, columns)]
+            else:  # closest: the points on either side of the center
+                candidates = [
+                    self._seek(session, table, name, lo, center,
+                        latest_first, columns),
+                    self._seek(session, table, name, center, hi, earliest,
+                        columns)]
+            rows.extend(row for row in candidates if row is not None)
+
+        # Reducing the candidates picks the same points as reducing the
+        # whole range would.
+        times, values = self._rows_to_arrays(selector.datatype, rows)
+        return selector.apply_strategies(bin_edges, center_times, times,
+            values, as_arrays=True)
+
+    def _fetch_buckets(self, session, names, interval, bin_edges):
+        '''Read the rollup buckets of several series that start between
+        the first and last bin edges with one query.
+
+        Returns a dict mapping series name to rollup.Buckets.
+        '''
+        rows = session.query(Rollup.name, *[getattr(Rollup, field)
+                for field in rollup.FIELDS]) \
+            .filter(
+                Rollup.name.in_(list(names)),
+                Rollup.interval == interval,
+                Rollup.start >= int(bin_edges[0]),
+                Rollup.start < int(bin_edges[-1])
+            ).order_by(Rollup.name, Rollup.start).all()
+
+        series_rows = dict((name, []) for name in names)
+        for name, group in groupby(rows, key=itemgetter(0)):
+            series_rows[name] = [row[1:] for row in group]
+
+        buckets = {}
+        for name, rows in series_rows.items():
+            columns = dict(zip(rollup.FIELDS, zip(*rows) if len(rows) > 0
+                else [[]] * len(rollup.FIELDS)))
+            buckets[name] = rollup.Buckets(**columns)
+        return buckets
@@ -0,0 +1,61 @@
+'''Conversion between datetime objects and integer epoch timestamps.
+
+Backends represent times internally as int64 microseconds since the epoch.
+Naive datetimes are treated as UTC.
+'''
+
+from datetime import datetime, timedelta
+import time
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+US_PER_SECOND = 10**6
+
+
+def to_epoch_us(times):
+    '''Convert a sequence of naive datetime objects or integer epoch
+    timestamps to an int64 array of microseconds since the epoch.'''
+    return np.array(times, dtype='datetime64[us]').astype(np.int64)
+
+
+def datetime_to_epoch_us(dt):
+    '''Convert a single naive datetime to integer microseconds since the
+    epoch.'''
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * US_PER_SECOND \
+        + delta.microseconds
+
+
+def as_epoch_us(time):
+    '''Convert a datetime or integer epoch timestamp to integer
+    microseconds since the epoch.'''
+    if isinstance(time, datetime):
+        return datetime_to_epoch_us(time)
+    else:
+        return int(time)
+
+
+def now_epoch_us():
+    '''Return the current UTC time in microseconds since the epoch.'''
+    return int(round(time.time() * US_PER_SECOND))
+
+
+def epoch_us_to_datetime(us):
+    '''Convert integer microseconds since the epoch to a naive datetime.'''
+    return EPOCH + timedelta(microseconds=int(us))
+
+
+def format_epoch_us(times, sep='T'):
+    '''Format integer epoch timestamps as a list of ISO 8601 strings.
+
+    The strings match ``datetime.isoformat(sep)``, so fractional seconds
+    are only included when they are not zero.
+    '''
+    times = np.asarray(times, dtype=np.int64)
+    datetimes = times.astype('datetime64[us]')
+    strings = np.where(times % US_PER_SECOND == 0,
+        np.datetime_as_string(datetimes, unit='s'),
+        np.datetime_as_string(datetimes, unit='us'))
+    if sep != 'T':
+        return [s.replace('T', sep, 1) for s in strings.tolist()]
+    return strings.tolist()
@@ -0,0 +1,120 @@
+'''Binary encodings of query results and raw data.
+
+Clients that load results into NumPy can ask for these formats in the
+``Accept`` header of ``/query`` and ``/data`` requests, instead of JSON.
+Responses are encoded as a list of named columns, each a NumPy array
+indexed by point along the first axis:
+
+* ``application/x-npz``: a NumPy ``.npz`` archive with one ``.npy`` array
+  per column, as read by ``numpy.load``.
+* ``application/x-npy``: a single ``.npy`` structured array with one
+  field per column, as read by ``numpy.load``.
+* ``application/x-ln-columns``: a simple length-prefixed format, read by
+  decode_columns().  All integers are little-endian.  The data starts with
+  ``COLUMNS_MAGIC`` and the number of columns (uint32), followed by each
+  column as its name (uint32 length, then UTF-8), its dtype (uint32 length,
+  then the ASCII string of ``numpy.dtype.str``), its shape (uint32 number
+  of dimensions, then a uint64 per dimension), and its data (uint64 length,
+  then the elements in C order).
+
+Blobs cannot be encoded in these formats.
+'''
+
+from io import BytesIO
+import struct
+
+import numpy as np
+
+NPZ_MIMETYPE = 'application/x-npz'
+NPY_MIMETYPE = 'application/x-npy'
+COLUMNS_MIMETYPE = 'application/x-ln-columns'
+
+COLUMNS_MAGIC = b'LNCOLS1\n'
+
+
+def check_columns(columns):
+    '''Raise ValueError if the ``(name, array)`` pairs in ``columns`` cannot
+    be encoded in the binary formats.'''
+    for name, array in columns:
+        if array.dtype == object:
+            raise ValueError('column %s holds objects, such as blobs' % name)
+
+
+def encode_npz(columns):
+    '''Encode a list of ``(name, array)`` pairs as a ``.npz`` archive.'''
+    check_columns(columns)
+    output = BytesIO()
+    np.savez(output, **dict(columns))
+    return output.getvalue()
+
+
+def encode_npy(columns):
+    '''Encode a list of ``(name, array)`` pairs of the same length as one
+    ``.npy`` structured array with a field per column.'''
+    check_columns(columns)
+    length = len(columns[0][1]) if len(columns) > 0 else 0
+    dtype = np.dtype([(str(name), array.dtype, array.shape[1:])
+        for name, array in columns])
+    records = np.empty(length, dtype=dtype)
+    for name, array in columns:
+        records[str(name)] = array
+
+    output = BytesIO()
+    np.save(output, records)
+    return output.getvalue()
+
+
+def encode_columns(columns):
+    '''Encode a list of ``(name, array)`` pairs in the length-prefixed
+    columnar format.'''
+    check_columns(columns)
+    parts = [COLUMNS_MAGIC, struct.pack('<I', len(columns))]
+    for name, array in columns:
+        array = np.ascontiguousarray(array)
+        name = name.encode('utf-8')
+        dtype = array.dtype.str.encode('ascii')
+        data = array.tobytes()
+        parts.extend([
+            struct.pack('<I', len(name)), name,
+            struct.pack('<I', len(dtype)), dtype,
+            struct.pack('<I%dQ' % array.ndim, array.ndim, *array.shape),
+            struct.pack('<Q', len(data)), data])
+    return b''.join(parts)
+
+
+def decode_columns(data):
+    '''Decode the length-prefixed columnar format into a list of
+    ``(name, array)`` pairs.  The arrays share memory with ``data``.'''
+    if data[:len(COLUMNS_MAGIC)] != COLUMNS_MAGIC:
+        raise ValueError('not in the columnar format')
+    position = len(COLUMNS_MAGIC)
+
+    def unpack(fmt):
+        values = struct.unpack_from(fmt, data, position)
+        return values, position + struct.calcsize(fmt)
+
+    def read_bytes():
+        (length,), start = unpack('<I')
+        return data[start:start + length], start + length
+
+    (count,), position = unpack('<I')
+    columns = []
+    for _ in range(count):
+        name, position = read_bytes()
+        dtype, position = read_bytes()
+        (ndim,), position = unpack('<I')
+        shape, position = unpack('<%dQ' % ndim)
+        (length,), position = unpack('<Q')
+        array = np.frombuffer(data, dtype=np.dtype(dtype.decode('ascii')),
+            count=int(np.prod(shape)), offset=position).reshape(shape)
+        columns.append((name.decode('utf-8'), array))
+        position += length
+    return columns
+
+
+# Encoders by MIME type
+ENCODERS = {
+    NPZ_MIMETYPE: encode_npz,
+    NPY_MIMETYPE: encode_npy,
+    COLUMNS_MIMETYPE: encode_columns,
+}
@@ -1,21 +1,42 @@
 '''Web server functions.'''
 
 import json
-import datetime
+import re
 import dateutil.parser
+import dateutil.tz
 from itertools import chain
 from flask import Flask, request, make_response, jsonify, Response
+import numpy as np
 
 from ln import __version__
 from ln import backend
+from ln import formats
 from ln.backend.base import Blob
-from ln.backend.exception import BadTypeError, SeriesDoesNotExistError, \
-    SeriesTimeOrderError
+from ln.backend.compat import string_types
+from ln.backend.datatype import parse_datatype
+from ln.backend.exception import BackendError, BadTypeError, \
+    SeriesDoesNotExistError, SeriesTimeOrderError
+from ln.backend.timestamp import datetime_to_epoch_us, now_epoch_us, \
+    format_epoch_us
 
 
 app = Flask('ln')
 storage_backend = None
 
+# Raw data points read from the storage backend at a time when streaming a
+# response
+DATA_PAGE_POINTS = 10000
+
+JSON_MIMETYPE = 'application/json'
+
+# Timestamps without a time zone that NumPy parses the same way as dateutil
+NAIVE_ISO_TIME = re.compile(
+    r'\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?)?$')
+
+# Response formats of /query and /data, in order of preference when the
+# client accepts several equally
+RESPONSE_MIMETYPES = [JSON_MIMETYPE] + sorted(formats.ENCODERS)
+
 
 def jsonify_with_status_code(status_code, *args, **kwargs):
     '''Just like Flask jsonify function, but with an HTTP status code.'''
@@ -24,22 +45,50 @@ def jsonify_with_status_code(status_code, *args, **kwargs):
     return response
 
 
+def negotiate_format():
+    '''Return the MIME type of the response format the client prefers,
+    from its Accept header.  JSON is the default.'''
+    return request.accept_mimetypes.best_match(RESPONSE_MIMETYPES) \
+        or JSON_MIMETYPE
+
+
+def binary_response(mimetype, columns, headers=None):
+    '''Encode a list of ``(name, array)`` columns in a binary format of
+    ln.formats, or return a 406 response if they cannot be.'''
+    try:
+        body = formats.ENCODERS[mimetype](columns)
+    except ValueError as e:
+        data = dict(msg='cannot encode response as %s: %s' % (mimetype, e))
+        return jsonify_with_status_code(406, **data)
+    return Response(body, mimetype=mimetype, headers=headers)
+
+
+def sse_message(times, values):
+    '''Format query results as a server-sent event message.'''
+    message = dict(times=format_epoch_us(times), values=values)
+    return 'data: %s\n\n' % json.dumps(message)
+
+
 def data_to_sse_stream(initial_times, initial_values, gen, limit=None):
     '''Convert a generator of data into a generator of server-sent event
     messages.
 
     :param intial_times: Initial array of times for query
     :param intial_values: Initial array of series values
-    :param gen: A generator of new (times, values) tuples
+    :param gen: An iterator of new (times, values) tuples, with a close()
+        method that ends the subscription
     :param limit: Maximum number of updates to return.  Only used for testing.
     '''
     i = 0
-    for times, values in chain([(initial_times, initial_values)], gen):
-        if limit is not None and i >= limit:
-            break
-        message = dict(times=[t.isoformat() for t in times], values=values)
-        yield 'data: %s\n\n' % json.dumps(message)
-        i += 1
+    try:
+        for times, values in chain([(initial_times, initial_values)], gen):
+            if limit is not None and i >= limit:
+                break
+            yield sse_message(times, values)
+            i += 1
+    finally:
+        # End the subscription as soon as the client goes away
+        gen.close()
 
 
 @app.route('/')
@@ -85,9 +134,9 @@ def data(series_name):
     if request.method == 'POST':
         try:
             if 'time' in request.form:
-                time = dateutil.parser.parse(request.form['time'])
+                time = parse_time(request.form['time'])
             else:
-                time = datetime.datetime.now()
+                time = now_epoch_us()
 
             if 'value' in request.files:
                 value = request.files['value'].read()
@@ -120,23 +169,198 @@ def data(series_name):
             limit = int(limit)
 
         try:
-            times, values, resume = storage_backend.get_data(series_name,
-                                                             offset=offset,
-                                                             limit=limit)
+            first = request.args.get('first', None)
+            if first is not None:
+                first = parse_time(first)
+            last = request.args.get('last', None)
+            if last is not None:
+                last = parse_time(last)
+        except (ValueError, TypeError) as e:
+            data = dict(msg='invalid ISO 8601 time specification: %s' % e)
+            return jsonify_with_status_code(400, **data)
+
+        page_limit = DATA_PAGE_POINTS if limit is None \
+            else min(limit, DATA_PAGE_POINTS)
+        mimetype = negotiate_format()
+        if mimetype != JSON_MIMETYPE:
+            return data_to_binary_response(series_name, offset, page_limit,
+                first, last, mimetype)
+        try:
+            # Read the first page now, so a missing series is still a 404
+            first_page = storage_backend.get_data(series_name, offset=offset,
+                limit=page_limit, first=first, last=last)
         except SeriesDoesNotExistError as e:
             return jsonify_with_status_code(404)
 
-        data = dict(times=[t.isoformat() for t in times])
+        pages = read_data_pages(series_name, first_page, limit, first, last)
+        return Response(data_to_json_stream(series_name, pages),
+            mimetype=JSON_MIMETYPE)
 
-        if len(values) > 0 and isinstance(values[0], Blob):
-            data['values'] = [make_url(series_name, b.index) for b in
-                values]
-        else:
-            data['values'] = values
 
-        if resume is not None:
-            data['resume'] = resume
-        return jsonify(**data)
+def read_data_pages(series_name, first_page, limit, first, last):
+    '''Generate the ``(times, values, resume)`` pages of raw data following
+    ``first_page``, reading at most ``DATA_PAGE_POINTS`` points at a time,
+    until ``limit`` points have been read or the data runs out.
+    '''
+    times, values, resume = first_page
+    yield first_page
+    remaining = None if limit is None else limit - len(times)
+    while resume is not None and (remaining is None or remaining > 0):
+        page_limit = DATA_PAGE_POINTS if remaining is None \
+            else min(remaining, DATA_PAGE_POINTS)
+        times, values, resume = storage_backend.get_data(series_name,
+            offset=resume, limit=page_limit, first=first, last=last)
+        if remaining is not None:
+            remaining -= len(times)
+        yield times, values, resume
+
+
+def data_to_json_stream(series_name, pages):
+    '''Convert pages of raw data into a generator of JSON text.
+
+    Values are written as the pages are read.  Only the int64 timestamps are
+    kept until the end, so large responses are never held in memory as
+    lists of Python objects.
+
+    :param series_name: Name of the data series, for blob URLs
+    :param pages: Iterable of ``(times, values, resume)`` tuples from
+        ``Backend.get_data``
+    '''
+    yield '{"values": ['
+    all_times = []
+    resume = None
+    separator = ''
+    for times, values, resume in pages:
+        all_times.append(times)
+        if len(values) == 0:
+            continue
+        if isinstance(values[0], Blob):
+            values = [make_url(series_name, b.index) for b in values]
+        yield separator + json.dumps(values)[1:-1]
+        separator = ', '
+
+    yield '], "times": ['
+    separator = ''
+    for times in all_times:
+        if len(times) == 0:
+            continue
+        yield separator + json.dumps(format_epoch_us(times))[1:-1]
+        separator = ', '
+    yield ']'
+
+    if resume is not None:
+        yield ', "resume": %d' % resume
+    yield '}'
+
+
+def data_to_binary_response(series_name, offset, limit, first, last,
+        mimetype):
+    '''Encode one page of raw data in a binary format, with ``times`` and
+    ``values`` columns read as arrays from the backend.  The resume sequence
+    number, if any, is sent in the ``X-Resume`` header.
+
+    Binary formats are encoded whole, so responses are limited to one page
+    of ``DATA_PAGE_POINTS`` to bound memory use, and clients follow
+    ``X-Resume`` for the rest.
+    '''
+    config = storage_backend.get_config(series_name)
+    if config is None:
+        return jsonify_with_status_code(404)
+    datatype = parse_datatype(config['type'])
+    if datatype.is_blob():
+        data = dict(msg='cannot encode blobs as %s' % mimetype)
+        return jsonify_with_status_code(406, **data)
+
+    times, values, resume = storage_backend.get_data_arrays(series_name,
+        offset=offset, limit=limit, first=first, last=last)
+    columns = [('times', times), ('values', values)]
+
+    headers = None if resume is None else {'X-Resume': str(resume)}
+    return binary_response(mimetype, columns, headers)
+
+
+def parse_time(time_string):
+    '''Parse an ISO 8601 timestamp into microseconds since the epoch.'''
+    dt = dateutil.parser.parse(time_string)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(dateutil.tz.tzutc()).replace(tzinfo=None)
+    return datetime_to_epoch_us(dt)
+
+
+def parse_times(time_strings):
+    '''Parse a list of ISO 8601 timestamps into an int64 array of
+    microseconds since the epoch.
+
+    The same timestamps as parse_time() are accepted.  The common case of
+    timestamps without a time zone is parsed in one vectorized pass by
+    NumPy, falling back to dateutil for anything else, since NumPy also
+    accepts strings like ``'NaT'`` or ``'now'``.
+    '''
+    if all(isinstance(t, string_types) and NAIVE_ISO_TIME.match(t)
+            for t in time_strings):
+        times = np.array(time_strings, dtype='datetime64[us]')
+        if np.isnat(times).any():
+            raise ValueError('invalid timestamp')
+        return times.astype(np.int64)
+    return np.array([parse_time(t) for t in time_strings], dtype=np.int64)
+
+
+def error_result(e):
+    '''Describe a backend error in the format used by data responses.'''
+    if isinstance(e, SeriesDoesNotExistError):
+        return dict(type='not_found', msg=str(e))
+    elif isinstance(e, SeriesTimeOrderError):
+        return dict(type='time_order', msg=str(e))
+    else:
+        return dict(type='bad_type', msg=str(e))
+
+
+@app.route('/data/<series_name>/batch', methods=['POST'])
+def data_batch(series_name):
+    '''Record a batch of new values for this data series.'''
+    try:
+        body = request.get_json(force=True, silent=True)
+        times = parse_times(body['times'])
+        values = body['values']
+    except (KeyError, TypeError, ValueError) as e:
+        data = dict(type='bad_request', msg='invalid batch: %s' % e)
+        return jsonify_with_status_code(400, **data)
+
+    try:
+        indices = storage_backend.add_data_many(series_name, times, values)
+    except SeriesDoesNotExistError as e:
+        return jsonify_with_status_code(404)
+    except (SeriesTimeOrderError, BadTypeError) as e:
+        return jsonify_with_status_code(400, **error_result(e))
+
+    data = dict(index=indices[0] if len(indices) > 0 else None,
+        count=len(indices))
+    return jsonify(**data)
+
+
+@app.route('/data', methods=['POST'])
+def data_multi():
+    '''Record batches of new values for several data series at once.'''
+    try:
+        body = request.get_json(force=True, silent=True)
+        batches = {}
+        for series_name, points in body.items():
+            times = parse_times([point[0] for point in points])
+            values = [point[1] for point in points]
+            batches[series_name] = (times, values)
+    except (AttributeError, IndexError, TypeError, ValueError) as e:
+        data = dict(type='bad_request', msg='invalid batch: %s' % e)
+        return jsonify_with_status_code(400, **data)
+
+    results = {}
+    for series_name, result in storage_backend.add_data_multi(batches).items():
+        if isinstance(result, BackendError):
+            results[series_name] = error_result(result)
+        else:
+            results[series_name] = dict(
+                index=result[0] if len(result) > 0 else None,
+                count=len(result))
+    return jsonify(results=results)
 
 
 @app.route('/data/<series_name>/<id>', methods=['GET'])
@@ -203,62 +427,101 @@ def config(series_name):
             return jsonify(**config)
 
 
-@app.route('/query')
-def query():
-    '''Resample the selected data series and return the result. The query
-    engine may return results with slightly different first and last times, as
-    well as a different number of points.
+def parse_query_args(args):
+    '''Check the arguments of a ``/query`` request.
 
-    If no end time is provided, the client will be send continuous updates via
-    server-sent events.
+    Returns ``(error, query)``: an error response and None if the arguments
+    are not valid, or else None and a dict with the ``selectors``,
+    ``first_us``, ``last_us`` (None for a continuous query), ``npoints`` and
+    ``updates`` of the query.
     '''
-    if 'last' not in request.args:
-        continuous = True
-        last = datetime.datetime.now().isoformat()
-    else:
-        last = request.args['last']
-        continuous = False
+    last = args.get('last')
 
     try:
-        selectors = request.args.getlist('selector')
-        first = request.args['first']
-        npoints = int(request.args['npoints'])
+        selectors = args.getlist('selector')
+        first = args['first']
+        npoints = int(args['npoints'])
     except (KeyError, ValueError) as e:
         data = dict(msg='invalid query: %s' % e)
 
-        return jsonify_with_status_code(400, **data)
+        return jsonify_with_status_code(400, **data), None
+
+    updates = args.get('updates', 'bin')
+    if updates not in ('bin', 'point'):
+        data = dict(msg='updates must be "bin" or "point"')
+
+        return jsonify_with_status_code(400, **data), None
 
     if npoints < 2:
         data = dict(msg='npoints must be >= 2')
 
-        return jsonify_with_status_code(400, **data)
+        return jsonify_with_status_code(400, **data), None
 
     try:
-        first_dt = dateutil.parser.parse(first)
-        last_dt = dateutil.parser.parse(last)
+        first_us = parse_time(first)
+        if last is None:
+            last_us = now_epoch_us()
+        else:
+            last_us = parse_time(last)
 
-        if first_dt >= last_dt:
+        if first_us >= last_us:
             data = dict(msg='last time must be greater than first')
 
-            return jsonify_with_status_code(400, **data)
+            return jsonify_with_status_code(400, **data), None
 
     except (ValueError, TypeError) as e:
         data = dict(msg='invalid ISO 8601 time specification: %s' % e)
 
-        return make_response(json.dumps(data), 400)
+        return make_response(json.dumps(data), 400), None
+
+    if last is None:
+        last_us = None
+    return None, dict(selectors=selectors, first_us=first_us, last_us=last_us,
+        npoints=npoints, updates=updates)
+
 
-    if not continuous:
-        times, values = storage_backend.query(selectors, first_dt, last_dt,
+@app.route('/query')
+def query():
+    '''Resample the selected data series and return the result. The query
+    engine may return results with slightly different first and last times, as
+    well as a different number of points.
+
+    If no end time is provided, the client will be send continuous updates via
+    server-sent events.
+    '''
+    error, parsed = parse_query_args(request.args)
+    if error is not None:
+        return error
+
+    selectors = parsed['selectors']
+    first_us = parsed['first_us']
+    last_us = parsed['last_us']
+    npoints = parsed['npoints']
+
+    mimetype = negotiate_format()
+    if last_us is not None and mimetype != JSON_MIMETYPE:
+        times, series = storage_backend.query_arrays(selectors, first_us,
+            last_us, npoints)
+        columns = [('times', times)]
+        for i, (values, valid) in enumerate(series):
+            columns.extend([('values_%d' % i, values), ('valid_%d' % i, valid)])
+        return binary_response(mimetype, columns)
+    elif last_us is not None:
+        times, values = storage_backend.query(selectors, first_us, last_us,
             npoints)
-        data = dict(times=[t.isoformat() for t in times], values=values)
+        data = dict(times=format_epoch_us(times), values=values)
         return jsonify(data)
     else:
         times, values, generator = \
-            storage_backend.query_continuous(selectors, first_dt, npoints)
+            storage_backend.query_continuous(selectors, first_us, npoints,
+                updates=parsed['updates'])
         limit = app.config.get('LIMIT_CONTINUOUS', None)
         response_generator = data_to_sse_stream(times, values, generator,
             limit=limit)
-        return Response(response_generator, mimetype='text/event-stream')
+        response = Response(response_generator, mimetype='text/event-stream')
+        # The stream may be closed before it starts, which skips its finally
+        response.call_on_close(generator.close)
+        return response
 
 
 def start(config, options):
@@ -267,6 +530,9 @@ def start(config, options):
     :param config: Configuration definition
     :param options: argparse.Namespace with command line options:
         profile - run application in profiler mode
+        server - ``'werkzeug'`` for the threaded development server, or
+            ``'asyncio'`` for the asyncio server in ln.aioserver
+        workers - threads for blocking calls in the asyncio server
     '''
     global storage_backend
 
@@ -274,11 +540,18 @@ def start(config, options):
 
     storage = config['storage']
     print('Opening "%s" storage backend...' % storage['backend'])
-    storage_backend = backend.get_backend(storage)
+    storage_backend = backend.get_backend(storage,
+        config.get('resampling_intervals'))
 
     app.config['url_base'] = 'url_base'
     print('Base URL is', config['url_base'])
 
+    if getattr(options, 'server', 'werkzeug') == 'asyncio':
+        from ln import aioserver
+        aioserver.run(config['host'], config['port'],
+            workers=getattr(options, 'workers', aioserver.DEFAULT_WORKERS))
+        return
+
     if options.profile:
         from werkzeug.contrib.profiler import ProfilerMiddleware
         app.config['PROFILE'] = True
@@ -1,32 +1,108 @@
 import json
-from base64 import b64encode
+import os
+import re
+from base64 import b64encode, b64decode
+from multiprocessing.pool import ThreadPool
 
 import ln
 from ln import backend
 from ln.backend.compat import zip
+from ln.backend.timestamp import format_epoch_us, to_epoch_us
 
+# Points read from the storage backend at a time while exporting
+EXPORT_PAGE_POINTS = 10000
 
-def export_json(backend, output_file):
+# Points added to the storage backend at a time while importing, each batch
+# in one transaction
+IMPORT_BATCH_POINTS = 50000
+
+# Characters read from an export file at a time while importing
+IMPORT_CHUNK_CHARS = 1 << 20
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_points(backend, series_name, page_size=EXPORT_PAGE_POINTS):
+    '''Generate the ``(times, values)`` pages of all the points of a series,
+    reading at most ``page_size`` points at a time.'''
+    offset = 0
+    while offset is not None:
+        times, values, offset = backend.get_data(series_name, offset,
+            page_size)
+        yield times, values
+
+
+def write_series_json(backend, series_name, output_file,
+        page_size=EXPORT_PAGE_POINTS):
+    '''Write the configuration and points of one series to the file object
+    ``output_file`` as a JSON object, one page of points at a time.'''
+    config = backend.get_config(series_name)
+    if config['type'].startswith('blob'):
+        transform = lambda v: b64encode(v.get_bytes()).decode('utf-8')
+    else:
+        transform = lambda v: v
+
+    output_file.write('{"config": %s, "points": [' % json.dumps(config))
+    separator = ''
+    for times, values in iter_points(backend, series_name, page_size):
+        if len(times) == 0:
+            continue
+        points = [(time, transform(value))
+            for time, value in zip(format_epoch_us(times, sep=' '), values)]
+        output_file.write(separator + json.dumps(points)[1:-1])
+        separator = ', '
+    output_file.write(']}')
+
+
+def export_json(backend, output_file, series_names=None,
+        page_size=EXPORT_PAGE_POINTS):
     '''Serialize the entire contents of ``backend`` in JSON format to the
-    file object ``output_file``.'''
-    obj = {
-        'version': ln.__version__,
-        'series': []
-    }
-
-    for series_name in backend.get_series_list():
-        config = backend.get_config(series_name)
-        if config['type'].startswith('blob'):
-            transform = lambda v: b64encode(v.get_bytes()).decode('utf-8')
-        else:
-            transform = lambda v: v
+    file object ``output_file``.
+
+    The output is written as the series are read, in pages of
+    ``page_size`` points, so the series are never held in memory.
+
+    :param series_names: Names of the series to export, or None for all
+    '''
+    if series_names is None:
+        series_names = backend.get_series_list()
 
-        times, values, resume = backend.get_data(series_name, 0)
-        points = [(str(time), transform(value))
-            for time, value in zip(times, values)]
-        obj['series'].append(dict(config=config, points=points))
+    output_file.write('{"version": %s, "series": ['
+        % json.dumps(ln.__version__))
+    for i, series_name in enumerate(series_names):
+        if i > 0:
+            output_file.write(', ')
+        write_series_json(backend, series_name, output_file, page_size)
+    output_file.write(']}')
 
-    json.dump(obj, output_file)
+
+def export_json_files(backend, output_dir, workers=1,
+        page_size=EXPORT_PAGE_POINTS):
+    '''Export each series of ``backend`` to its own file in ``output_dir``,
+    exporting up to ``workers`` series at a time.
+
+    Each file is named after its series, and holds the same format as
+    export_json with a single series.  Returns the list of paths written.
+    '''
+    series_names = backend.get_series_list()
+    for series_name in series_names:
+        if os.sep in series_name or series_name in (os.curdir, os.pardir):
+            raise ValueError('Cannot use series name "%s" as a file name'
+                % series_name)
+
+    def export_series(series_name):
+        path = os.path.join(output_dir, series_name + '.json')
+        with open(path, 'w') as output:
+            export_json(backend, output, [series_name], page_size)
+        return path
+
+    if workers <= 1 or len(series_names) <= 1:
+        return [export_series(series_name) for series_name in series_names]
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(export_series, series_names)
+    finally:
+        pool.close()
 
 
 def export_command(config, options):
@@ -37,5 +113,186 @@ def export_command(config, options):
     print('Opening "%s" storage backend...' % storage['backend'])
     storage_backend = backend.get_backend(storage)
 
-    with open(options.output) as output:
-        export_json(storage_backend, output)
+    if os.path.isdir(options.output):
+        paths = export_json_files(storage_backend, options.output,
+            workers=getattr(options, 'workers', 1))
+        print('Exported %d series to %s' % (len(paths), options.output))
+    else:
+        with open(options.output, 'w') as output:
+            export_json(storage_backend, output)
+
+
+class JSONStreamReader(object):
+    '''Reads a JSON document from a text file a piece at a time, so that
+    documents larger than memory can be processed.
+
+    Arrays and objects are walked with iter_array() and iter_object(), and
+    other values are read whole with value().
+    '''
+
+    def __init__(self, input_file, chunk_size=None):
+        self._file = input_file
+        self._chunk_size = chunk_size or IMPORT_CHUNK_CHARS
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _read_more(self):
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        '''Return the next character that is not whitespace without
+        consuming it, or an empty string at the end of the file.'''
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                return ''
+
+    def expect(self, char):
+        '''Consume the next character, which must be ``char``.'''
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expected "%s" but found "%s"' % (char, found))
+        self._pos += 1
+
+    def value(self):
+        '''Read and return the next JSON value.'''
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A value ending with the buffer may continue in the file,
+                # like a number that was split across reads.
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._read_more()
+
+    def iter_array(self):
+        '''Step through the array starting at the next character.  The
+        generator yields once for each element, which the caller must read
+        before continuing.'''
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ']':
+                self._pos += 1
+                return
+            self.expect(',')
+
+    def iter_object(self):
+        '''Step through the object starting at the next character.  The
+        generator yields each key, and the caller must read its value before
+        continuing.'''
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == '}':
+                self._pos += 1
+                return
+            self.expect(',')
+
+
+def add_points(backend, config, points):
+    '''Add a list of ``[time, value]`` points in the export format to the
+    series described by ``config``.'''
+    times = to_epoch_us([point[0] for point in points])
+    if config['type'].startswith('blob'):
+        values = [b64decode(point[1]) for point in points]
+    else:
+        values = [point[1] for point in points]
+    backend.add_data_many(config['name'], times, values)
+
+
+def import_series_json(backend, reader, batch_size=IMPORT_BATCH_POINTS):
+    '''Create the series whose export is the next object of the
+    JSONStreamReader ``reader``, and add its points ``batch_size`` at a
+    time.  Returns the name of the series.'''
+    config = None
+    pending = []  # Points found before the config
+    for key in reader.iter_object():
+        if key == 'config':
+            config = reader.value()
+            backend.create_series(**config)
+            for start in range(0, len(pending), batch_size):
+                add_points(backend, config, pending[start:start + batch_size])
+            pending = []
+        elif key == 'points':
+            batch = []
+            for _ in reader.iter_array():
+                batch.append(reader.value())
+                if config is not None and len(batch) >= batch_size:
+                    add_points(backend, config, batch)
+                    batch = []
+            if config is None:
+                pending = batch
+            elif len(batch) > 0:
+                add_points(backend, config, batch)
+        else:
+            reader.value()
+
+    if config is None:
+        raise ValueError('Series without a config in export')
+    return config['name']
+
+
+def import_json(backend, input_file, batch_size=IMPORT_BATCH_POINTS):
+    '''Load an export made by export_json from the file object
+    ``input_file`` into ``backend``, creating its series.
+
+    The file is read incrementally, and points are added with
+    ``add_data_many`` in batches of ``batch_size``, so neither the file nor
+    a whole series needs to fit in memory.  Returns the list of series
+    names imported.
+    '''
+    reader = JSONStreamReader(input_file)
+    series_names = []
+    for key in reader.iter_object():
+        if key == 'series':
+            for _ in reader.iter_array():
+                series_names.append(import_series_json(backend, reader,
+                    batch_size))
+        else:
+            reader.value()
+    return series_names
+
+
+def import_command(config, options):
+    '''Import database from JSON file.'''
+    print('Natural Log', ln.__version__)
+
+    storage = config['storage']
+    print('Opening "%s" storage backend...' % storage['backend'])
+    storage_backend = backend.get_backend(storage)
+
+    if os.path.isdir(options.input):
+        paths = [os.path.join(options.input, filename) for filename
+            in sorted(os.listdir(options.input)) if filename.endswith('.json')]
+    else:
+        paths = [options.input]
+
+    count = 0
+    for path in paths:
+        with open(path, 'r') as input_file:
+            count += len(import_json(storage_backend, input_file))
+    print('Imported %d series' % count)
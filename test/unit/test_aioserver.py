@@ -0,0 +1,152 @@
+import pytest
+import json
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from ln.backend import get_backend
+from ln.backend.timestamp import now_epoch_us
+import ln.server
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7),
+    reason='asyncio server requires Python 3.7')
+
+
+@pytest.fixture
+def server_address():
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from ln import aioserver
+
+    ln.server.app.config['TESTING'] = True
+    ln.server.app.config['url_base'] = ''
+    ln.server.app.config['LIMIT_CONTINUOUS'] = 3
+    ln.server.storage_backend = get_backend({'backend': 'memory'})
+    ln.server.storage_backend.create_series(name='int', type='int32',
+        reduction='sum', interpolation='zero', description='', unit='',
+        metadata='')
+
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=2)
+    http_server = loop.run_until_complete(
+        aioserver.start_server('127.0.0.1', 0, executor))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+
+    yield http_server.sockets[0].getsockname()[:2]
+
+    async def shutdown():
+        http_server.close()
+        tasks = [t for t in asyncio.all_tasks()
+            if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    executor.shutdown()
+    del ln.server.app.config['LIMIT_CONTINUOUS']
+
+
+def test_routes(server_address):
+    import http.client
+    conn = http.client.HTTPConnection(*server_address)
+
+    # Several requests on one kept-alive connection
+    conn.request('POST', '/data/int', body='value=5&time=2013-08-26T00:00:00',
+        headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    assert response.status == 200
+    response.read()
+
+    conn.request('GET', '/')
+    response = conn.getresponse()
+    assert response.status == 200
+    assert json.loads(response.read().decode())['names'] == ['int']
+
+    conn.request('GET', '/query?selector=int&first=2013-08-26T00:00:00'
+        '&last=2013-08-26T01:00:00&npoints=2')
+    response = conn.getresponse()
+    assert json.loads(response.read().decode())['values'] == [[5, 0]]
+
+    conn.request('GET', '/query?selector=int&first=2013-08-26T00:00:00')
+    response = conn.getresponse()
+    assert response.status == 400
+    conn.close()
+
+
+def test_streamed_body(server_address, monkeypatch):
+    import http.client
+    monkeypatch.setattr('ln.server.DATA_PAGE_POINTS', 2)
+    start = datetime(2013, 8, 26)
+    ln.server.storage_backend.add_data_many('int',
+        [start + timedelta(seconds=i) for i in range(5)], list(range(5)))
+
+    # Streamed responses are sent in chunks, and the connection stays open
+    conn = http.client.HTTPConnection(*server_address)
+    conn.request('GET', '/data/int?offset=0')
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.getheader('Transfer-Encoding') == 'chunked'
+    assert json.loads(response.read().decode())['values'] == list(range(5))
+
+    conn.request('GET', '/')
+    response = conn.getresponse()
+    assert response.status == 200
+    assert json.loads(response.read().decode())['names'] == ['int']
+    conn.close()
+
+
+def test_continuous_query(server_address):
+    import http.client
+    delta_t = timedelta(milliseconds=100)
+    first = datetime.utcnow() - delta_t
+
+    conn = http.client.HTTPConnection(*server_address)
+    conn.request('GET', '/query?selector=int&first=%s&npoints=2'
+        '&updates=point' % first.isoformat())
+    response = conn.getresponse()
+    assert response.status == 200
+    assert response.getheader('Content-Type').startswith('text/event-stream')
+
+    def read_message():
+        line = response.fp.readline()
+        response.fp.readline()
+        return json.loads(line.decode()[len('data: '):])
+
+    initial = read_message()
+    assert initial['values'] == [[0, 0]]
+
+    # New points are pushed as they are added
+    now = now_epoch_us()
+    ln.server.storage_backend.add_data('int', now + 10**5, 4)
+    ln.server.storage_backend.add_data('int', now + 10**5 + 1, 3)
+    assert read_message()['values'] == [[4]]
+    assert read_message()['values'] == [[7]]
+    conn.close()
+
+
+def test_continuous_query_cancelled(server_address):
+    import http.client
+    import time
+    scheduler = ln.server.storage_backend._scheduler
+    first = datetime.utcnow() - timedelta(hours=1)
+
+    # Bins of half an hour, so no new point would reveal the closed socket
+    conn = http.client.HTTPConnection(*server_address)
+    conn.request('GET', '/query?selector=int&first=%s&npoints=2'
+        % first.isoformat())
+    response = conn.getresponse()
+    assert response.status == 200
+    response.fp.readline()
+    assert len(scheduler._groups) == 1
+
+    # The subscription ends as soon as the client goes away
+    response.close()
+    conn.close()
+    deadline = time.time() + 5
+    while len(scheduler._groups) > 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(scheduler._groups) == 0
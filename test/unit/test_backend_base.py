@@ -16,8 +16,12 @@ def test_base_exceptions():
         b.update_config('blah')
     with pytest.raises(BackendError):
         b.add_data('blah', 'blah', 'blah')
+    with pytest.raises(BackendError):
+        b.add_data_many('blah', 'blah', 'blah')
     with pytest.raises(BackendError):
         b.get_data('blah')
+    with pytest.raises(BackendError):
+        b.get_data_arrays('blah')
     with pytest.raises(BackendError):
         b.query('blah', 'blah', 'blah', 'blah')
     with pytest.raises(BackendError):
@@ -35,7 +39,18 @@ def test_get_backend_sql(tmpdir):
     assert len(b.get_series_list()) == 0
 
 
+def test_get_backend_segment(tmpdir):
+    b = get_backend({'backend': 'segment', 'path': str(tmpdir)})
+    assert len(b.get_series_list()) == 0
+
+
 def test_blob_exception():
     blob = Blob(index=1, mimetype='text/plain')
     with pytest.raises(BackendError):
         blob.get_bytes()
+
+
+def test_map_parallel():
+    b = Backend(query_workers=3)
+    assert b._map_parallel(lambda x: x * 2, range(10)) == list(range(0, 20, 2))
+    assert Backend()._map_parallel(len, ['a', 'bc']) == [1, 2]
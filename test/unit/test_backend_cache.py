@@ -0,0 +1,87 @@
+from ln.backend.cache import QueryCache, estimate_size
+from ln.backend.memory import MemoryBackend
+from ln.backend.sql import SQLBackend
+from datetime import datetime, timedelta
+import pytest
+
+
+def test_estimate_size():
+    assert estimate_size([[1, 2], [None]]) > estimate_size([[1], []])
+    assert estimate_size([[b'a' * 1000]]) > 1000
+
+
+def test_get_put():
+    cache = QueryCache(10**6)
+    assert cache.get('a') is None
+    cache.put('a', [[1, 2]], 100, cache.watermarks(['x']))
+    value = cache.get('a')
+    assert value == [[1, 2]]
+    # Callers get their own copy
+    value[0].append(3)
+    assert cache.get('a') == [[1, 2]]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_invalidate():
+    cache = QueryCache(10**6)
+    cache.appended('x', 50)
+    cache.put('live', [[1]], 100, cache.watermarks(['x', 'y']))
+    cache.put('historical', [[2]], 50, cache.watermarks(['x']))
+    cache.put('other', [[3]], 100, cache.watermarks(['y']))
+
+    cache.appended('x', 60)
+    assert cache.get('live') is None
+    assert cache.get('historical') == [[2]]
+    assert cache.get('other') == [[3]]
+    assert len(cache) == 2
+
+
+def test_lru_eviction():
+    value = [[1.0] * 10]
+    size = estimate_size(value)
+    cache = QueryCache(size * 3)
+    for key in 'abc':
+        cache.put(key, value, 0, {})
+    cache.get('a')
+    cache.put('d', value, 0, {})
+    assert cache.get('b') is None
+    assert [cache.get(key) is not None for key in 'acd'] == [True] * 3
+    assert cache.size == size * 3
+
+    # Results larger than the whole budget are not cached
+    cache.put('e', [[1.0] * 100], 0, {})
+    assert cache.get('e') is None
+
+
+@pytest.mark.parametrize('make_backend', [
+    lambda: MemoryBackend(query_cache_size=10**6),
+    lambda: SQLBackend('sqlite://', query_cache_size=10**6),
+])
+def test_backend_query_cache(make_backend):
+    b = make_backend()
+    b.create_series(name='int', type='int32', reduction='sum',
+        interpolation='zero', description='', unit='', metadata='')
+    start = datetime(2013, 8, 26)
+    b.add_data_many('int', [start + timedelta(hours=i) for i in range(4)],
+        [1, 2, 3, 4])
+
+    historical = (start, start + timedelta(hours=2), 3)
+    live = (start, start + timedelta(hours=5), 6)
+    assert b.query(['int'], *historical)[1] == [[1, 2, 3]]
+    assert b.query(['int:sum:zero'], *historical)[1] == [[1, 2, 3]]
+    assert b.query(['int'], *live)[1] == [[1, 2, 3, 4, 0, 0]]
+    assert b.query(['int'], *live)[1] == [[1, 2, 3, 4, 0, 0]]
+    assert (b.query_cache.hits, b.query_cache.misses) == (2, 2)
+
+    b.add_data('int', start + timedelta(hours=5), 6)
+    assert b.query(['int'], *historical)[1] == [[1, 2, 3]]
+    assert b.query(['int'], *live)[1] == [[1, 2, 3, 4, 0, 6]]
+    assert (b.query_cache.hits, b.query_cache.misses) == (3, 3)
+
+    # Modifying the arrays of a result leaves the cached result intact
+    _, [(values, valid)] = b.query_arrays(['int'], *historical)
+    values[:] = 0
+    valid[:] = False
+    _, [(values, valid)] = b.query_arrays(['int'], *historical)
+    assert values.tolist() == [1, 2, 3] and valid.all()
+    assert b.query(['int'], *historical)[1] == [[1, 2, 3]]
@@ -168,6 +168,39 @@ def test_make_zero_blob():
     assert d.make_zero() == b''
 
 
+def test_stack_scalar():
+    d = Datatype('int32')
+    assert np.array_equal(d.stack([1, 2, 3]), [1, 2, 3])
+
+
+def test_stack_array():
+    d = Datatype('int32', shape=(2,))
+    a = d.stack([d.coerce((1, 2)), d.coerce((3, 4))])
+    assert array_equal_with_dtype(a,
+        np.array([[1, 2], [3, 4]], dtype=np.int32))
+
+    assert d.stack([]).shape == (0, 2)
+
+
+def test_stack_blob():
+    d = Datatype('blob', mimetype='text/plain')
+    a = d.stack([b'foo', b'ba'])
+    assert a.dtype == object
+    assert list(a) == [b'foo', b'ba']
+
+
+def test_bytes_round_trip():
+    d = Datatype('int16', shape=(2, 3))
+    v = d.coerce([[1, 2, 3], [4, 5, -6]])
+    data = d.to_bytes(v)
+    assert data == np.array(v, dtype='<i2').tobytes()
+    assert array_equal_with_dtype(d.from_bytes(data).astype(np.int16), v)
+
+    stacked = d.from_bytes(data * 2, count=2)
+    assert stacked.shape == (2, 2, 3)
+    assert np.array_equal(stacked[1], v)
+
+
 def test_convert_to_jsonable_scalar():
     d = Datatype('int32')
     assert type(d.convert_to_jsonable(1)) == type(1)
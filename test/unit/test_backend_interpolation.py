@@ -1,31 +1,99 @@
 from ln.backend import interpolation
 from ln.backend.datatype import Datatype
 import numpy as np
-import pytest
+
+
+def dense(a, datatype):
+    '''Split a list with None for empty bins into values and a mask.'''
+    valid = np.array([v is not None for v in a])
+    values = datatype.make_zeros(len(a))
+    for i, v in enumerate(a):
+        if v is not None:
+            values[i] = v
+    return values, valid
+
+
+def sparse(values, valid):
+    return [v if ok else None for v, ok in zip(values.tolist(), valid)]
 
 
 def test_none():
+    d = Datatype('int32')
     a = [1, 3, None, 4, None]
-    assert interpolation.none(a, None, None) == a
+    assert sparse(*interpolation.none(*dense(a, d), datatype=d,
+        center_times=None)) == a
 
 
 def test_zero():
     d = Datatype('int32')
     a = [1, 3, None, 4, None]
-    result = interpolation.zero(a, d, None)
-    assert np.array_equal(result, [1, 3, 0, 4, 0])
+    result = interpolation.zero(*dense(a, d), datatype=d, center_times=None)
+    assert sparse(*result) == [1, 3, 0, 4, 0]
+
+
+def test_zero_array():
+    d = Datatype('int32', shape=(2,))
+    values, valid = dense([None, [1, 2], None], d)
+    values[0] = values[2] = 5
+    result = interpolation.zero(values, valid, d, None)
+    assert sparse(*result) == [[0, 0], [1, 2], [0, 0]]
 
 
 def test_previous():
     d = Datatype('int32')
     a = [1, 3, None, 4, None]
-    result = interpolation.previous(a, d, None)
-    assert np.array_equal(result, [1, 3, 3, 4, 4])
+    result = interpolation.previous(*dense(a, d), datatype=d,
+        center_times=None)
+    assert sparse(*result) == [1, 3, 3, 4, 4]
+
+
+def test_previous_leading_empty():
+    d = Datatype('float32', shape=(2,))
+    a = [None, None, [1.0, 2.0], None]
+    result = interpolation.previous(*dense(a, d), datatype=d,
+        center_times=None)
+    assert sparse(*result) == [None, None, [1.0, 2.0], [1.0, 2.0]]
 
 
-@pytest.mark.xfail
 def test_linear():
     d = Datatype('float32')
     a = [1.0, 3.0, None, 4.0, None]
-    assert np.array_equal(interpolation.linear(a, d, None),
-        [1.0, 3.0, 3.5, 4.0, 4.0])
+    result = interpolation.linear(*dense(a, d), datatype=d,
+        center_times=None)
+    assert sparse(*result) == [1.0, 3.0, 3.5, 4.0, None]
+
+
+def test_linear_center_times():
+    d = Datatype('float64')
+    a = [None, 2.0, None, None, 8.0, None]
+    center_times = np.array([0, 10, 20, 40, 70, 80]) * 10**6
+    result = sparse(*interpolation.linear(*dense(a, d), datatype=d,
+        center_times=center_times))
+    assert result[0] is None and result[-1] is None
+    assert np.allclose(result[1:5], [2.0, 3.0, 5.0, 8.0])
+
+
+def test_linear_int():
+    d = Datatype('int32')
+    result = interpolation.linear(*dense([1, None, 2], d), datatype=d,
+        center_times=None)
+    assert sparse(*result) == [1.0, 1.5, 2.0]
+
+
+def test_linear_array():
+    d = Datatype('float32', shape=(2,))
+    a = [[0.0, 4.0], None, None, [3.0, 1.0]]
+    result = sparse(*interpolation.linear(*dense(a, d), datatype=d,
+        center_times=None))
+    assert np.allclose(result, [[0.0, 4.0], [1.0, 3.0], [2.0, 2.0],
+        [3.0, 1.0]])
+
+
+def test_linear_too_few():
+    d = Datatype('float32')
+    result = interpolation.linear(*dense([None, 1.0, None], d), datatype=d,
+        center_times=None)
+    assert sparse(*result) == [None, 1.0, None]
+    result = interpolation.linear(*dense([None, None], d), datatype=d,
+        center_times=None)
+    assert sparse(*result) == [None, None]
@@ -0,0 +1,239 @@
+from ln.backend.memory import MemoryBackend, INITIAL_CAPACITY
+from ln.backend.exception import BackendError, BadTypeError, SeriesCreationError, \
+    SeriesDoesNotExistError, SeriesTimeOrderError
+from ln.backend.timestamp import to_epoch_us, datetime_to_epoch_us
+from datetime import datetime, timedelta
+import pytest
+import numpy as np
+
+
+@pytest.fixture
+def backend():
+    b = MemoryBackend()
+    int_config = dict(
+        name='int',
+        type='int32',
+        reduction='sum',
+        interpolation='zero',
+        description='Integer counter',
+        unit='',
+        metadata=''
+    )
+    b.create_series(**int_config)
+    array_config = dict(
+        name='array',
+        type='float32[4]',
+        reduction='mean',
+        interpolation='none',
+        description='Array',
+        unit='',
+        metadata=''
+    )
+    b.create_series(**array_config)
+    blob_config = dict(
+        name='blob',
+        type='blob:text/plain',
+        reduction='closest',
+        interpolation='none',
+        description='BLOB',
+        unit='',
+        metadata=''
+    )
+    b.create_series(**blob_config)
+    return b
+
+
+def test_create_conflict(backend):
+    with pytest.raises(SeriesCreationError):
+        backend.create_series(name='int', type='int32', reduction='sum',
+            interpolation='zero', description='', unit='', metadata='')
+
+
+def test_series_list(backend):
+    assert backend.get_series_list() == ['int', 'array', 'blob']
+
+
+def test_update_config(backend):
+    backend.update_config('int', unit='counts')
+    config = backend.get_config('int')
+    assert config['unit'] == 'counts'
+    assert config['description'] == 'Integer counter'
+
+    assert backend.get_config('not.there') is None
+    with pytest.raises(SeriesDoesNotExistError):
+        backend.update_config('not.there', unit='')
+
+
+def test_add_doesnotexist(backend):
+    with pytest.raises(SeriesDoesNotExistError):
+        backend.add_data('doesnotexist', datetime.now(), 1)
+    with pytest.raises(SeriesDoesNotExistError):
+        backend.get_data('doesnotexist')
+
+
+def test_add_int(backend):
+    times = []
+    # Enough points to grow the arrays a few times
+    for i in range(4 * INITIAL_CAPACITY + 1):
+        times.append(datetime.now())
+        assert backend.add_data('int', times[-1], i) == i
+
+    db_times, db_values, next_seq = backend.get_data('int', 0)
+    assert np.array_equal(to_epoch_us(times), db_times)
+    assert list(range(len(times))) == db_values
+    assert next_seq is None
+
+    db_times, db_values, next_seq = backend.get_data('int')
+    assert np.array_equal(to_epoch_us([times[-1]]), db_times)
+    assert [len(times) - 1] == db_values
+
+    db_times, db_values, next_seq = backend.get_data('int', 1, 2)
+    assert np.array_equal(to_epoch_us(times[1:3]), db_times)
+    assert [1, 2] == db_values
+    assert next_seq == 3
+
+
+def test_get_time_range(backend):
+    start = datetime(2015, 3, 1)
+    times = [start + timedelta(seconds=i) for i in range(10)]
+    backend.add_data_many('int', times, np.arange(10))
+
+    first = start + timedelta(seconds=2)
+    last = start + timedelta(seconds=7.5)
+    db_times, db_values, next_seq = backend.get_data('int', limit=3,
+        first=first, last=last)
+    assert np.array_equal(to_epoch_us(times[2:5]), db_times)
+    assert [2, 3, 4] == db_values
+    assert next_seq == 5
+
+    db_times, db_values, next_seq = backend.get_data('int', next_seq, 3,
+        first=first, last=last)
+    assert [5, 6, 7] == db_values
+    assert next_seq is None
+
+    db_times, db_values, next_seq = backend.get_data('int', last=start)
+    assert len(db_times) == 0
+    assert next_seq is None
+
+
+def test_add_array(backend):
+    times = []
+    values = []
+    for i in range(10):
+        times.append(datetime.now())
+        values.append(np.array(range(4)) * i)
+        assert backend.add_data('array', times[-1], values[-1]) == i
+
+    db_times, db_values, next_seq = backend.get_data('array', 0)
+    assert np.array_equal(to_epoch_us(times), db_times)
+    assert np.array_equal(np.array(values), np.array(db_values))
+
+
+def test_add_blob(backend):
+    now = datetime.now()
+    backend.add_data('blob', now, b'abc')
+    backend.add_data('blob', now, b'\x00\x01')
+
+    db_times, db_values, next_seq = backend.get_data('blob', 0)
+    assert np.array_equal(to_epoch_us([now, now]), db_times)
+    assert [b'abc', b'\x00\x01'] == [v.get_bytes() for v in db_values]
+    assert [0, 1] == [v.index for v in db_values]
+
+
+def test_get_data_arrays(backend):
+    start = datetime(2015, 3, 1)
+    times = [start + timedelta(seconds=i) for i in range(10)]
+    backend.add_data_many('int', times, range(10))
+    backend.add_data_many('array', times,
+        [np.arange(4) * i for i in range(10)])
+
+    db_times, db_values, next_seq = backend.get_data_arrays('int', 1, 3)
+    assert np.array_equal(to_epoch_us(times[1:4]), db_times)
+    assert db_values.dtype == np.int64
+    assert db_values.tolist() == [1, 2, 3]
+    assert next_seq == 4
+
+    db_times, db_values, next_seq = backend.get_data_arrays('array')
+    assert np.array_equal(to_epoch_us(times[-1:]), db_times)
+    assert db_values.tolist() == [[0, 9, 18, 27]]
+    assert next_seq is None
+
+    with pytest.raises(BackendError):
+        backend.get_data_arrays('blob', 0)
+
+
+def test_add_wrong_order(backend):
+    now = datetime.now()
+    backend.add_data('int', now, 1)
+    with pytest.raises(SeriesTimeOrderError):
+        backend.add_data('int', now - timedelta(hours=1), 2)
+
+
+def test_add_bad_type(backend):
+    with pytest.raises(BadTypeError):
+        backend.add_data('array', datetime.now(), [1, 2])
+
+
+def test_add_many(backend):
+    start = datetime(2013, 8, 26)
+    times = [start + timedelta(seconds=i) for i in range(5 * INITIAL_CAPACITY)]
+    values = list(range(len(times)))
+
+    assert list(backend.add_data_many('int', times[:3], values[:3])) == \
+        [0, 1, 2]
+    assert list(backend.add_data_many('int', times[3:], values[3:])) == \
+        values[3:]
+
+    db_times, db_values, next_seq = backend.get_data('int', 0)
+    assert np.array_equal(to_epoch_us(times), db_times)
+    assert values == db_values
+
+    with pytest.raises(SeriesTimeOrderError):
+        backend.add_data_many('int', [start], [1])
+    with pytest.raises(BadTypeError):
+        backend.add_data_many('array', [times[-1]], [[1, 2]])
+
+
+def test_publish_under_lock(backend):
+    # Appends are published before the next append can start, so
+    # subscribers see them in order
+    published = []
+    backend.append_bus.subscribe(lambda name, times, values:
+        published.append((list(values), backend._lock.locked())))
+    start = datetime(2013, 8, 26)
+    backend.add_data('int', start, 1)
+    backend.add_data_many('int', [start + timedelta(seconds=1)], [2])
+    assert published == [([1], True), ([2], True)]
+
+
+def test_query(backend):
+    start = datetime(2013, 8, 26, 0, 0, 0)
+    backend.add_data('int', start + timedelta(hours=1), 1)
+    backend.add_data('int', start + timedelta(hours=2, minutes=29, seconds=59), 3)
+    backend.add_data('int', start + timedelta(hours=2, minutes=30), 10)
+    backend.add_data('int', start + timedelta(hours=3), 20)
+    backend.add_data('int', start + timedelta(hours=3, minutes=10), 1)
+    backend.add_data('int', start + timedelta(hours=5), 2)
+    backend.add_data('int', start + timedelta(hours=6), 6)
+    backend.add_data('array', start + timedelta(hours=1), [1, 2, 3, 4])
+    backend.add_data('array', start + timedelta(hours=1, minutes=10),
+        [3, 4, 5, 6])
+
+    first = datetime(2013, 8, 26, 0, 0, 0)
+    last = datetime(2013, 8, 26, 11, 0, 0)
+
+    times, values = backend.query(['int', 'array'], first, last, 12)
+    assert times[0] == datetime_to_epoch_us(first)
+    assert times[-1] == datetime_to_epoch_us(last)
+    assert values[0] == [0, 1, 3, 31, 0, 2, 6, 0, 0, 0, 0, 0]
+    assert values[1] == [None, [2, 3, 4, 5]] + [None] * 10
+
+    times, series = backend.query_arrays(['int', 'array'], first, last, 12)
+    values, valid = series[0]
+    assert values.dtype == np.int64
+    assert values.tolist() == [0, 1, 3, 31, 0, 2, 6, 0, 0, 0, 0, 0]
+    assert valid.all()
+    values, valid = series[1]
+    assert values.shape == (12, 4)
+    assert values[1].tolist() == [2, 3, 4, 5]
+    assert valid.tolist() == [False, True] + [False] * 10
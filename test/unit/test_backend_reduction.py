@@ -1,31 +1,80 @@
 from ln.backend import reduction
+from ln.backend.timestamp import to_epoch_us
 from datetime import datetime
+import numpy as np
 import pytest
 
 
 @pytest.fixture
 def group():
-    times = [datetime(2013, 8, 26, i + 1, 0, 0) for i in range(5)]
-    values = [1, 2, 3, 4, 5]
-    center_time = datetime(2013, 8, 26, 1, 40, 0)
-    return dict(times=times, values=values, center_time=center_time)
+    times = to_epoch_us([datetime(2013, 8, 26, i + 1, 0, 0) for i in range(5)])
+    values = np.array([1, 2, 3, 4, 5])
+    offsets = np.array([0])
+    center_times = to_epoch_us([datetime(2013, 8, 26, 1, 40, 0)])
+    return dict(times=times, values=values, offsets=offsets,
+        center_times=center_times)
+
+
+@pytest.fixture
+def groups():
+    times = to_epoch_us([datetime(2013, 8, 26, i + 1, 0, 0) for i in range(5)])
+    values = np.array([[1, 10], [2, 20], [3, 30], [4, 40], [5, 50]])
+    offsets = np.array([0, 2])
+    center_times = to_epoch_us([datetime(2013, 8, 26, 1, 40, 0),
+        datetime(2013, 8, 26, 3, 50, 0)])
+    return dict(times=times, values=values, offsets=offsets,
+        center_times=center_times)
 
 
 def test_closest(group):
-    assert reduction.closest(**group) == 2
+    assert np.array_equal(reduction.closest(**group), [2])
+
+
+def test_first_last(group, groups):
+    assert np.array_equal(reduction.first(**group), [1])
+    assert np.array_equal(reduction.last(**group), [5])
+    assert np.array_equal(reduction.first(**groups), [[1, 10], [3, 30]])
+    assert np.array_equal(reduction.last(**groups), [[2, 20], [5, 50]])
 
 
 def test_sum(group):
-    assert reduction.sum(**group) == 15
+    assert np.array_equal(reduction.sum(**group), [15])
 
 
 def test_mean(group):
-    assert reduction.mean(**group) == 3
+    assert np.array_equal(reduction.mean(**group), [3])
 
 
 def test_min(group):
-    assert reduction.min(**group) == 1
+    assert np.array_equal(reduction.min(**group), [1])
 
 
 def test_max(group):
-    assert reduction.max(**group) == 5
+    assert np.array_equal(reduction.max(**group), [5])
+
+
+def test_closest_groups(groups):
+    assert np.array_equal(reduction.closest(**groups), [[2, 20], [4, 40]])
+
+
+def test_closest_tie():
+    times = np.array([0, 10, 10, 20])
+    values = np.array([1, 2, 3, 4])
+    result = reduction.closest(times, values, np.array([0]), np.array([15]))
+    assert np.array_equal(result, [2])
+
+
+def test_sum_groups(groups):
+    assert np.array_equal(reduction.sum(**groups), [[3, 30], [12, 120]])
+
+
+def test_mean_groups(groups):
+    assert np.array_equal(reduction.mean(**groups), [[1.5, 15], [4, 40]])
+
+
+def test_min_groups(groups):
+    assert np.array_equal(reduction.min(**groups), [[1, 10], [3, 30]])
+
+
+def test_max_groups(groups):
+    assert np.array_equal(reduction.max(**groups), [[2, 20], [5, 50]])
@@ -0,0 +1,82 @@
+from ln.backend import rollup
+import numpy as np
+
+
+def test_aggregate():
+    times = np.array([0, 10, 60 * 10**6, 61 * 10**6, 200 * 10**6])
+    values = np.array([1.0, 3.0, 5.0, -2.0, 4.0])
+    buckets = rollup.aggregate(times, values, 60)
+
+    assert len(buckets) == 3
+    assert np.array_equal(buckets.start, [0, 60 * 10**6, 180 * 10**6])
+    assert np.array_equal(buckets.count, [2, 2, 1])
+    assert np.array_equal(buckets.sum, [4.0, 3.0, 4.0])
+    assert np.array_equal(buckets.min, [1.0, -2.0, 4.0])
+    assert np.array_equal(buckets.max, [3.0, 5.0, 4.0])
+    assert np.array_equal(buckets.first_time, [0, 60 * 10**6, 200 * 10**6])
+    assert np.array_equal(buckets.first_value, [1.0, 5.0, 4.0])
+    assert np.array_equal(buckets.last_time, [10, 61 * 10**6, 200 * 10**6])
+    assert np.array_equal(buckets.last_value, [3.0, -2.0, 4.0])
+
+
+def test_aggregate_empty():
+    buckets = rollup.aggregate(np.array([], dtype=np.int64), np.array([]), 1)
+    assert len(buckets) == 0
+
+
+def test_concatenate():
+    times = np.arange(0, 10 * 10**6, 10**5)
+    values = np.sin(np.arange(len(times)))
+    whole = rollup.aggregate(times, values, 3)
+    split = rollup.concatenate([rollup.aggregate(times[:45], values[:45], 3),
+        rollup.aggregate(times[45:], values[45:], 3)])
+
+    for field in rollup.FIELDS:
+        assert np.allclose(getattr(whole, field), getattr(split, field))
+
+
+def test_pick_interval():
+    intervals = [1, 60, 3600]
+    hour = 3600 * 10**6
+    assert rollup.pick_interval(intervals, np.array([0, 10**5])) is None
+    assert rollup.pick_interval(intervals, np.array([0, 10**6])) == 1
+    assert rollup.pick_interval(intervals, np.array([0, 3599 * 10**6])) == 1
+    assert rollup.pick_interval(intervals, np.array([0, 10 * hour])) == 3600
+    assert rollup.pick_interval([], np.array([0, 10 * hour])) is None
+
+    # Tiers that do not line up with the bins need several buckets per bin
+    assert rollup.pick_interval(intervals, np.array([1, 3599 * 10**6 + 1])) \
+        == 60
+    assert rollup.pick_interval(intervals, np.array([1, 10**6 + 1])) is None
+    assert rollup.pick_interval(intervals,
+        np.array([hour // 2, 3 * hour // 2])) == 60
+
+
+def test_whole_buckets():
+    times = np.arange(0, 10 * 10**6, 10**5)
+    buckets = rollup.aggregate(times, np.ones(len(times)), 1)
+    bin_edges = np.array([1, 3, 6, 8]) * 10**6 + 5 * 10**5
+
+    whole = rollup.whole_buckets(buckets, bin_edges, 1)
+    assert np.array_equal(whole.start, np.array([2, 4, 5, 7]) * 10**6)
+
+    lo, hi = rollup.partial_ranges(bin_edges, 1)
+    assert np.array_equal(lo, np.array([1.5, 3, 6, 8]) * 10**6)
+    assert np.array_equal(hi, np.array([2, 4, 7, 8.5]) * 10**6)
+
+    combined = rollup.combine([whole,
+        rollup.from_points(times[15:20], np.ones(5))])
+    assert np.array_equal(combined.start[:6],
+        [15 * 10**5, 16 * 10**5, 17 * 10**5, 18 * 10**5, 19 * 10**5, 2 * 10**6])
+
+
+def test_merges():
+    times = np.arange(6) * 10**6
+    values = np.array([1.0, 2.0, 6.0, 4.0, 5.0, 3.0])
+    buckets = rollup.aggregate(times, values, 1)
+    offsets = np.array([0, 2])
+
+    assert np.array_equal(rollup.merge_sum(buckets, offsets), [3.0, 18.0])
+    assert np.array_equal(rollup.merge_mean(buckets, offsets), [1.5, 4.5])
+    assert np.array_equal(rollup.merge_min(buckets, offsets), [1.0, 3.0])
+    assert np.array_equal(rollup.merge_max(buckets, offsets), [2.0, 6.0])
@@ -0,0 +1,185 @@
+from ln.backend.scheduler import ContinuousScheduler, BinSummary, \
+    align_continuous, TICK_RESOLUTION_US
+from ln.backend.reduction import REDUCTIONS
+from ln.backend.selector import create_selector
+from ln.backend.bus import AppendBus
+from ln.backend.memory import MemoryBackend
+from ln.backend.timestamp import now_epoch_us
+from itertools import islice
+import threading
+import numpy as np
+import pytest
+
+
+def make_selectors(interpolation='zero'):
+    config = dict(name='int', type='int32', reduction='sum',
+        interpolation=interpolation)
+    return [create_selector(config)]
+
+
+def test_align_continuous():
+    first, last, delta_t = align_continuous(10**9 + 7, 10**9 + 62000 * 59, 60)
+    assert delta_t == 62000 and delta_t % (2 * TICK_RESOLUTION_US) == 0
+    assert last % delta_t == 0
+    assert abs(last - (10**9 + 62000 * 59)) <= delta_t // 2
+    assert last - first == 59 * delta_t
+
+    # Narrow bins keep microsecond resolution
+    first, last, delta_t = align_continuous(0, 90, 4)
+    assert delta_t == 30 and (first, last) == (0, 90)
+
+
+@pytest.mark.parametrize('reduction', sorted(REDUCTIONS))
+def test_bin_summary(reduction):
+    # Adding points a chunk at a time gives the reduction of the whole bin
+    times = np.array([0, 10, 10, 40, 60, 60, 90])
+    values = np.array([5, 3, 8, 1, 9, 2, 4])
+    summary = BinSummary(reduction, 50)
+    for lo, hi in [(0, 2), (2, 3), (3, 3), (3, 7)]:
+        summary.add(times[lo:hi], values[lo:hi])
+    expected = REDUCTIONS[reduction](times, values, np.array([0]),
+        np.array([50]))
+    assert summary.reduced().tolist() == expected.tolist()
+    assert BinSummary(reduction, 50).reduced() is None
+
+
+def test_shared_ticks():
+    bus = AppendBus()
+    scheduler = ContinuousScheduler(bus)
+    delta_t = 10**4
+    start = (now_epoch_us() // delta_t - 100) * delta_t
+    # Hold off the scheduler thread until everyone has subscribed
+    with scheduler._condition:
+        gen_a = scheduler.subscribe(make_selectors(), start, delta_t)
+        gen_b = scheduler.subscribe(make_selectors(), start, delta_t)
+        # A later subscriber on the same grid skips the bins it already has
+        gen_c = scheduler.subscribe(make_selectors(), start + 2 * delta_t,
+            delta_t)
+        assert len(scheduler._groups) == 1
+        bus.publish('int', np.array([start - delta_t, start, start + 1,
+            start + delta_t + 5, start + 2 * delta_t]),
+            np.array([100, 1, 2, 3, 4]))
+        bus.publish('other', np.array([start]), np.array([100]))
+
+    results_a = list(islice(gen_a, 3))
+    results_b = list(islice(gen_b, 3))
+    results_c = list(islice(gen_c, 1))
+    assert [t[0] - start for t, _ in results_a] == [0, delta_t, 2 * delta_t]
+    assert [values for _, values in results_a] == [[[3]], [[3]], [[4]]]
+    # Every subscriber gets the same result object for a bin
+    assert all(a[1] is b[1] for a, b in zip(results_a, results_b))
+    assert results_c[0][1] is results_a[2][1]
+
+    for gen in (gen_a, gen_b, gen_c):
+        gen.close()
+    assert scheduler._groups == {} and scheduler._series_groups == {}
+
+
+def test_point_updates():
+    bus = AppendBus()
+    scheduler = ContinuousScheduler(bus)
+    delta_t = 3600 * 10**6
+    start = now_epoch_us()
+    gen = scheduler.subscribe(make_selectors(), start, delta_t,
+        updates='point')
+
+    bus.publish('int', np.array([start]), np.array([5]))
+    bus.publish('int', np.array([start + 1, start + 2]), np.array([1, 2]))
+    updates = list(islice(gen, 2))
+    assert [times[0] for times, _ in updates] == [start, start]
+    assert [values for _, values in updates] == [[[5]], [[8]]]
+    gen.close()
+
+    # Only a summary of the open bin is kept, and updates are delivered by
+    # the scheduler thread rather than the thread adding data
+    threads = []
+    delivered = threading.Event()
+
+    def callback(result):
+        threads.append(threading.current_thread())
+        delivered.set()
+    cancel = scheduler.add_subscriber(make_selectors(), start, delta_t,
+        callback, updates='point')
+    group, = scheduler._groups.values()
+    bus.publish('int', np.arange(start, start + 1000), np.ones(1000))
+    summary, = group.bins[start]
+    assert summary.count == 1000 and summary.value.tolist() == [1000]
+    assert delivered.wait(5)
+    assert threads == [scheduler._thread]
+    cancel()
+
+
+def test_previous_interpolation():
+    bus = AppendBus()
+    scheduler = ContinuousScheduler(bus)
+    delta_t = 10**4
+    start = (now_epoch_us() // delta_t - 100) * delta_t
+    with scheduler._condition:
+        gen = scheduler.subscribe(make_selectors('previous'), start,
+            delta_t)
+        bus.publish('int', np.array([start, start + 2 * delta_t]),
+            np.array([3, 4]))
+
+    # Empty bins repeat the last value, as in an ordinary query
+    results = list(islice(gen, 4))
+    assert [values for _, values in results] == [[[3]], [[3]], [[4]], [[4]]]
+    gen.close()
+
+
+def test_backend_continuous():
+    b = MemoryBackend()
+    b.create_series(name='int', type='int32', reduction='sum',
+        interpolation='zero', description='', unit='', metadata='')
+    first = now_epoch_us() - 10**5
+    times, values, gen = b.query_continuous(['int'], first, 2,
+        updates='point')
+    b.add_data('int', int(times[-1]) + 10**5, 7)
+    new_times, new_values = next(gen)
+    assert new_times[0] == times[-1] + 10**5
+    assert new_values == [[7]]
+    gen.close()
+
+
+def test_close_unread():
+    b = MemoryBackend()
+    b.create_series(name='int', type='int32', reduction='sum',
+        interpolation='zero', description='', unit='', metadata='')
+    times, values, gen = b.query_continuous(['int'], now_epoch_us() - 10**5,
+        2)
+    assert len(b._scheduler._groups) == 1
+
+    # Closing without ever reading still ends the subscription
+    gen.close()
+    assert len(b._scheduler._groups) == 0
+    assert list(gen) == []
+
+
+def test_failing_callback():
+    bus = AppendBus()
+    scheduler = ContinuousScheduler(bus)
+    delta_t = 10**4
+    start = (now_epoch_us() // delta_t - 100) * delta_t
+    calls = []
+
+    def fail(result):
+        calls.append(result)
+        raise RuntimeError('Event loop is closed')
+
+    with scheduler._condition:
+        scheduler.add_subscriber(make_selectors(), start, delta_t, fail,
+            updates='point')
+        gen = scheduler.subscribe(make_selectors(), start, delta_t,
+            updates='point')
+        bus.publish('int', np.array([start]), np.array([5]))
+
+    # The failure stays out of the thread adding data, and only ends the
+    # failing subscription, while the scheduler thread keeps ticking
+    results = list(islice(gen, 4))
+    assert len(calls) == 1
+    assert results[0][1] == [[5]]
+    assert [t[0] - start for t, _ in results[1:]] == \
+        [0, delta_t, 2 * delta_t]
+    assert scheduler._thread is not None
+    group, = scheduler._groups.values()
+    assert len(group.subscribers) == 1
+    gen.close()
@@ -0,0 +1,219 @@
+from ln.backend.segment import SegmentBackend
+from ln.backend.exception import BackendError, BadTypeError, SeriesCreationError, \
+    SeriesDoesNotExistError, SeriesTimeOrderError
+from ln.backend.timestamp import to_epoch_us, datetime_to_epoch_us
+from datetime import datetime, timedelta
+import os
+import pytest
+import numpy as np
+
+
+def create_series(b):
+    int_config = dict(
+        name='int',
+        type='int32',
+        reduction='sum',
+        interpolation='zero',
+        description='Integer counter',
+        unit='',
+        metadata=''
+    )
+    b.create_series(**int_config)
+    array_config = dict(
+        name='array',
+        type='float32[2,2]',
+        reduction='mean',
+        interpolation='none',
+        description='Array',
+        unit='',
+        metadata=''
+    )
+    b.create_series(**array_config)
+    blob_config = dict(
+        name='blob',
+        type='blob:text/plain',
+        reduction='closest',
+        interpolation='none',
+        description='BLOB',
+        unit='',
+        metadata=''
+    )
+    b.create_series(**blob_config)
+
+
+@pytest.fixture
+def backend(tmpdir):
+    b = SegmentBackend(str(tmpdir.join('segments')))
+    create_series(b)
+    return b
+
+
+def test_create(backend):
+    assert backend.get_series_list() == ['int', 'array', 'blob']
+    assert backend.get_config('int')['type'] == 'int32'
+    assert backend.get_config('not.there') is None
+    with pytest.raises(SeriesCreationError):
+        create_series(backend)
+
+
+def test_update_config(backend):
+    backend.update_config('int', description='foo')
+    assert backend.get_config('int')['description'] == 'foo'
+    with pytest.raises(SeriesDoesNotExistError):
+        backend.update_config('not.there', unit='')
+
+
+def test_add_int(backend):
+    times = []
+    for i in range(10):
+        times.append(datetime.now())
+        assert backend.add_data('int', times[-1], i) == i
+
+    db_times, db_values, next_seq = backend.get_data('int', 0)
+    assert np.array_equal(to_epoch_us(times), db_times)
+    assert list(range(10)) == db_values
+    assert next_seq is None
+
+    db_times, db_values, next_seq = backend.get_data('int', 1, 2)
+    assert np.array_equal(to_epoch_us(times[1:3]), db_times)
+    assert [1, 2] == db_values
+    assert next_seq == 3
+
+    db_times, db_values, next_seq = backend.get_data('int')
+    assert np.array_equal(to_epoch_us([times[-1]]), db_times)
+    assert [9] == db_values
+
+
+def test_add_array(backend):
+    now = datetime.now()
+    backend.add_data('array', now, [[1, 2], [3, 4]])
+    db_times, db_values, next_seq = backend.get_data('array', 0)
+    assert db_values == [[[1.0, 2.0], [3.0, 4.0]]]
+
+    with pytest.raises(BadTypeError):
+        backend.add_data('array', now, [1, 2])
+
+
+def test_add_blob(backend):
+    now = datetime.now()
+    backend.add_data('blob', now, b'abc')
+    backend.add_data('blob', now, b'')
+    backend.add_data('blob', now, b'\x00\xff')
+
+    db_times, db_values, next_seq = backend.get_data('blob', 0)
+    assert [b'abc', b'', b'\x00\xff'] == [v.get_bytes() for v in db_values]
+
+
+def test_get_data_arrays(backend):
+    start = datetime(2015, 3, 1)
+    times = [start + timedelta(seconds=i) for i in range(10)]
+    backend.add_data_many('int', times, range(10))
+    backend.add_data_many('array', times,
+        [np.arange(4).reshape(2, 2) * i for i in range(10)])
+
+    db_times, db_values, next_seq = backend.get_data_arrays('int',
+        first=times[2], last=times[5])
+    assert np.array_equal(to_epoch_us(times[2:5]), db_times)
+    assert db_values.dtype == np.int64
+    assert db_values.tolist() == [2, 3, 4]
+    assert next_seq is None
+
+    db_times, db_values, next_seq = backend.get_data_arrays('array', 8)
+    assert db_values.shape == (2, 2, 2)
+    assert db_values.tolist() == [[[0, 8], [16, 24]], [[0, 9], [18, 27]]]
+
+    with pytest.raises(BackendError):
+        backend.get_data_arrays('blob', 0)
+
+
+def test_add_wrong_order(backend):
+    now = datetime.now()
+    backend.add_data('int', now, 1)
+    with pytest.raises(SeriesTimeOrderError):
+        backend.add_data('int', now - timedelta(hours=1), 2)
+    with pytest.raises(SeriesDoesNotExistError):
+        backend.add_data('doesnotexist', now, 1)
+
+
+def test_add_many(backend):
+    start = datetime(2013, 8, 26)
+    times = [start + timedelta(seconds=i) for i in range(6)]
+
+    assert list(backend.add_data_many('int', times[:2], [0, 1])) == [0, 1]
+    assert backend.add_data('int', times[2], 2) == 2
+    assert list(backend.add_data_many('int', times[3:], [3, 4, 5])) == \
+        [3, 4, 5]
+    db_times, db_values, next_seq = backend.get_data('int', 0)
+    assert np.array_equal(to_epoch_us(times), db_times)
+    assert (db_values, next_seq) == (list(range(6)), None)
+
+    with pytest.raises(SeriesTimeOrderError):
+        backend.add_data_many('int', [start], [1])
+
+    assert list(backend.add_data_many('blob', times[:3],
+        [b'a', b'', b'cd'])) == [0, 1, 2]
+    db_times, db_values, next_seq = backend.get_data('blob', 0)
+    assert [b'a', b'', b'cd'] == [v.get_bytes() for v in db_values]
+
+
+def test_publish_under_lock(backend):
+    # Appends are published before the next append can start, so
+    # subscribers see them in order
+    published = []
+    backend.append_bus.subscribe(lambda name, times, values:
+        published.append((list(values), backend._lock.locked())))
+    start = datetime(2013, 8, 26)
+    backend.add_data('int', start, 1)
+    backend.add_data_many('int', [start + timedelta(seconds=1)], [2])
+    assert published == [([1], True), ([2], True)]
+
+
+def test_reopen(tmpdir):
+    path = str(tmpdir.join('segments'))
+    b = SegmentBackend(path)
+    create_series(b)
+    now = datetime.now()
+    b.add_data('int', now, 5)
+    b.add_data('blob', now, b'abc')
+    b.update_config('int', unit='counts')
+    b.close()
+
+    # Simulate a point torn by a crash in the middle of a write
+    with open(os.path.join(path, '0.values'), 'ab') as f:
+        f.write(b'\x01\x02')
+
+    b = SegmentBackend(path)
+    assert b.get_series_list() == ['int', 'array', 'blob']
+    assert b.get_config('int')['unit'] == 'counts'
+    now_us = datetime_to_epoch_us(now)
+    times, values, resume = b.get_data('int', 0)
+    assert (list(times), values, resume) == ([now_us], [5], None)
+    assert b.get_data('blob')[1][0].get_bytes() == b'abc'
+    assert b.add_data('int', now, 6) == 1
+    times, values, resume = b.get_data('int', 0)
+    assert (list(times), values, resume) == ([now_us, now_us], [5, 6], None)
+
+
+def test_query(backend):
+    start = datetime(2013, 8, 26, 0, 0, 0)
+    backend.add_data('int', start + timedelta(hours=1), 1)
+    backend.add_data('int', start + timedelta(hours=2, minutes=29, seconds=59), 3)
+    backend.add_data('int', start + timedelta(hours=2, minutes=30), 10)
+    backend.add_data('int', start + timedelta(hours=3), 20)
+    backend.add_data('int', start + timedelta(hours=3, minutes=10), 1)
+    backend.add_data('int', start + timedelta(hours=5), 2)
+    backend.add_data('int', start + timedelta(hours=6), 6)
+    backend.add_data('blob', start + timedelta(hours=1), b'a')
+    backend.add_data('blob', start + timedelta(hours=1, minutes=10), b'b')
+
+    first = datetime(2013, 8, 26, 0, 0, 0)
+    last = datetime(2013, 8, 26, 11, 0, 0)
+
+    times, values = backend.query(['int', 'blob'], first, last, 12)
+    assert values[0] == [0, 1, 3, 31, 0, 2, 6, 0, 0, 0, 0, 0]
+    assert values[1] == [None, b'a'] + [None] * 10
+
+    times, values = backend.query(['blob:closest:zero', 'blob:closest:previous'],
+        first, last, 4)
+    assert values[0] == [b'a', b'', b'', b'']
+    assert values[1] == [b'a', b'a', b'a', b'a']
@@ -5,6 +5,7 @@ from ln.backend.interpolation import previous as interp_previous
 from ln.backend.reduction import sum as reduce_sum
 from ln.backend.reduction import closest as reduce_closest
 from ln.backend.exception import BadSelectorError
+from ln.backend.timestamp import to_epoch_us
 
 from datetime import datetime
 import numpy as np
@@ -90,11 +91,31 @@ def test_apply_strategies():
         interpolation='zero')
     s = create_selector(config)
 
-    # Dummy time
-    t = datetime(2013, 8, 26, 11, 0, 0)
-
-    center_times = [datetime(2013, 8, 26, i + 1, 0, 0) for i in range(5)]
-    groups = [[(t, 1), (t, 5), (t, 10)],
-        [(t, 2), (t, 2)], [], [(t, 1)], [(t, 4), (t, 5), (t, 6)]]
-    resampled_values = s.apply_strategies(center_times, groups)
+    bin_edges = to_epoch_us([datetime(2013, 8, 26, i, 30, 0)
+        for i in range(6)])
+    center_times = to_epoch_us([datetime(2013, 8, 26, i + 1, 0, 0)
+        for i in range(5)])
+    times = to_epoch_us([datetime(2013, 8, 26, 0, 0, 0)]  # Before first bin
+        + [datetime(2013, 8, 26, 1, 0, 0)] * 3
+        + [datetime(2013, 8, 26, 2, 0, 0)] * 2
+        + [datetime(2013, 8, 26, 4, 0, 0)]
+        + [datetime(2013, 8, 26, 5, 0, 0)] * 3
+        + [datetime(2013, 8, 26, 5, 30, 0)])  # Past last bin
+    values = np.array([100, 1, 5, 10, 2, 2, 1, 4, 5, 6, 100])
+    resampled_values = s.apply_strategies(bin_edges, center_times,
+        times, values)
     assert np.array_equal(resampled_values, [16, 4, 0, 1, 15])
+
+
+def test_apply_strategies_empty():
+    config = dict(name='foo', type='float32[2]', reduction='mean',
+        interpolation='none')
+    s = create_selector(config)
+
+    bin_edges = np.array([0, 10, 20])
+    center_times = np.array([5, 15])
+    times = np.array([], dtype=np.int64)
+    values = s.datatype.stack([])
+    resampled_values = s.apply_strategies(bin_edges, center_times,
+        times, values)
+    assert resampled_values == [None, None]
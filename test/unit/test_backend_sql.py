@@ -1,5 +1,9 @@
 from ln.backend.sql import SQLBackend
-from ln.backend.exception import SeriesCreationError, SeriesDoesNotExistError
+from sqlalchemy import create_engine, inspect, event
+from ln.backend.timestamp import to_epoch_us, datetime_to_epoch_us
+from datetime import datetime
+from ln.backend.exception import SeriesCreationError, \
+    SeriesDoesNotExistError, SeriesTimeOrderError
 import pytest
 
 
@@ -117,3 +121,180 @@ def test_create_source_array():
 
     for key, value in true_config.items():
         assert config[key] == value
+
+
+def test_series_indexes():
+    b = SQLBackend('sqlite://')
+    inspector = inspect(b._engine)
+    for table in ['int', 'float', 'array', 'blob']:
+        indexes = dict((index['name'], index['column_names'])
+            for index in inspector.get_indexes(table))
+        assert indexes['ix_%s_name_sequence' % table] == ['name', 'sequence']
+        assert indexes['ix_%s_name_timestamp' % table] == \
+            ['name', 'timestamp']
+
+
+def test_add_missing_indexes(tmpdir):
+    url = 'sqlite:///' + str(tmpdir.join('test.sqlite'))
+    engine = create_engine(url)
+    engine.execute('CREATE TABLE float (id INTEGER PRIMARY KEY, '
+        'name VARCHAR, sequence INTEGER, timestamp DATETIME, value FLOAT)')
+    engine.dispose()
+
+    b = SQLBackend(url)
+    index_names = [index['name'] for index in
+        inspect(b._engine).get_indexes('float')]
+    assert 'ix_float_name_sequence' in index_names
+    assert 'ix_float_name_timestamp' in index_names
+
+
+def test_unique_sequences(tmpdir):
+    # Databases from before unique sequence numbers get the unique index
+    url = 'sqlite:///' + str(tmpdir.join('test.sqlite'))
+    engine = create_engine(url)
+    engine.execute('CREATE TABLE schema_info (key VARCHAR PRIMARY KEY, '
+        'value VARCHAR)')
+    engine.execute("INSERT INTO schema_info VALUES ('version', '3')")
+    engine.execute('CREATE TABLE int (id INTEGER PRIMARY KEY, '
+        'name VARCHAR, sequence INTEGER, timestamp BIGINT, value INTEGER)')
+    engine.execute('CREATE INDEX ix_int_name_sequence ON int (name, sequence)')
+    engine.dispose()
+
+    b = SQLBackend(url)
+    unique = dict((index['name'], index['unique'])
+        for index in inspect(b._engine).get_indexes('int'))
+    assert unique['ix_int_name_sequence']
+
+
+def test_second_writer(tmpdir):
+    url = 'sqlite:///' + str(tmpdir.join('test.sqlite'))
+    a = SQLBackend(url)
+    a.create_series(name='rate', type='int32', reduction='sum',
+        interpolation='zero', unit='', description='', metadata='')
+    b = SQLBackend(url)
+    assert a.add_data('rate', 1000, 1) == 0
+    assert b.add_data('rate', 2000, 2) == 1
+    assert list(b.add_data_many('rate', [3000], [3])) == [2]
+
+    # A's tail is stale, so the write must see B's points
+    with pytest.raises(SeriesTimeOrderError):
+        a.add_data('rate', 1500, 4)
+    with pytest.raises(SeriesTimeOrderError):
+        a.add_data_many('rate', [1500], [4])
+    assert a.add_data('rate', 4000, 4) == 3
+    assert list(b.add_data_many('rate', [5000], [5])) == [4]
+    assert b.add_data_multi({'rate': ([6000], [6])})['rate'] == range(5, 6)
+
+    times, values, resume = a.get_data('rate', 0)
+    assert list(times) == [1000, 2000, 3000, 4000, 5000, 6000]
+    assert values == [1, 2, 3, 4, 5, 6]
+
+
+def test_migrate_json_arrays(tmpdir):
+    # Build a database the way versions before binary array storage did
+    url = 'sqlite:///' + str(tmpdir.join('test.sqlite'))
+    engine = create_engine(url)
+    engine.execute('CREATE TABLE series (id INTEGER PRIMARY KEY, '
+        'name VARCHAR, type VARCHAR, reduction VARCHAR, '
+        'interpolation VARCHAR, unit VARCHAR, description VARCHAR, '
+        'meta VARCHAR)')
+    engine.execute('CREATE TABLE array (id INTEGER PRIMARY KEY, '
+        'name VARCHAR, sequence INTEGER, timestamp DATETIME, value TEXT)')
+    engine.execute("INSERT INTO series VALUES (1, 'rates', 'int16[2,2]', "
+        "'mean', 'none', '', '', '')")
+    for i in range(3):
+        engine.execute("INSERT INTO array VALUES (?, 'rates', ?, "
+            "'2013-08-26 0%d:00:00.000000', ?)" % i, i + 1, i,
+            '[[%d, 1], [2, 3]]' % i)
+    engine.dispose()
+
+    b = SQLBackend(url)
+    times, values, resume = b.get_data('rates', 0)
+    assert values == [[[i, 1], [2, 3]] for i in range(3)]
+    assert times[2] == datetime_to_epoch_us(datetime(2013, 8, 26, 2))
+
+    # Opening again must not re-run the migration
+    b = SQLBackend(url)
+    assert b.get_data('rates')[1] == [[[2, 1], [2, 3]]]
+
+
+def test_migrate_interrupted(tmpdir, monkeypatch):
+    import ln.backend.sql
+    url = 'sqlite:///' + str(tmpdir.join('test.sqlite'))
+    engine = create_engine(url)
+    engine.execute('CREATE TABLE series (id INTEGER PRIMARY KEY, '
+        'name VARCHAR, type VARCHAR, reduction VARCHAR, '
+        'interpolation VARCHAR, unit VARCHAR, description VARCHAR, '
+        'meta VARCHAR)')
+    engine.execute('CREATE TABLE array (id INTEGER PRIMARY KEY, '
+        'name VARCHAR, sequence INTEGER, timestamp DATETIME, value TEXT)')
+    engine.execute("INSERT INTO series VALUES (1, 'rates', 'int16[2]', "
+        "'mean', 'none', '', '', '')")
+    for i in range(5):
+        engine.execute("INSERT INTO array VALUES (?, 'rates', ?, "
+            "'2013-08-26 0%d:00:00.000000', ?)" % i, i + 1, i, '[%d, 1]' % i)
+    engine.dispose()
+
+    # Fail while converting the third timestamp, one row per batch
+    converted = []
+
+    def failing_convert(dt):
+        if len(converted) == 2:
+            raise RuntimeError('interrupted')
+        converted.append(dt)
+        return datetime_to_epoch_us(dt)
+    monkeypatch.setattr(ln.backend.sql, 'datetime_to_epoch_us',
+        failing_convert)
+    migrate_datetimes = SQLBackend._migrate_datetimes
+    monkeypatch.setattr(SQLBackend, '_migrate_datetimes',
+        lambda self: migrate_datetimes(self, batch_size=1))
+    with pytest.raises(RuntimeError):
+        SQLBackend(url)
+
+    # The finished migration and batches were committed
+    engine = create_engine(url)
+    info = dict((row.key, row.value)
+        for row in engine.execute('SELECT key, value FROM schema_info'))
+    assert (info['version'], info['upgrade:3:array']) == ('2', '2')
+    engine.dispose()
+
+    # Opening again resumes after the last committed batch
+    monkeypatch.undo()
+    b = SQLBackend(url)
+    times, values, resume = b.get_data('rates', 0)
+    assert values == [[i, 1] for i in range(5)]
+    assert list(times) == [datetime_to_epoch_us(datetime(2013, 8, 26, i))
+        for i in range(5)]
+    engine = create_engine(url)
+    assert list(engine.execute("SELECT key, value FROM schema_info "
+        "WHERE key LIKE 'upgrade:%' OR key = 'version'")) == [('version', '4')]
+    engine.dispose()
+
+
+def test_series_lookup_cached():
+    b = SQLBackend('sqlite://')
+    b.create_series(name='rate', type='int32', reduction='sum',
+        interpolation='zero', unit='', description='', metadata='')
+    b.add_data('rate', datetime(2013, 8, 26, 1), 1)
+
+    statements = []
+    event.listen(b._engine, 'before_cursor_execute',
+        lambda conn, cursor, statement, *args: statements.append(statement))
+
+    b.add_data('rate', datetime(2013, 8, 26, 2), 2)
+    b.get_data('rate')
+    b.get_config('rate')
+    b.query(['rate'], datetime(2013, 8, 26, 1), datetime(2013, 8, 26, 2), 2)
+    assert not [s for s in statements if 'FROM series' in s]
+
+    # Inserts do not read back the last point of the series
+    del statements[:]
+    b.add_data('rate', datetime(2013, 8, 26, 3), 3)
+    assert not [s for s in statements if s.startswith('SELECT')]
+
+    # Missing series are not cached
+    with pytest.raises(SeriesDoesNotExistError):
+        b.add_data('late', datetime(2013, 8, 26, 2), 2)
+    b.create_series(name='late', type='int32', reduction='sum',
+        interpolation='zero', unit='', description='', metadata='')
+    assert b.add_data('late', datetime(2013, 8, 26, 2), 2) == 0
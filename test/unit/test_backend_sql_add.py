@@ -1,6 +1,7 @@
 from ln.backend.sql import SQLBackend
-from ln.backend.exception import BadTypeError, SeriesDoesNotExistError, \
+from ln.backend.exception import BackendError, BadTypeError, SeriesDoesNotExistError, \
     SeriesTimeOrderError
+from ln.backend.timestamp import to_epoch_us, datetime_to_epoch_us
 from datetime import datetime, timedelta
 import pytest
 import numpy as np
@@ -82,7 +83,7 @@ def test_get_last(backend):
     db_times, db_values, next_seq = b.get_data('int')
     assert len(db_times) == 1
     assert len(db_values) == 1
-    assert times[-1] == db_times[0]
+    assert datetime_to_epoch_us(times[-1]) == db_times[0]
     assert 9 == db_values[0]
     assert next_seq is None
 
@@ -98,17 +99,61 @@ def test_get_limit(backend):
     assert len(db_times) == 2
     assert len(db_values) == 2
     assert next_seq == 3
-    assert times[1:3] == db_times
+    assert np.array_equal(to_epoch_us(times[1:3]), db_times)
     assert [1, 2] == db_values
 
     db_times, db_values, next_seq = b.get_data('int', 9, 2)
     assert len(db_times) == 1
     assert len(db_values) == 1
     assert next_seq is None
-    assert times[-1] == db_times[0]
+    assert datetime_to_epoch_us(times[-1]) == db_times[0]
     assert [9] == db_values
 
 
+def test_get_pages(backend):
+    from sqlalchemy import event
+
+    b = backend
+    start = datetime(2015, 3, 1)
+    times = [start + timedelta(seconds=i) for i in range(20)]
+    b.add_data_many('int', times, np.arange(20))
+
+    executed = []
+    event.listen(b._engine, 'before_cursor_execute',
+        lambda conn, cursor, statement, parameters, *args:
+            executed.append((statement, parameters)))
+
+    # Pages seek to their first sequence number instead of skipping rows
+    db_times, db_values, next_seq = b.get_data('int', 15, 3)
+    assert [15, 16, 17] == db_values
+    assert next_seq == 18
+    statement, parameters = executed[-1]
+    assert 'sequence >=' in statement
+    assert 15 in parameters
+    assert 'OFFSET' not in statement or parameters[-1] == 0
+
+    # Time bounds select [first, last)
+    first = start + timedelta(seconds=4.5)
+    last = start + timedelta(seconds=12)
+    db_times, db_values, next_seq = b.get_data('int', limit=4, first=first,
+        last=last)
+    assert np.array_equal(to_epoch_us(times[5:9]), db_times)
+    assert [5, 6, 7, 8] == db_values
+    assert next_seq == 9
+
+    db_times, db_values, next_seq = b.get_data('int', next_seq, 4,
+        first=first, last=last)
+    assert [9, 10, 11] == db_values
+    assert next_seq is None
+
+    # Nothing in range
+    db_times, db_values, next_seq = b.get_data('int',
+        first=start + timedelta(days=1))
+    assert len(db_times) == 0
+    assert [] == db_values
+    assert next_seq is None
+
+
 def test_add_int(backend):
     b = backend
     times = []
@@ -118,7 +163,7 @@ def test_add_int(backend):
         assert index == i
 
     db_times, db_values, next_seq = b.get_data('int', 0)
-    assert times == db_times
+    assert np.array_equal(to_epoch_us(times), db_times)
     assert list(range(10)) == db_values
     assert next_seq is None
 
@@ -132,7 +177,7 @@ def test_add_float(backend):
         assert index == i
 
     db_times, db_values, next_seq = b.get_data('float', 0)
-    assert times == db_times
+    assert np.array_equal(to_epoch_us(times), db_times)
     assert [i + 0.5 for i in range(10)] == db_values
     assert next_seq is None
 
@@ -148,7 +193,7 @@ def test_add_array(backend):
         assert index == i
 
     db_times, db_values, next_seq = b.get_data('array', 0)
-    assert times == db_times
+    assert np.array_equal(to_epoch_us(times), db_times)
     assert np.array_equal(np.array(values), np.array(db_values))
     assert next_seq is None
 
@@ -164,11 +209,38 @@ def test_add_blob(backend):
         assert index == i
 
     db_times, db_values, next_seq = b.get_data('blob', 0)
-    assert times == db_times
+    assert np.array_equal(to_epoch_us(times), db_times)
     assert values == [b.get_bytes() for b in db_values]
     assert next_seq is None
 
 
+def test_get_data_arrays(backend):
+    b = backend
+    start = datetime(2015, 3, 1)
+    times = [start + timedelta(seconds=i) for i in range(10)]
+    b.add_data_many('int', times, range(10))
+    b.add_data_many('array', times, [np.arange(4) * i for i in range(10)])
+
+    db_times, db_values, next_seq = b.get_data_arrays('int', 1, 3)
+    assert np.array_equal(to_epoch_us(times[1:4]), db_times)
+    assert db_values.dtype == np.int64
+    assert db_values.tolist() == [1, 2, 3]
+    assert next_seq == 4
+
+    db_times, db_values, next_seq = b.get_data_arrays('array', 8)
+    assert np.array_equal(to_epoch_us(times[8:]), db_times)
+    assert db_values.tolist() == [[0, 8, 16, 24], [0, 9, 18, 27]]
+    assert next_seq is None
+
+    db_times, db_values, next_seq = b.get_data_arrays('int',
+        first=start + timedelta(days=1))
+    assert len(db_times) == 0
+    assert db_values.tolist() == []
+
+    with pytest.raises(BackendError):
+        b.get_data_arrays('blob', 0)
+
+
 def test_add_wrong_order(backend):
     b = backend
 
@@ -182,3 +254,117 @@ def test_add_bad_type(backend):
     b = backend
     with pytest.raises(BadTypeError):
         b.add_data('int', datetime.now, [1, 2])
+
+
+def test_add_many(backend):
+    b = backend
+    start = datetime(2013, 8, 26)
+    times = [start + timedelta(seconds=i) for i in range(10)]
+
+    assert list(b.add_data_many('int', times[:4], range(4))) == [0, 1, 2, 3]
+    assert list(b.add_data_many('int', times[4:], range(4, 10))) == \
+        list(range(4, 10))
+    assert list(b.add_data_many('int', [], [])) == []
+
+    db_times, db_values, next_seq = b.get_data('int', 0)
+    assert np.array_equal(to_epoch_us(times), db_times)
+    assert list(range(10)) == db_values
+
+
+def test_add_many_array_and_blob(backend):
+    b = backend
+    now = datetime.now()
+    values = [np.arange(4) * i for i in range(3)]
+    assert list(b.add_data_many('array', [now] * 3, values)) == [0, 1, 2]
+    db_times, db_values, next_seq = b.get_data('array', 0)
+    assert np.array_equal(values, db_values)
+
+    assert list(b.add_data_many('blob', [now] * 2, [b'a', b'bc'])) == [0, 1]
+    db_times, db_values, next_seq = b.get_data('blob', 0)
+    assert [b'a', b'bc'] == [v.get_bytes() for v in db_values]
+
+
+def test_add_many_wrong_order(backend):
+    b = backend
+    now = datetime.now()
+    with pytest.raises(SeriesTimeOrderError):
+        b.add_data_many('int', [now, now - timedelta(hours=1)], [1, 2])
+
+    b.add_data('int', now, 1)
+    with pytest.raises(SeriesTimeOrderError):
+        b.add_data_many('int', [now - timedelta(hours=1), now], [1, 2])
+
+    # Nothing from the failed batches was written
+    db_times, db_values, next_seq = b.get_data('int', 0)
+    assert [1] == db_values
+
+
+def test_add_many_bad_type(backend):
+    b = backend
+    now = datetime.now()
+    with pytest.raises(BadTypeError):
+        b.add_data_many('int', [now, now], [1, 'foo'])
+    with pytest.raises(BadTypeError):
+        b.add_data_many('array', [now], [[1, 2]])
+    with pytest.raises(BadTypeError):
+        b.add_data_many('int', [now, now], [1])
+    with pytest.raises(SeriesDoesNotExistError):
+        b.add_data_many('doesnotexist', [now], [1])
+
+
+def test_add_multi(backend):
+    b = backend
+    now = datetime.now()
+    results = b.add_data_multi({
+        'int': ([now, now], [1, 2]),
+        'float': ([now], [1.5]),
+        'array': ([now], [[1, 2]]),
+        'doesnotexist': ([now], [1]),
+    })
+    assert list(results['int']) == [0, 1]
+    assert list(results['float']) == [0]
+    assert isinstance(results['array'], BadTypeError)
+    assert isinstance(results['doesnotexist'], SeriesDoesNotExistError)
+
+    assert b.get_data('int', 0)[1] == [1, 2]
+    assert b.get_data('float', 0)[1] == [1.5]
+    assert b.get_data('array', 0)[1] == []
+
+
+def test_add_resumes_existing_series(tmpdir):
+    url = 'sqlite:///' + str(tmpdir.join('test.sqlite'))
+    b = SQLBackend(url)
+    b.create_series(name='int', type='int32', reduction='sum',
+        interpolation='zero', unit='', description='', metadata='')
+    now = datetime.now()
+    b.add_data_many('int', [now, now], [1, 2])
+
+    # A new backend reads the tail of the series on first use
+    b = SQLBackend(url)
+    with pytest.raises(SeriesTimeOrderError):
+        b.add_data('int', now - timedelta(hours=1), 3)
+    assert b.add_data('int', now, 3) == 2
+
+
+def test_add_threaded(tmpdir):
+    import threading
+
+    b = SQLBackend('sqlite:///' + str(tmpdir.join('test.sqlite')))
+    b.create_series(name='int', type='int32', reduction='sum',
+        interpolation='zero', unit='', description='', metadata='')
+    now = datetime.now()
+    sequences = []
+
+    def writer():
+        for i in range(20):
+            sequences.append(b.add_data('int', now, i))
+
+    threads = [threading.Thread(target=writer) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every point got its own sequence number
+    assert sorted(sequences) == list(range(80))
+    assert len(b.get_data('int', 0)[1]) == 80
@@ -1,5 +1,6 @@
 from ln.backend.sql import SQLBackend
 from ln.backend.exception import BadSelectorError
+from ln.backend.timestamp import to_epoch_us, datetime_to_epoch_us
 from datetime import datetime, timedelta
 import pytest
 import numpy as np
@@ -44,6 +45,29 @@ def test_query_basic(backend):
     assert np.array_equal(values, [[1, 34, 2, 6, 0, 0]])
 
 
+def test_query_other_series(backend):
+    other_config = dict(
+        name='other',
+        type='int32',
+        reduction='sum',
+        interpolation='zero',
+        description='Another integer counter',
+        unit='',
+        metadata=''
+    )
+    backend.create_series(**other_config)
+    start = datetime(2013, 8, 26, 0, 0, 0)
+    backend.add_data('other', start + timedelta(hours=1, minutes=5), 100)
+    backend.add_data('other', start + timedelta(hours=4), 200)
+
+    first = datetime(2013, 8, 26, 0, 0, 0)
+    last = datetime(2013, 8, 26, 11, 0, 0)
+
+    times, values = backend.query(['int', 'other'], first, last, 12)
+    assert np.array_equal(values, [[0, 1, 3, 31, 0, 2, 6, 0, 0, 0, 0, 0],
+        [0, 100, 0, 0, 200, 0, 0, 0, 0, 0, 0, 0]])
+
+
 def test_bad_query(backend):
     first = datetime(2013, 8, 26, 0, 0, 0)
     last = datetime(2013, 8, 26, 11, 0, 0)
@@ -60,7 +84,7 @@ def test_bad_query(backend):
 
 def test_query_continuous(backend):
     delta_t = timedelta(milliseconds=100)
-    first = datetime.now() - delta_t
+    first = datetime.utcnow() - delta_t
 
     times, values, gen = backend.query_continuous(['int'], first, 2)
 
@@ -71,3 +95,203 @@ def test_query_continuous(backend):
         assert len(times) == 1
         assert len(values[0]) == 1
         assert values[0][0] == i + 2
+
+
+def make_rollup_backend(url, resampling_intervals):
+    b = SQLBackend(url, resampling_intervals=resampling_intervals)
+    b.create_series(name='float', type='float64', reduction='mean',
+        interpolation='none', description='', unit='', metadata='')
+    b.create_series(name='array', type='float64[2]', reduction='mean',
+        interpolation='none', description='', unit='', metadata='')
+    return b
+
+
+def add_minute_data(b, start):
+    times = [start + timedelta(seconds=15 * i) for i in range(4 * 60 * 6)]
+    values = np.sin(np.arange(len(times)) * 0.1)
+    b.add_data_many('float', times[:100], values[:100])
+    for time, value in zip(times[100:110], values[100:110]):
+        b.add_data('float', time, value)
+    b.add_data_many('float', times[110:], values[110:])
+    b.add_data_many('array', times, np.column_stack([values, values]))
+    return times, values
+
+
+@pytest.mark.parametrize('reduction', ['sum', 'mean', 'min', 'max'])
+def test_query_rollup(reduction):
+    raw = make_rollup_backend('sqlite://', [])
+    rolled = make_rollup_backend('sqlite://', [60, 3600])
+    start = datetime(2013, 8, 26)
+    add_minute_data(raw, start)
+    add_minute_data(rolled, start)
+
+    # Bin edges fall on hours, so the rollups give the same answer
+    selectors = ['float:' + reduction, 'array:' + reduction]
+    first = start + timedelta(minutes=30)
+    last = start + timedelta(hours=5, minutes=30)
+    expected = raw.query(selectors, first, last, 6)
+    times, values = rolled.query(selectors, first, last, 6)
+    assert np.array_equal(times, expected[0])
+    for series, expected_series in zip(values, expected[1]):
+        assert np.allclose(series, expected_series)
+
+
+def test_query_rollup_tier(monkeypatch):
+    b = make_rollup_backend('sqlite://', [60, 3600])
+    start = datetime(2013, 8, 26)
+    add_minute_data(b, start)
+
+    intervals = []
+    original = b._fetch_buckets
+    def fetch_buckets(session, names, interval, *args):
+        intervals.append(interval)
+        return original(session, names, interval, *args)
+    monkeypatch.setattr(b, '_fetch_buckets', fetch_buckets)
+
+    b.query(['float'], start, start + timedelta(hours=6), 3)
+    b.query(['float'], start, start + timedelta(hours=6), 60)
+    b.query(['float'], start, start + timedelta(hours=6), 1000)
+    b.query(['float:closest'], start, start + timedelta(hours=6), 3)
+    b.query(['float'], start, start + timedelta(hours=8), 5)
+    # The hour tier does not line up with the 3 hour bins starting at
+    # 22:30, but the minute tier does.  Bins of about 6 minutes do not line
+    # up with either, and hold too few minute buckets to use them.
+    assert intervals == [60, 3600]
+
+
+@pytest.mark.parametrize('reduction', ['sum', 'mean', 'min', 'max'])
+def test_query_rollup_unaligned(reduction):
+    raw = make_rollup_backend('sqlite://', [])
+    rolled = make_rollup_backend('sqlite://', [1, 60, 3600, 86400])
+    start = datetime(2013, 8, 26)
+    add_minute_data(raw, start)
+    add_minute_data(rolled, start)
+
+    # Bin edges fall inside the buckets of every tier
+    selectors = ['float:' + reduction]
+    first = start + timedelta(minutes=7, seconds=13)
+    last = start + timedelta(hours=5, minutes=41)
+    for npoints in [2, 5, 17]:
+        expected = raw.query(selectors, first, last, npoints)
+        times, values = rolled.query(selectors, first, last, npoints)
+        assert np.array_equal(times, expected[0])
+        assert np.allclose(values, expected[1])
+
+
+def test_rollup_reconfigure(tmpdir):
+    url = 'sqlite:///' + str(tmpdir.join('test.sqlite'))
+    b = make_rollup_backend(url, [])
+    start = datetime(2013, 8, 26)
+    add_minute_data(b, start)
+    first = start + timedelta(minutes=30)
+    last = start + timedelta(hours=5, minutes=30)
+    expected = b.query(['float:max'], first, last, 6)
+
+    # Rollups are built for existing data when intervals are added, and
+    # kept when the backend is opened without a list of intervals.
+    SQLBackend(url, resampling_intervals=[3600])
+    b = SQLBackend(url)
+    assert b._rollup_intervals == [3600]
+    assert b.query(['float:max'], first, last, 6)[1] == expected[1]
+
+    b = SQLBackend(url, resampling_intervals=[])
+    assert b._rollup_intervals == []
+    assert b.query(['float:max'], first, last, 6)[1] == expected[1]
+
+
+@pytest.mark.parametrize('reduction', ['closest', 'first', 'last'])
+def test_query_seek(monkeypatch, reduction):
+    b = SQLBackend('sqlite://')
+    b.create_series(name='float', type='float64', reduction='mean',
+        interpolation='none', description='', unit='', metadata='')
+    b.create_series(name='array', type='int32[2]', reduction='mean',
+        interpolation='none', description='', unit='', metadata='')
+    start = datetime(2013, 8, 26)
+    # Uneven spacing, with runs of points sharing the same timestamp
+    offsets = np.cumsum(np.arange(400) % 7 == 0) * 37
+    times = [start + timedelta(seconds=int(s)) for s in offsets]
+    b.add_data_many('float', times, np.arange(len(times)) * 0.5)
+    b.add_data_many('array', times,
+        np.column_stack([np.arange(len(times))] * 2))
+
+    selectors = ['float:' + reduction, 'array:' + reduction]
+    first = start - timedelta(minutes=3)
+    last = start + timedelta(hours=1)
+
+    monkeypatch.setattr('ln.backend.sql.SEEK_POINTS_PER_BIN', 10**6)
+    expected = b.query(selectors, first, last, 13)
+
+    seeks = []
+    original = b._resample_seek
+    def resample_seek(*args):
+        seeks.append(args)
+        return original(*args)
+    monkeypatch.setattr(b, '_resample_seek', resample_seek)
+    monkeypatch.setattr('ln.backend.sql.SEEK_POINTS_PER_BIN', 0)
+    times, values = b.query(selectors, first, last, 13)
+
+    assert len(seeks) == 2
+    assert np.array_equal(times, expected[0])
+    assert values == expected[1]
+
+
+def test_query_round_trips():
+    from sqlalchemy import event
+
+    b = SQLBackend('sqlite://')
+    start = datetime(2013, 8, 26)
+    names = ['a', 'b', 'c', 'empty', 'f']
+    for name in names:
+        b.create_series(name=name, type='float64' if name == 'f' else 'int32',
+            reduction='sum', interpolation='none', description='', unit='',
+            metadata='')
+        if name != 'empty':
+            b.add_data_many(name, [start + timedelta(minutes=i)
+                for i in range(10)], list(range(10)))
+    expected = [b.query([name], start, start + timedelta(minutes=9), 4)[1][0]
+        for name in names]
+
+    b._catalog.clear()
+    statements = []
+    event.listen(b._engine, 'before_cursor_execute',
+        lambda conn, cursor, statement, *args: statements.append(statement))
+    times, values = b.query(names + ['a:max'], start,
+        start + timedelta(minutes=9), 4)
+
+    assert values == expected + [[1, 4, 7, 9]]
+    # One catalog lookup, and one scan of each value table
+    assert len([s for s in statements if s.startswith('SELECT')]) == 3
+
+
+def test_query_workers(tmpdir, monkeypatch):
+    url = 'sqlite:///' + str(tmpdir.join('test.sqlite'))
+    serial = SQLBackend(url, resampling_intervals=[600])
+    start = datetime(2013, 8, 26)
+    times = [start + timedelta(seconds=37 * i) for i in range(300)]
+    for name, type_ in [('int', 'int32'), ('float', 'float64'),
+            ('array', 'float32[2]'), ('blob', 'blob:text/plain')]:
+        serial.create_series(name=name, type=type_, reduction='closest',
+            interpolation='previous', description='', unit='', metadata='')
+        if name == 'blob':
+            values = [str(i).encode() for i in range(len(times))]
+        elif type_ == 'float32[2]':
+            values = np.column_stack([np.arange(len(times))] * 2)
+        else:
+            values = np.arange(len(times))
+        serial.add_data_many(name, times, values)
+
+    parallel = SQLBackend(url, query_workers=4)
+    selectors = ['int', 'int:sum', 'float:mean:linear', 'array:mean',
+        'blob', 'float:last']
+    first = start - timedelta(minutes=5)
+    last = start + timedelta(hours=3)
+    for npoints in [2, 7, 40]:
+        expected = serial.query(selectors, first, last, npoints)
+        times, values = parallel.query(selectors, first, last, npoints)
+        assert np.array_equal(times, expected[0])
+        assert values == expected[1]
+
+    # Selections found by seeking run on the workers too
+    monkeypatch.setattr('ln.backend.sql.SEEK_POINTS_PER_BIN', 0)
+    times, values = parallel.query(selectors, first, last, 7)
+    assert values == serial.query(selectors, first, last, 7)[1]
@@ -0,0 +1,39 @@
+from ln.backend.timestamp import to_epoch_us, as_epoch_us, \
+    datetime_to_epoch_us, epoch_us_to_datetime, format_epoch_us, now_epoch_us
+from datetime import datetime
+import time
+import numpy as np
+import pytest
+
+
+def test_round_trip():
+    dt = datetime(2013, 8, 26, 1, 2, 3, 4)
+    us = datetime_to_epoch_us(dt)
+    assert us == 1377478923000004
+    assert epoch_us_to_datetime(us) == dt
+    assert as_epoch_us(dt) == us
+    assert as_epoch_us(np.int64(us)) == us
+    assert np.array_equal(to_epoch_us([dt, us]), [us, us])
+
+
+def test_format():
+    times = [datetime(2013, 8, 26, 1), datetime(2013, 8, 26, 1, 2, 3, 500),
+        datetime(1969, 12, 31, 23, 59, 59, 1)]
+    assert format_epoch_us(to_epoch_us(times)) == \
+        [t.isoformat() for t in times]
+    assert format_epoch_us(to_epoch_us(times), sep=' ') == \
+        [str(t) for t in times]
+    assert format_epoch_us([]) == []
+
+
+@pytest.mark.skipif(not hasattr(time, 'tzset'), reason='needs time.tzset')
+def test_now_is_utc(monkeypatch):
+    # The local time zone must not move the current time
+    monkeypatch.setenv('TZ', 'EST+05')
+    time.tzset()
+    try:
+        utc_now = datetime_to_epoch_us(datetime.utcnow())
+        assert abs(now_epoch_us() - utc_now) < 10**6
+    finally:
+        monkeypatch.undo()
+        time.tzset()
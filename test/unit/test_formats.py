@@ -0,0 +1,49 @@
+from ln.formats import encode_npz, encode_npy, encode_columns, \
+    decode_columns
+from io import BytesIO
+import pytest
+import numpy as np
+
+
+@pytest.fixture
+def columns():
+    return [
+        ('times', np.array([10, 20, 30], dtype=np.int64)),
+        ('values_0', np.arange(6, dtype=np.float32).reshape(3, 2)),
+        ('valid_0', np.array([True, False, True])),
+    ]
+
+
+def test_columns_round_trip(columns):
+    decoded = decode_columns(encode_columns(columns))
+    assert [name for name, _ in decoded] == [name for name, _ in columns]
+    for (_, expected), (_, array) in zip(columns, decoded):
+        assert array.dtype == expected.dtype
+        assert np.array_equal(array, expected)
+
+    empty = decode_columns(encode_columns([('times',
+        np.zeros(0, dtype=np.int64))]))
+    assert empty[0][1].shape == (0,)
+
+    with pytest.raises(ValueError):
+        decode_columns(b'not columns')
+
+
+def test_npz(columns):
+    archive = np.load(BytesIO(encode_npz(columns)))
+    for name, expected in columns:
+        assert np.array_equal(archive[name], expected)
+
+
+def test_npy(columns):
+    records = np.load(BytesIO(encode_npy(columns)))
+    for name, expected in columns:
+        assert np.array_equal(records[name], expected)
+
+
+def test_blobs_rejected():
+    blobs = np.empty(1, dtype=object)
+    blobs[0] = b'abc'
+    for encode in [encode_npz, encode_npy, encode_columns]:
+        with pytest.raises(ValueError):
+            encode([('values', blobs)])
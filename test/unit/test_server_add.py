@@ -1,6 +1,6 @@
 import ln.server
 from ln.backend import get_backend
-from ln.backend.compat import get_total_seconds
+from ln.backend.timestamp import to_epoch_us, datetime_to_epoch_us
 from datetime import datetime, timedelta
 import pytest
 import numpy as np
@@ -122,6 +122,89 @@ def test_get_limit(app):
     assert [9] == response['values']
 
 
+def test_get_time_range(app):
+    b = ln.server.storage_backend
+    start = datetime(2015, 3, 1)
+    times = [start + timedelta(seconds=i) for i in range(10)]
+    b.add_data_many('int', times, np.arange(10))
+
+    response, code = get_json_and_status(app.get('/data/int?first=%s'
+        '&last=%s&limit=2' % (times[3].isoformat(), times[7].isoformat())))
+    assert code == 200
+    assert [t.isoformat() for t in times[3:5]] == response['times']
+    assert [3, 4] == response['values']
+    assert response['resume'] == 5
+
+    response, code = get_json_and_status(app.get('/data/int?first=blah'))
+    assert code == 400
+
+
+def test_get_pages(app, monkeypatch):
+    monkeypatch.setattr('ln.server.DATA_PAGE_POINTS', 3)
+    b = ln.server.storage_backend
+    start = datetime(2015, 3, 1)
+    times = [start + timedelta(seconds=i) for i in range(10)]
+    b.add_data_many('int', times, np.arange(10))
+
+    # Streamed from several pages of the backend
+    response, code = get_json_and_status(app.get('/data/int?offset=0'))
+    assert code == 200
+    assert [t.isoformat() for t in times] == response['times']
+    assert list(range(10)) == response['values']
+    assert 'resume' not in response
+
+    response, code = get_json_and_status(app.get('/data/int?offset=1'
+        '&limit=7&last=%s' % times[9].isoformat()))
+    assert [t.isoformat() for t in times[1:8]] == response['times']
+    assert list(range(1, 8)) == response['values']
+    assert response['resume'] == 8
+
+    response, code = get_json_and_status(app.get('/data/int?first=%s'
+        % (start + timedelta(days=1)).isoformat()))
+    assert code == 200
+    assert response == dict(times=[], values=[])
+
+
+def test_get_binary(app, monkeypatch):
+    from ln.formats import decode_columns
+
+    b = ln.server.storage_backend
+    start = datetime(2015, 3, 1)
+    times = [start + timedelta(seconds=i) for i in range(10)]
+    b.add_data_many('int', times, np.arange(10))
+
+    response = app.get('/data/int?offset=2&limit=5',
+        headers={'Accept': 'application/x-ln-columns'})
+    assert response.status_code == 200
+    columns = dict(decode_columns(response.get_data()))
+    assert np.array_equal(columns['times'], to_epoch_us(times[2:7]))
+    assert columns['values'].tolist() == [2, 3, 4, 5, 6]
+    assert response.headers['X-Resume'] == '7'
+
+    response = app.get('/data/int?offset=0',
+        headers={'Accept': 'application/x-npy'})
+    records = np.load(BytesIO(response.get_data()))
+    assert records['values'].tolist() == list(range(10))
+    assert 'X-Resume' not in response.headers
+
+    # Binary responses stop after one page
+    monkeypatch.setattr('ln.server.DATA_PAGE_POINTS', 4)
+    response = app.get('/data/int?offset=2',
+        headers={'Accept': 'application/x-ln-columns'})
+    columns = dict(decode_columns(response.get_data()))
+    assert columns['values'].tolist() == [2, 3, 4, 5]
+    assert response.headers['X-Resume'] == '6'
+
+    b.add_data('blob', datetime.now(), b'abc')
+    response = app.get('/data/blob?offset=0',
+        headers={'Accept': 'application/x-npz'})
+    assert response.status_code == 406
+
+    response = app.get('/data/noexist?offset=0',
+        headers={'Accept': 'application/x-npz'})
+    assert response.status_code == 404
+
+
 def test_get_id_no_series(app):
     # This config does not exist
     res = app.get('/data/noexist/1')
@@ -147,7 +230,7 @@ def test_add_int(app):
         assert response['url'] == '/data/int/%d' % i
 
     db_times, db_values, next_seq = b.get_data('int', 0)
-    assert times == db_times
+    assert np.array_equal(to_epoch_us(times), db_times)
     assert list(range(10)) == db_values
     assert next_seq is None
 
@@ -168,7 +251,7 @@ def test_add_float(app):
         assert response['url'] == '/data/float/%d' % i
 
     db_times, db_values, next_seq = b.get_data('float', 0)
-    assert times == db_times
+    assert np.array_equal(to_epoch_us(times), db_times)
     assert [i + 0.5 for i in range(10)] == db_values
     assert next_seq is None
 
@@ -188,7 +271,7 @@ def test_add_array(app):
         assert response['url'] == '/data/array/%d' % i
 
     db_times, db_values, next_seq = b.get_data('array', 0)
-    assert times == db_times
+    assert np.array_equal(to_epoch_us(times), db_times)
     assert np.array_equal(np.array(values), np.array(db_values))
     assert next_seq is None
 
@@ -223,7 +306,7 @@ def test_add_blob(app):
     assert response.mimetype == 'text/plain'
 
     db_times, db_values, next_seq = b.get_data('blob', 0)
-    assert times == db_times
+    assert np.array_equal(to_epoch_us(times), db_times)
     assert np.array_equal(range(10), [b.index for b in db_values])  # Index numbers
     assert next_seq is None
 
@@ -250,12 +333,113 @@ def test_add_bad_type(app):
 
 def test_add_now(app):
     b = ln.server.storage_backend
-    now = datetime.now()
+    now = datetime.utcnow()
     data = dict(value=1)
     response, code = get_json_and_status(app.post('/data/int', data=data))
     assert code == 200
     assert response['index'] == 0
 
     db_times, db_values, next_seq = b.get_data('int', 0)
-    assert get_total_seconds(db_times[0] - now) < 0.1
+    assert abs(db_times[0] - datetime_to_epoch_us(now)) < 0.1 * 10**6
     assert db_values[0] == 1
+
+
+def test_add_batch(app):
+    b = ln.server.storage_backend
+    start = datetime(2013, 8, 26)
+    times = [start + timedelta(seconds=i) for i in range(5)]
+
+    batch = dict(times=[t.isoformat() for t in times[:3]], values=[0, 1, 2])
+    response, code = get_json_and_status(app.post('/data/int/batch',
+        data=json.dumps(batch), content_type='application/json'))
+    assert code == 200
+    assert response == dict(index=0, count=3)
+
+    batch = dict(times=[t.isoformat() for t in times[3:]], values=[3, 4])
+    response, code = get_json_and_status(app.post('/data/int/batch',
+        data=json.dumps(batch), content_type='application/json'))
+    assert code == 200
+    assert response == dict(index=3, count=2)
+
+    db_times, db_values, next_seq = b.get_data('int', 0)
+    assert np.array_equal(to_epoch_us(times), db_times)
+    assert list(range(5)) == db_values
+
+
+def test_add_batch_errors(app):
+    now = datetime.now()
+    batch = dict(times=[now.isoformat()], values=[1])
+    response = app.post('/data/doesnotexist/batch', data=json.dumps(batch))
+    assert response.status_code == 404
+
+    batch = dict(times=[now.isoformat(),
+        (now - timedelta(hours=1)).isoformat()], values=[1, 2])
+    response, code = get_json_and_status(app.post('/data/int/batch',
+        data=json.dumps(batch)))
+    assert code == 400
+    assert response['type'] == 'time_order'
+
+    batch = dict(times=[now.isoformat()], values=[[1, 2]])
+    response, code = get_json_and_status(app.post('/data/int/batch',
+        data=json.dumps(batch)))
+    assert code == 400
+    assert response['type'] == 'bad_type'
+
+    response, code = get_json_and_status(app.post('/data/int/batch',
+        data='not json'))
+    assert code == 400
+    assert response['type'] == 'bad_request'
+
+
+def test_add_multi(app):
+    b = ln.server.storage_backend
+    start = datetime(2013, 8, 26)
+    t0 = start.isoformat()
+    t1 = (start + timedelta(seconds=1)).isoformat()
+    body = {
+        'int': [[t0, 1], [t1, 2]],
+        'float': [[t0, 0.5]],
+        'array': [[t0, [1, 2]]],  # Wrong shape
+        'doesnotexist': [[t0, 1]],
+    }
+    response, code = get_json_and_status(app.post('/data',
+        data=json.dumps(body), content_type='application/json'))
+    assert code == 200
+    results = response['results']
+    assert results['int'] == dict(index=0, count=2)
+    assert results['float'] == dict(index=0, count=1)
+    assert results['array']['type'] == 'bad_type'
+    assert results['doesnotexist']['type'] == 'not_found'
+
+    assert b.get_data('int', 0)[1] == [1, 2]
+    times, values, resume = b.get_data('float', 0)
+    assert (list(times), values, resume) == \
+        ([datetime_to_epoch_us(start)], [0.5], None)
+    times, values, resume = b.get_data('array', 0)
+    assert (list(times), values, resume) == ([], [], None)
+
+
+def test_parse_times():
+    expected = to_epoch_us([datetime(2013, 8, 26, 1, 2, 3),
+        datetime(2013, 8, 26, 1, 2, 3, 500000)])
+    assert np.array_equal(ln.server.parse_times(['2013-08-26 01:02:03',
+        '2013-08-26T01:02:03.5']), expected)
+    # Falls back to dateutil for formats NumPy does not parse
+    assert np.array_equal(ln.server.parse_times(['Aug 26 2013 1:02:03',
+        '2013-08-26T03:02:03+02:00']), expected[:1].repeat(2))
+
+    # Only timestamps the single point endpoint accepts
+    for time_string in ['NaT', '', 'now', 'today']:
+        with pytest.raises(ValueError):
+            ln.server.parse_times(['2013-08-26', time_string])
+    assert ln.server.parse_times(['2013-08-26T00:00:00Z']) == \
+        to_epoch_us([datetime(2013, 8, 26)])
+
+
+def test_add_batch_nat(app):
+    data = json.dumps(dict(times=['NaT'], values=[1]))
+    response, code = get_json_and_status(app.post('/data/int/batch',
+        data=data))
+    assert code == 400
+    assert response['type'] == 'bad_request'
+    assert ln.server.storage_backend.get_data('int', 0)[1] == []
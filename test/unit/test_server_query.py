@@ -56,6 +56,40 @@ def test_query_basic(app):
     assert np.array_equal(values, [[1, 34, 2, 6, 0, 0]])
 
 
+def test_query_binary(app):
+    from ln.formats import decode_columns
+    from io import BytesIO
+
+    first = datetime(2013, 8, 26, 0, 0, 0)
+    last = datetime(2013, 8, 26, 11, 0, 0)
+    url = '/query?selector=int&selector=int:sum:none&first=%s&last=%s' \
+        '&npoints=12' % (first.isoformat(), last.isoformat())
+    expected = json.loads(app.get(url).get_data(as_text=True))
+
+    response = app.get(url, headers={'Accept': 'application/x-ln-columns'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ln-columns'
+    columns = dict(decode_columns(response.get_data()))
+    assert columns['times'].dtype == np.int64
+    assert [t.isoformat() for t in
+        columns['times'].astype('datetime64[us]').tolist()] \
+        == expected['times']
+    assert columns['values_0'].tolist() == expected['values'][0]
+    assert columns['valid_0'].all()
+    assert [v if ok else None for v, ok in zip(columns['values_1'].tolist(),
+        columns['valid_1'])] == expected['values'][1]
+
+    response = app.get(url, headers={'Accept': 'application/json;q=0.5, '
+        'application/x-npz'})
+    assert response.mimetype == 'application/x-npz'
+    archive = np.load(BytesIO(response.get_data()))
+    assert archive['values_0'].tolist() == expected['values'][0]
+
+    # JSON remains the default
+    response = app.get(url, headers={'Accept': '*/*'})
+    assert response.mimetype == 'application/json'
+
+
 def test_query_fail_missing_field(app):
     result = app.get('/query?selector=int&first=foo&last=bar')
     assert result.status_code == 400
@@ -90,24 +124,42 @@ def test_query_continuous(app):
     else:
         delta_t = timedelta(milliseconds=100)
 
-    first = datetime.now() - delta_t
+    first = datetime.utcnow() - delta_t
 
     times, values, gen = backend.query_continuous(['int'], first, 2)
     response = app.get('/query?selector=int&first=%s&npoints=2'
-        % (first.isoformat(),))
+        % (first.isoformat(),), buffered=False)
     assert response.status_code == 200
+    messages = (chunk.decode('utf-8')[len('data: '):]
+        for chunk in response.response)
 
-    # Quick! Populate backend directly with some data
-    for i in range(2, 6):
-        backend.add_data('int', first + i * delta_t, i)
-
-    messages = response.get_data(as_text=True).split('data: ')[1:]
-    initial = json.loads(messages[0])
+    initial = json.loads(next(messages))
     assert len(initial['times']) == 2
     assert initial['values'] == [[0, 0]]
 
+    # Quick! Populate backend directly with some data, at the centers of
+    # the bins, which are aligned to the shared tick grid
+    bin_centers = ln.server.parse_times(initial['times'])
+    bin_width = int(bin_centers[1] - bin_centers[0])
+    for i in range(2, 6):
+        backend.add_data('int', int(bin_centers[0]) + i * bin_width, i)
+
     for i in range(2, 6):
-        message = json.loads(messages[i - 1])
+        message = json.loads(next(messages))
         assert len(message['times']) == 1
         assert len(message['values']) == 1
         assert message['values'][0][0] == i
+    response.close()
+
+
+def test_query_continuous_closed(app):
+    scheduler = ln.server.storage_backend._scheduler
+    first = datetime.utcnow() - timedelta(seconds=1)
+    response = app.get('/query?selector=int&first=%s&npoints=2'
+        % first.isoformat(), buffered=False)
+    assert response.status_code == 200
+    assert len(scheduler._groups) == 1
+
+    # The client goes away before any message is sent
+    response.close()
+    assert len(scheduler._groups) == 0
@@ -6,7 +6,7 @@ import base64
 from datetime import datetime
 
 from ln.backend.sql import SQLBackend
-from ln.util import export_json
+from ln.util import export_json, export_json_files
 import ln
 
 try:  # Python 2
@@ -168,3 +168,38 @@ def test_export_blob(backend):
     ]
     assert contents == expected
 
+
+
+def test_export_pages(backend):
+    times = [datetime(2012, 1, 15, 1, 0, i) for i in range(5)]
+    backend.add_data_many('float', times, [1.0, 2.0, 3.0, 4.0, 5.0])
+    for time in times[:3]:
+        backend.add_data('blob', time, b'abc')
+
+    out_file = StringIO()
+    export_json(backend, out_file)
+    paged_file = StringIO()
+    export_json(backend, paged_file, page_size=2)
+    assert json.loads(paged_file.getvalue()) == \
+        json.loads(out_file.getvalue())
+
+    contents = json.loads(paged_file.getvalue())
+    assert [p[1] for p in contents['series'][0]['points']] == \
+        [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_export_files(backend, tmpdir):
+    backend.add_data('float', datetime(2012, 1, 15, 1, 0, 0), 1.0)
+
+    paths = export_json_files(backend, str(tmpdir), workers=2, page_size=1)
+    assert len(paths) == 3
+
+    expected = basic_contents()
+    for path, series in zip(sorted(paths), sorted(expected['series'],
+            key=lambda s: s['config']['name'])):
+        assert path == str(tmpdir.join(series['config']['name'] + '.json'))
+        with open(path) as f:
+            contents = json.load(f)
+        if series['config']['name'] == 'float':
+            series['points'] = [['2012-01-15 01:00:00', 1.0]]
+        assert contents == {'version': ln.__version__, 'series': [series]}
@@ -0,0 +1,87 @@
+from __future__ import unicode_literals
+
+import pytest
+import json
+from datetime import datetime, timedelta
+import numpy as np
+
+from ln.backend.memory import MemoryBackend
+from ln.backend.sql import SQLBackend
+from ln.util import export_json, import_json, JSONStreamReader
+
+try:  # Python 2
+    from StringIO import StringIO
+except ImportError:  # Python 3
+    from io import StringIO
+
+
+@pytest.fixture
+def backend():
+    b = SQLBackend('sqlite://')
+    b.create_series(name='float', type='float32', reduction='mean',
+        interpolation='linear', description='Float counter', unit='m',
+        metadata='blah')
+    b.create_series(name='array', type='int16[2]', reduction='mean',
+        interpolation='linear', description='Array', unit='cm',
+        metadata='test')
+    b.create_series(name='blob', type='blob:text/plain', reduction='closest',
+        interpolation='none', description='BLOB', unit='', metadata='image')
+
+    start = datetime(2012, 1, 15)
+    times = [start + timedelta(seconds=1.5 * i) for i in range(25)]
+    b.add_data_many('float', times, np.arange(25) / 4.0)
+    b.add_data_many('array', times[:5], [[i, -i] for i in range(5)])
+    b.add_data('blob', start, b'\x00\x01\xff')
+    return b
+
+
+def test_stream_reader():
+    reader = JSONStreamReader(StringIO(' {"a": [1, 22.5, "x"], '
+        '"b": {}, "c": [] } '), chunk_size=3)
+    items = []
+    for key in reader.iter_object():
+        if key == 'a':
+            for _ in reader.iter_array():
+                items.append(reader.value())
+        elif key == 'b':
+            assert list(reader.iter_object()) == []
+        else:
+            assert list(reader.iter_array()) == []
+    assert items == [1, 22.5, 'x']
+    assert reader.peek() == ''
+
+    with pytest.raises(ValueError):
+        list(JSONStreamReader(StringIO('[1 2]')).iter_array())
+
+
+def test_import_round_trip(backend, monkeypatch):
+    # Small reads split values across chunks
+    monkeypatch.setattr('ln.util.IMPORT_CHUNK_CHARS', 7)
+    exported = StringIO()
+    export_json(backend, exported)
+
+    imported = MemoryBackend()
+    names = import_json(imported, StringIO(exported.getvalue()),
+        batch_size=4)
+    assert names == ['float', 'array', 'blob']
+    for name in names:
+        assert imported.get_config(name) == backend.get_config(name)
+
+    reexported = StringIO()
+    export_json(imported, reexported)
+    assert json.loads(reexported.getvalue()) == \
+        json.loads(exported.getvalue())
+
+
+def test_import_points_before_config():
+    # Keys may come in any order
+    config = dict(name='float', type='float32', reduction='mean',
+        interpolation='linear', description='', unit='', metadata='')
+    points = [['2012-01-15 01:00:00', 1.0], ['2012-01-15 01:00:01', 2.0]]
+    exported = '{"series": [{"points": %s, "config": %s}], "version": "0.1"}' \
+        % (json.dumps(points), json.dumps(config))
+
+    b = MemoryBackend()
+    assert import_json(b, StringIO(exported), batch_size=1) == ['float']
+    times, values, _ = b.get_data('float', 0)
+    assert values == [1.0, 2.0]